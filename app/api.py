@@ -2,13 +2,15 @@
 FastAPI路由和接口
 """
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Body, Cookie, Depends
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from jinja2 import Template
 import os
 from typing import Optional, Dict, List, Any
 import json
 import asyncio
+import uuid
 from datetime import datetime
 from pydantic import BaseModel
 import pandas as pd
@@ -17,20 +19,108 @@ from app.database import Database
 from app.config import Config
 from app.statistics import Statistics
 from app.data_updater import DataUpdater
-from app.data_fetcher import DataFetcher
 from app.auth import AuthManager
+from app.return_panel import ReturnPanel
+from app.cache import ResultCache
+from app.parallel import ParallelAggregator
+from app.kline_store import PYARROW_AVAILABLE, get_kline_store
 
 app = FastAPI(title="StockInsight - 股票洞察分析系统")
 
 # 初始化
 db = Database()
 config = Config()
-statistics = Statistics(db)
+# 月K线历史读取：sqlite（默认）或 parquet（按数据源、年份分区的列式文件，需要安装 pyarrow）
+if config.get('kline_store', 'sqlite') == 'parquet':
+    if PYARROW_AVAILABLE:
+        db.use_kline_store(get_kline_store(db.db_path))
+    else:
+        print("未安装 pyarrow，月K线列式存储未启用，继续从数据库读取")
+# 统计后端：sqlite（默认，查询汇总表）或 panel（内存收益面板）
+return_panel = ReturnPanel(db) if config.get('analytics_backend', 'sqlite') == 'panel' else None
+# 全市场统计的并行进程数（0或1表示不启用多进程）
+analytics_workers = int(config.get('analytics_workers', 0))
+parallel_aggregator = ParallelAggregator(db, analytics_workers) if analytics_workers > 1 else None
+statistics = Statistics(db, panel=return_panel, parallel=parallel_aggregator, config=config)
 updater = DataUpdater(db, config)
+# 配置变化（包括直接修改config.json）时，下次更新开始时切换数据源
+config.subscribe(updater.on_config_change)
 auth = AuthManager(db)
+# 统计结果缓存（按数据版本失效，容量单位MB）
+result_cache = ResultCache(max_bytes=int(config.get('result_cache_mb', 64)) * 1024 * 1024)
+
+def clear_result_cache_on_source_switch(old_config: Dict, new_config: Dict):
+    """切换默认数据源后，原数据源的统计结果很少再被请求，直接清空缓存释放内存"""
+    if old_config.get('data_source') != new_config.get('data_source'):
+        result_cache.clear()
+
+config.subscribe(clear_result_cache_on_source_switch)
 
-# 定期清理过期会话
 import threading
+
+def rebuild_return_panel():
+    """重建收益面板并发布新版本，其他worker随后自动切换（未启用面板后端时不做任何事）"""
+    if return_panel is None:
+        return
+    try:
+        return_panel.rebuild()
+    except Exception as e:
+        print(f"收益面板加载失败，统计将继续使用数据库: {e}")
+
+def load_return_panel():
+    """启动时加载收益面板：优先映射已发布的面板文件（多worker共享），没有时再构建"""
+    if return_panel is None:
+        return
+    try:
+        return_panel.load_or_rebuild()
+    except Exception as e:
+        print(f"收益面板加载失败，统计将继续使用数据库: {e}")
+
+def prepare_kline_store():
+    """启动时准备月K线列式存储：首次启用时从数据库全量导出，之前未完成的同步在此补做"""
+    store = db.kline_store
+    if store is None:
+        return
+    try:
+        if store.is_ready:
+            store.sync(db)
+        else:
+            store.rebuild(db)
+    except Exception as e:
+        print(f"月K线列式存储准备失败，将继续从数据库读取: {e}")
+
+def load_storage():
+    """先准备列式存储（面板可从中读取），再加载收益面板"""
+    prepare_kline_store()
+    load_return_panel()
+
+# 启动时在后台准备列式存储和面板，完成前读取和统计请求使用数据库
+threading.Thread(target=load_storage, daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_parallel_aggregator():
+    """关闭统计进程池"""
+    if parallel_aggregator is not None:
+        parallel_aggregator.shutdown()
+
+def _cached_body(endpoint: str, params: Dict, data_source: str, compute) -> bytes:
+    key = result_cache.make_key(endpoint, params, data_source, statistics.data_version())
+    body = result_cache.get(key)
+    if body is None:
+        body = json.dumps(compute(), ensure_ascii=False).encode('utf-8')
+        result_cache.set(key, body)
+    return body
+
+async def cached_json(endpoint: str, params: Dict, data_source: str, compute) -> Response:
+    """
+    返回统计结果：命中缓存时直接返回序列化好的响应，否则调用compute计算并缓存
+    
+    计算在线程池中执行，避免阻塞事件循环（其他请求在计算期间仍可响应）
+    """
+    body = await run_in_threadpool(_cached_body, endpoint, params, data_source, compute)
+    return Response(content=body, media_type="application/json")
+
+# 定期清理过期会话
 def cleanup_sessions_periodically():
     while True:
         import time
@@ -40,24 +130,29 @@ def cleanup_sessions_periodically():
 cleanup_thread = threading.Thread(target=cleanup_sessions_periodically, daemon=True)
 cleanup_thread.start()
 
-# 进度状态（用于实时返回更新进度）
-update_progress = {
-    'current': 0,
-    'total': 100,
-    'message': '',
-    'is_running': False
-}
+# 数据更新的锁和进度记录在数据库中（update_progress 表），任一 worker 都能查询进度、阻止重复更新；
+# 更新线程的进度先记在内存中，由后台线程定期写入数据库（同时作为心跳，见 Database.UPDATE_STALE_SECONDS）
+PROGRESS_WRITE_INTERVAL = 1.0
+PROGRESS_HEARTBEAT_INTERVAL = 60.0
 
 # 静态文件
 if os.path.exists("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-def progress_callback(current: int, total: int, message: str = ""):
-    """进度回调函数"""
-    update_progress['current'] = current
-    update_progress['total'] = total
-    update_progress['message'] = message
+def report_update_progress(owner: str, progress: Dict, stop: threading.Event):
+    """把更新线程的最新进度写入数据库：变化时每秒最多写一次，没有变化时定期刷新心跳"""
+    import time
+    written, written_at = None, time.monotonic()
+    while not stop.wait(PROGRESS_WRITE_INTERVAL):
+        state = (progress['current'], progress['total'], progress['message'])
+        if state == written and time.monotonic() - written_at < PROGRESS_HEARTBEAT_INTERVAL:
+            continue
+        try:
+            db.set_update_progress(owner, *state)
+            written, written_at = state, time.monotonic()
+        except Exception as e:
+            print(f"[数据更新] 写入进度失败: {e}")
 
 
 # ========== 认证相关API ==========
@@ -314,9 +409,8 @@ async def index(request: Request):
 async def get_stocks():
     """获取股票列表"""
     try:
-        stocks_df = db.get_stocks(exclude_delisted=True)
-        stocks = stocks_df.to_dict('records')
-        return {"success": True, "data": stocks}
+        # 股票目录中已缓存序列化好的响应
+        return Response(content=db.stock_directory().listed_json, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -384,14 +478,17 @@ async def get_stock_statistics(data: Dict = Body(...), session_id: Optional[str]
         requested_data_source = data.get('data_source')
         current_data_source = requested_data_source if requested_data_source else config.get('data_source', 'akshare')
         
-        result = statistics.calculate_stock_month_statistics(
-            stock['ts_code'], month, start_year, end_year, data_source=current_data_source
-        )
-        result['symbol'] = stock.get('symbol', code)
-        result['name'] = stock.get('name', '')
-        result['data_source'] = current_data_source
+        def compute():
+            result = statistics.calculate_stock_month_statistics(
+                stock['ts_code'], month, start_year, end_year, data_source=current_data_source
+            )
+            result['symbol'] = stock.get('symbol', code)
+            result['name'] = stock.get('name', '')
+            result['data_source'] = current_data_source
+            return {"success": True, "data": result}
         
-        return {"success": True, "data": result}
+        params = {'ts_code': stock['ts_code'], 'month': month, 'start_year': start_year, 'end_year': end_year}
+        return await cached_json('stock_statistics', params, current_data_source, compute)
     except ValueError as e:
         return {"success": False, "message": f"参数错误: {str(e)}"}
     except Exception as e:
@@ -439,23 +536,26 @@ async def get_stock_multi_month_statistics(data: Dict = Body(...), session_id: O
         requested_data_source = data.get('data_source')
         current_data_source = requested_data_source if requested_data_source else config.get('data_source', 'akshare')
         
-        # 计算每个月份的统计
-        results = []
-        for month in months:
-            stat = statistics.calculate_stock_month_statistics(
-                stock['ts_code'], month, start_year, end_year, data_source=current_data_source
-            )
-            if stat['total_count'] > 0:  # 只包含有数据的月份
-                stat['month'] = month
-                stat['symbol'] = stock.get('symbol', code)
-                stat['name'] = stock.get('name', '')
-                stat['data_source'] = current_data_source
-                results.append(stat)
-        
-        # 按月份排序
-        results.sort(key=lambda x: x['month'])
+        months = sorted(set(int(month) for month in months))
         
-        return {"success": True, "data": results}
+        def compute():
+            # 一次读取该股票全部月份的统计
+            profile = statistics.calculate_stock_profile(
+                stock['ts_code'], start_year, end_year, data_source=current_data_source
+            )
+            results = []
+            for stat in profile['monthly']:
+                if stat['month'] in months and stat['total_count'] > 0:  # 只包含有数据的月份
+                    stat['symbol'] = stock.get('symbol', code)
+                    stat['name'] = stock.get('name', '')
+                    stat['data_source'] = current_data_source
+                    results.append(stat)
+            
+            # data按月份排序；matrix为年份×月份涨跌幅矩阵（用于热力图）
+            return {"success": True, "data": results, "matrix": profile['matrix']}
+        
+        params = {'ts_code': stock['ts_code'], 'months': months, 'start_year': start_year, 'end_year': end_year}
+        return await cached_json('stock_multi_month_statistics', params, current_data_source, compute)
     except ValueError as e:
         return {"success": False, "message": f"参数错误: {str(e)}"}
     except Exception as e:
@@ -485,15 +585,20 @@ async def get_month_filter_statistics(data: Dict = Body(...), session_id: Option
         requested_data_source = data.get('data_source')
         current_data_source = requested_data_source if requested_data_source else config.get('data_source', 'akshare')
         
-        results = statistics.calculate_month_filter_statistics(
-            month, start_year, end_year, top_n, data_source=current_data_source, min_count=min_count
-        )
-        
-        # 为每个结果添加数据源信息
-        for result in results:
-            result['data_source'] = current_data_source
-        
-        return {"success": True, "data": results, "data_source": current_data_source}
+        def compute():
+            results = statistics.calculate_month_filter_statistics(
+                month, start_year, end_year, top_n, data_source=current_data_source, min_count=min_count
+            )
+            
+            # 为每个结果添加数据源信息
+            for result in results:
+                result['data_source'] = current_data_source
+            
+            return {"success": True, "data": results, "data_source": current_data_source}
+        
+        params = {'month': month, 'start_year': start_year, 'end_year': end_year,
+                  'top_n': top_n, 'min_count': min_count}
+        return await cached_json('month_filter', params, current_data_source, compute)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -512,15 +617,19 @@ async def get_industry_statistics(data: Dict = Body(...), session_id: Optional[s
         requested_data_source = data.get('data_source')
         current_data_source = requested_data_source if requested_data_source else config.get('data_source', 'akshare')
         
-        results = statistics.calculate_industry_statistics(
-            month, start_year, end_year, industry_type, data_source=current_data_source
-        )
-        
-        # 为每个结果添加数据源信息
-        for result in results:
-            result['data_source'] = current_data_source
-        
-        return {"success": True, "data": results, "data_source": current_data_source}
+        def compute():
+            results = statistics.calculate_industry_statistics(
+                month, start_year, end_year, industry_type, data_source=current_data_source
+            )
+            
+            # 为每个结果添加数据源信息
+            for result in results:
+                result['data_source'] = current_data_source
+            
+            return {"success": True, "data": results, "data_source": current_data_source}
+        
+        params = {'month': month, 'start_year': start_year, 'end_year': end_year, 'industry_type': industry_type}
+        return await cached_json('industry_statistics', params, current_data_source, compute)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -544,15 +653,20 @@ async def get_industry_top_stocks(data: Dict = Body(...), session_id: Optional[s
         requested_data_source = data.get('data_source')
         current_data_source = requested_data_source if requested_data_source else config.get('data_source', 'akshare')
         
-        results = statistics.calculate_industry_top_stocks(
-            industry_name, month, start_year, end_year, industry_type, top_n, data_source=current_data_source
-        )
-        
-        # 为每个结果添加数据源信息
-        for result in results:
-            result['data_source'] = current_data_source
-        
-        return {"success": True, "data": results, "data_source": current_data_source}
+        def compute():
+            results = statistics.calculate_industry_top_stocks(
+                industry_name, month, start_year, end_year, industry_type, top_n, data_source=current_data_source
+            )
+            
+            # 为每个结果添加数据源信息
+            for result in results:
+                result['data_source'] = current_data_source
+            
+            return {"success": True, "data": results, "data_source": current_data_source}
+        
+        params = {'industry_name': industry_name, 'month': month, 'start_year': start_year,
+                  'end_year': end_year, 'industry_type': industry_type, 'top_n': top_n}
+        return await cached_json('industry_top_stocks', params, current_data_source, compute)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -575,7 +689,9 @@ async def update_data(background_tasks: BackgroundTasks, data: Dict = Body(defau
     try:
         update_type = data.get('update_type', 'incremental')
         
-        if update_progress['is_running']:
+        # 在数据库写事务中获取更新锁：其他 worker 上已有更新在运行时直接返回
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        if not await run_in_threadpool(db.try_begin_update, owner, '准备更新...'):
             # 如果更新正在进行，返回特殊状态，让前端显示进度
             return {
                 "success": True, 
@@ -583,41 +699,47 @@ async def update_data(background_tasks: BackgroundTasks, data: Dict = Body(defau
                 "already_running": True
             }
         
-        update_progress['is_running'] = True
-        update_progress['current'] = 0
-        update_progress['total'] = 100
-        update_progress['message'] = '准备更新...'
-        
         def update_task():
+            progress = {'current': 0, 'total': 100, 'message': '准备更新...'}
+            
+            def progress_callback(current: int, total: int, message: str = ""):
+                progress.update(current=current, total=total, message=message)
+            
+            stop = threading.Event()
+            reporter = threading.Thread(target=report_update_progress, args=(owner, progress, stop), daemon=True)
+            reporter.start()
             try:
-                # 每次更新时重新创建DataUpdater，确保使用最新配置
+                # 共用的 updater 在更新开始时应用之前的配置变化（更新期间修改配置不影响本次更新）
                 current_data_source = config.get('data_source', 'tushare')
                 print(f"[数据更新] 当前使用的数据源: {current_data_source}")
-                current_updater = DataUpdater(db, config)
-                current_updater.set_progress_callback(progress_callback)
+                updater.set_progress_callback(progress_callback)
                 
                 if update_type == "full":
                     # 获取更新模式：overwrite（覆盖模式）或 supplement（补充模式，默认）
                     overwrite_mode = data.get('overwrite_mode', False)
                     print(f"[数据更新] 全量更新，模式: {'覆盖模式' if overwrite_mode else '补充模式'}")
-                    current_updater.update_all_data(overwrite_mode=overwrite_mode)
+                    updater.update_all_data(overwrite_mode=overwrite_mode)
                 else:
                     print(f"[数据更新] 增量更新")
-                    current_updater.update_incremental()
+                    updater.update_incremental()
             except Exception as e:
                 import traceback
                 error_detail = traceback.format_exc()
                 print(f"[数据更新] 更新失败: {error_detail}")
-                update_progress['message'] = f'更新失败: {str(e)}'
+                progress['message'] = f'更新失败: {str(e)}'
                 raise
             finally:
-                update_progress['is_running'] = False
+                stop.set()
+                reporter.join()
+                db.set_update_progress(owner, progress['current'], progress['total'], progress['message'],
+                                       finished=True)
+                # 数据更新结束后重建收益面板
+                rebuild_return_panel()
         
         background_tasks.add_task(update_task)
         
         return {"success": True, "message": "数据更新已开始"}
     except Exception as e:
-        update_progress['is_running'] = False
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -627,12 +749,7 @@ async def get_update_progress(session_id: Optional[str] = Cookie(None)):
     auth.require_permission(session_id, 'data_management')
     return {
         "success": True,
-        "data": {
-            "current": update_progress['current'],
-            "total": update_progress['total'],
-            "message": update_progress['message'],
-            "is_running": update_progress['is_running']
-        }
+        "data": db.get_update_progress()
     }
 
 
@@ -641,9 +758,9 @@ async def get_config(session_id: Optional[str] = Cookie(None)):
     """获取配置（仅管理员）"""
     auth.require_admin(session_id)
     try:
-        # 重新加载配置文件，确保返回最新的配置
-        config.config = config.load_config()
-        return {"success": True, "data": config.config}
+        # 检查配置文件是否被修改，确保返回最新的配置
+        config.reload()
+        return {"success": True, "data": config.to_dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -653,16 +770,16 @@ async def update_config(data: Dict = Body(...), session_id: Optional[str] = Cook
     """更新配置（仅管理员）"""
     auth.require_admin(session_id)
     try:
+        changes = {}
         for key, value in data.items():
             # 对于字符串类型的值，如果是空字符串，则跳过更新（保留原有值）
             # 但对于 data_source，空字符串也应该更新（因为可能是用户想重置）
             if isinstance(value, str) and value == '' and key != 'data_source':
                 continue
-            config.set(key, value)
+            changes[key] = value
         
-        # 重新初始化数据源（同时更新fetcher和data_source）
-        updater.fetcher = DataFetcher(config)
-        updater.data_source = config.get('data_source', 'akshare')
+        # 一次写入全部修改；数据源的重新初始化由 updater 的配置订阅完成
+        config.update(changes)
         
         return {"success": True, "message": "配置已更新"}
     except Exception as e:
@@ -718,17 +835,17 @@ async def get_data_status(session_id: Optional[str] = Cookie(None)):
     """获取数据状态（需要数据管理权限）"""
     auth.require_permission(session_id, 'data_management')
     try:
-        stocks_df = db.get_stocks(exclude_delisted=True)
-        total_stocks = len(stocks_df)
+        total_stocks = len(db.stock_directory().listed)
         
-        # 获取所有数据源的统计信息
+        # 获取所有数据源的统计信息（读取数据源汇总表）
         data_source_stats = db.get_data_source_statistics()
         
         # 计算总数据量（所有数据源的数据量之和）
         total_data_count = sum(source.get('data_count', 0) for source in data_source_stats)
         
         # 获取总体最新日期（所有数据源中的最新日期）
-        latest_date = db.get_latest_trade_date()
+        latest_date = max((source['latest_date'] for source in data_source_stats if source['latest_date']),
+                          default=None)
         
         return {
             "success": True,
@@ -736,7 +853,9 @@ async def get_data_status(session_id: Optional[str] = Cookie(None)):
                 "total_stocks": total_stocks,
                 "total_data_count": total_data_count,
                 "latest_date": latest_date,
-                "data_sources": data_source_stats
+                "data_sources": data_source_stats,
+                # 本 worker 的统计结果缓存使用情况（条数、字节数、命中次数）
+                "result_cache": result_cache.stats()
             }
         }
     except Exception as e:
@@ -866,15 +985,16 @@ async def export_multi_month_statistics(data: Dict = Body(...), session_id: Opti
         
         current_data_source = requested_data_source if requested_data_source else config.get('data_source', 'akshare')
         
-        # 计算每个月份的统计
+        # 一次读取该股票全部月份的统计
+        profile = statistics.calculate_stock_profile(
+            stock['ts_code'], start_year, end_year, data_source=current_data_source
+        )
+        months = set(int(month) for month in months)
         export_data = []
-        for month in months:
-            stat = statistics.calculate_stock_month_statistics(
-                stock['ts_code'], month, start_year, end_year, data_source=current_data_source
-            )
-            if stat['total_count'] > 0:
+        for stat in profile['monthly']:
+            if stat['month'] in months and stat['total_count'] > 0:
                 export_data.append({
-                    '月份': f"{month}月",
+                    '月份': f"{stat['month']}月",
                     '总次数': stat.get('total_count', 0),
                     '上涨次数': stat.get('up_count', 0),
                     '下跌次数': stat.get('down_count', 0),
@@ -0,0 +1,68 @@
+"""
+统计结果缓存
+
+缓存统计接口序列化后的响应内容（bytes），按总字节数做LRU淘汰。
+缓存键包含数据版本号，数据更新后版本号变化，旧结果自然失效并逐步被淘汰。
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(endpoint: str, params: Dict, data_source: str, data_version: str) -> str:
+        """由接口名、规范化后的参数、数据源和数据版本号生成缓存键"""
+        return json.dumps([endpoint, params, data_source, data_version],
+                          sort_keys=True, ensure_ascii=False, default=str)
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存（命中时移到最近使用位置）"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+    
+    def set(self, key: str, body: bytes):
+        """写入缓存，超出容量时淘汰最久未使用的结果"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+    
+    def clear(self):
+        """清空缓存（命中统计保留）"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+    
+    def stats(self) -> Dict:
+        """缓存使用情况"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
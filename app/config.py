@@ -3,17 +3,169 @@
 """
 import os
 import json
-from typing import Dict, Optional
+import threading
+import time
+import weakref
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def _freeze(value):
+    """转换为只读视图（字典为 MappingProxyType，列表为元组），共享的快照不会被某个调用方改动"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    """只读视图转换回可修改的字典和列表"""
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class _ConfigStore:
+    """
+    进程内共享的配置快照（每个配置文件一个）
+    
+    快照是递归只读的视图（见 _freeze），更新时生成新快照整体替换；
+    只有文件修改时间变化时才重新读取文件，批量修改一次性原子写入。
+    """
+    
+    # 检查配置文件修改时间的最小间隔（秒）
+    CHECK_INTERVAL = 1.0
+    
+    def __init__(self, config_file: str, loader: Callable[[], Dict]):
+        self.config_file = config_file
+        self._loader = loader
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._mtime = self._file_mtime()
+        self._snapshot = _freeze(loader())
+        self._last_check = time.monotonic()
+    
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+    
+    def snapshot(self, force_check: bool = False) -> Mapping:
+        """返回当前配置快照（配置文件被外部修改时自动重新加载）"""
+        now = time.monotonic()
+        if not force_check and now - self._last_check < self.CHECK_INTERVAL:
+            return self._snapshot
+        
+        with self._lock:
+            reloaded = self._reload_if_modified(now)
+            new = self._snapshot
+        # 通知订阅者时不持有锁，回调中读取或修改配置不会与其他线程互相等待
+        if reloaded is not None:
+            self._notify(*reloaded)
+        return new
+    
+    def _reload_if_modified(self, now: float) -> Optional[Tuple[Mapping, Mapping]]:
+        """配置文件修改时间变化时重新读取（需持有锁），返回 (旧配置, 新配置)，未变化时返回None"""
+        self._last_check = now
+        mtime = self._file_mtime()
+        if mtime == self._mtime:
+            return None
+        old = self._snapshot
+        self._mtime = mtime
+        self._snapshot = _freeze(self._loader())
+        return old, self._snapshot
+    
+    def update(self, changes: Dict[str, Any]) -> Mapping:
+        """批量修改配置（键支持点号分隔的多级路径），一次写入文件后通知订阅者"""
+        with self._lock:
+            # 先合并外部对配置文件的修改，再在其基础上修改
+            reloaded = self._reload_if_modified(time.monotonic())
+            old = self._snapshot
+            new = _thaw(old)
+            for key, value in changes.items():
+                keys = key.split('.')
+                target = new
+                for k in keys[:-1]:
+                    if not isinstance(target.get(k), dict):
+                        target[k] = {}
+                    target = target[k]
+                target[keys[-1]] = value
+            self._write(new)
+            self._snapshot = _freeze(new)
+            self._mtime = self._file_mtime()
+            new = self._snapshot
+        if reloaded is not None:
+            self._notify(*reloaded)
+        self._notify(old, new)
+        return new
+    
+    def _write(self, config: Dict):
+        """先写临时文件再替换，避免其他进程读到写了一半的配置"""
+        tmp_file = f"{self.config_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        try:
+            os.replace(tmp_file, self.config_file)
+        except OSError:
+            # 配置文件单独挂载（如Docker绑定挂载单个文件）时无法替换，退回直接覆盖写入
+            os.remove(tmp_file)
+            with open(self.config_file, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=2)
+    
+    def subscribe(self, callback: Callable[[Mapping, Mapping], None]):
+        """订阅配置变化，回调参数为 (旧配置, 新配置)（只读快照）；绑定方法只保存弱引用，对象销毁后自动取消"""
+        if hasattr(callback, '__self__'):
+            ref = weakref.WeakMethod(callback)
+        else:
+            ref = lambda: callback
+        with self._lock:
+            self._subscribers.append(ref)
+    
+    def _notify(self, old: Mapping, new: Mapping):
+        if old == new:
+            return
+        with self._lock:
+            self._subscribers = [ref for ref in self._subscribers if ref() is not None]
+            callbacks = [ref() for ref in self._subscribers]
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(old, new)
+            except Exception as e:
+                print(f"配置变更通知失败: {e}")
+
+
+_stores: Dict[str, _ConfigStore] = {}
+_stores_lock = threading.Lock()
 
 
 class Config:
     def __init__(self, config_file: str = None):
         # 支持环境变量指定配置文件路径（用于Docker部署）
         if config_file is None:
-            import os
             config_file = os.getenv("CONFIG_PATH", "config.json")
         self.config_file = config_file
-        self.config = self.load_config()
+        # 同一配置文件在进程内共享一份快照，创建Config对象不再读取文件
+        with _stores_lock:
+            key = os.path.abspath(config_file)
+            if key not in _stores:
+                _stores[key] = _ConfigStore(config_file, self.load_config)
+            self._store = _stores[key]
+    
+    @property
+    def config(self) -> Mapping:
+        """当前配置快照（递归只读：字典为 MappingProxyType，列表为元组；修改请使用 set/update）"""
+        return self._store.snapshot()
+    
+    def to_dict(self) -> Dict:
+        """当前配置的可修改副本（如用于序列化返回）"""
+        return _thaw(self._store.snapshot())
     
     def load_config(self) -> Dict:
         """加载配置"""
@@ -25,6 +177,10 @@ class Config:
                 pass
         return self.get_default_config()
     
+    def reload(self) -> Mapping:
+        """立即检查配置文件是否被修改，返回最新配置"""
+        return self._store.snapshot(force_check=True)
+    
     def get_default_config(self) -> Dict:
         """默认配置"""
         return {
@@ -37,20 +193,23 @@ class Config:
                 "api_key": ""
             },
             "akshare": {},
-            "update_frequency": "monthly"
+            "update_frequency": "monthly",
+            "analytics_backend": "sqlite",
+            "kline_store": "sqlite",
+            "result_cache_mb": 64,
+            "analytics_workers": 0
         }
     
     def save_config(self):
         """保存配置"""
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False, indent=2)
+        self._store.update({})
     
     def get(self, key: str, default=None):
         """获取配置值"""
         keys = key.split('.')
         value = self.config
         for k in keys:
-            if isinstance(value, dict) and k in value:
+            if isinstance(value, Mapping) and k in value:
                 value = value[k]
             else:
                 return default
@@ -58,17 +217,17 @@ class Config:
     
     def set(self, key: str, value):
         """设置配置值"""
-        keys = key.split('.')
-        config = self.config
-        for k in keys[:-1]:
-            if k not in config:
-                config[k] = {}
-            config = config[k]
-        config[keys[-1]] = value
-        self.save_config()
-    
-    def get_data_source_config(self) -> Dict:
+        self.update({key: value})
+    
+    def update(self, changes: Dict[str, Any]):
+        """批量设置配置值（一次写入文件）"""
+        self._store.update(changes)
+    
+    def subscribe(self, callback: Callable[[Mapping, Mapping], None]):
+        """订阅配置变化，回调参数为 (旧配置, 新配置)（只读快照）"""
+        self._store.subscribe(callback)
+    
+    def get_data_source_config(self) -> Mapping:
         """获取当前数据源配置"""
         data_source = self.get('data_source', 'tushare')
         return self.get(data_source, {})
-
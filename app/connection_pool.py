@@ -0,0 +1,221 @@
+"""
+SQLite连接池
+
+数据库运行在WAL模式：读连接与写连接互不阻塞。
+每个线程保持一个长期复用的读连接；所有写操作提交到唯一的写线程依次执行，
+写线程把排队中的多个写操作合并到同一个事务里提交（组提交），
+每个写操作各自使用一个SAVEPOINT，单个写操作失败只回滚它自己。
+连接长期存在，sqlite3 的语句缓存（cached_statements）在多次调用之间保持有效。
+需要附加（ATTACH）其他数据库文件时由 set_attachments 统一设置，各连接在下次使用前各自附加。
+"""
+import functools
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Dict, Sequence
+
+
+class PooledConnection(sqlite3.Connection):
+    """池化连接：close() 不真正关闭连接，只回滚未提交的事务，连接留给下次使用"""
+    
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+    
+    def close_physical(self):
+        """真正关闭底层连接"""
+        super().close()
+
+
+class WriterConnection(PooledConnection):
+    """
+    写线程使用的连接（手动事务模式）
+    
+    事务由写线程统一开始和提交：写方法中的 commit()/close() 不做任何事，
+    rollback() 只回滚当前写操作的SAVEPOINT。
+    """
+    
+    SAVEPOINT = 'write_job'
+    
+    def commit(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def rollback(self):
+        self.execute(f"ROLLBACK TO {self.SAVEPOINT}")
+
+
+class ConnectionPool:
+    # 每个连接缓存的预编译语句数量
+    CACHED_STATEMENTS = 256
+    # 等待锁的超时时间（毫秒）
+    BUSY_TIMEOUT_MS = 30000
+    # 每个连接的页缓存（负数表示KB）和内存映射大小
+    CACHE_SIZE_KB = 16384
+    MMAP_SIZE = 256 * 1024 * 1024
+    # 一次组提交最多合并的写操作数
+    MAX_GROUP_SIZE = 256
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # 数据库结构是否已初始化（同一进程内每个数据库文件只初始化一次）
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+        self._local = threading.local()
+        # 附加的数据库文件 {模式名: 路径}、附加后在每个连接上执行的语句，以及设置的版本号
+        self.attachments: Dict[str, str] = {}
+        self._attach_setup = []
+        self._attach_version = 0
+        self._attach_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer_started = threading.Event()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name=f"sqlite-writer:{db_path}",
+                                               daemon=True)
+        self._writer_thread.start()
+        self._writer_started.wait()
+    
+    def _connect(self, factory=PooledConnection, **kwargs) -> PooledConnection:
+        conn = sqlite3.connect(self.db_path, factory=factory, cached_statements=self.CACHED_STATEMENTS,
+                               timeout=self.BUSY_TIMEOUT_MS / 1000, **kwargs)
+        conn.execute(f"PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{self.CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {self.MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.attached = {}
+        conn.attach_version = 0
+        return conn
+    
+    def set_attachments(self, attachments: Dict[str, str], setup_sql: Sequence[str] = ()):
+        """
+        设置每个连接附加的数据库文件 {模式名: 路径} 和附加后在每个连接上执行的语句（如临时视图）
+        
+        读连接在下次取用时生效，写连接在下一次组提交开始前生效（ATTACH 不能在事务中执行）
+        """
+        with self._attach_lock:
+            self.attachments = {schema: os.path.abspath(path) for schema, path in attachments.items()}
+            self._attach_setup = list(setup_sql)
+            self._attach_version += 1
+    
+    def _apply_attachments(self, conn: PooledConnection):
+        """按当前设置附加或解除附加数据库文件（连接处于事务中时留到下次）"""
+        if conn.attach_version == self._attach_version or conn.in_transaction:
+            return
+        with self._attach_lock:
+            attachments, setup_sql, version = self.attachments, self._attach_setup, self._attach_version
+        for schema, path in list(conn.attached.items()):
+            if attachments.get(schema) != path:
+                conn.execute(f"DETACH DATABASE {schema}")
+                del conn.attached[schema]
+        for schema, path in attachments.items():
+            if schema not in conn.attached:
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                conn.execute(f"PRAGMA {schema}.cache_size = -{self.CACHE_SIZE_KB}")
+                if isinstance(conn, WriterConnection):
+                    conn.execute(f"PRAGMA {schema}.synchronous = NORMAL")
+                conn.attached[schema] = path
+        for sql in setup_sql:
+            conn.execute(sql)
+        conn.attach_version = version
+    
+    def reader(self) -> PooledConnection:
+        """当前线程的读连接（首次使用时创建）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        self._apply_attachments(conn)
+        return conn
+    
+    def connection(self) -> PooledConnection:
+        """在写线程中（即写方法内部）返回写连接，否则返回本线程的读连接"""
+        if threading.current_thread() is self._writer_thread:
+            return self._writer
+        return self.reader()
+    
+    def run_write(self, fn, *args, **kwargs):
+        """
+        在写线程中执行写操作并等待其提交完成，返回 fn 的返回值（异常原样抛出）
+        
+        写方法内部再调用其他写方法时直接执行，属于同一个写操作。
+        """
+        if threading.current_thread() is self._writer_thread:
+            return fn(*args, **kwargs)
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future.result()
+    
+    def _writer_loop(self):
+        self._writer = self._connect(factory=WriterConnection, isolation_level=None)
+        # WAL模式写入数据库文件后长期有效；synchronous=NORMAL 在WAL下只在检查点时同步
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._writer.execute("PRAGMA synchronous = NORMAL")
+        self._writer_started.set()
+        
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.MAX_GROUP_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run_group(batch)
+    
+    def _run_group(self, batch):
+        """在一个事务中依次执行一组写操作，提交后再通知各调用方"""
+        conn = self._writer
+        outcomes = []
+        try:
+            self._apply_attachments(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, kwargs, _ in batch:
+                conn.execute(f"SAVEPOINT {WriterConnection.SAVEPOINT}")
+                try:
+                    outcomes.append((True, fn(*args, **kwargs)))
+                except BaseException as e:
+                    conn.execute(f"ROLLBACK TO {WriterConnection.SAVEPOINT}")
+                    outcomes.append((False, e))
+                conn.execute(f"RELEASE {WriterConnection.SAVEPOINT}")
+            conn.execute("COMMIT")
+        except BaseException as e:
+            # 开始或提交事务失败：整组写操作都未生效
+            if conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        
+        for (_, _, _, future), (ok, value) in zip(batch, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """获取数据库文件对应的连接池（同一进程内同一文件共用一个连接池和写线程）"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path)
+        return _pools[key]
+
+
+def write_method(func):
+    """
+    标记 Database 的写方法：方法在写线程中执行并与其他排队的写操作组提交，
+    方法内 get_connection() 返回的是写连接，调用方式与原来一致
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self._pool.run_write(func, self, *args, **kwargs)
+    return wrapper
@@ -10,6 +10,7 @@ import time
 import requests
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from app.config import Config
+from app.database import Database
 
 try:
     import akshare as ak
@@ -19,8 +20,10 @@ except ImportError:
 
 
 class DataFetcher:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, db: Optional[Database] = None):
         self.config = config
+        # 由调用方传入共用的数据库对象；单独使用时才自行创建
+        self.db = db if db is not None else Database()
         self.data_source = config.get('data_source', 'tushare')
         self._init_data_source()
     
@@ -69,9 +72,7 @@ class DataFetcher:
         # BaoStock没有提供股票列表接口，只能从数据库获取已有的股票列表
         # 不允许自动切换到其他数据源，必须由用户手动选择
         try:
-            from app.database import Database
-            db = Database()
-            stocks_df = db.get_stocks(exclude_delisted=True)
+            stocks_df = self.db.get_stocks(exclude_delisted=True)
             if not stocks_df.empty:
                 return stocks_df
         except Exception as e:
@@ -700,7 +701,7 @@ class DataFetcher:
         """
         if df.empty:
             return df
-            
+        
         if 'pct_chg' in df.columns and not df['pct_chg'].isna().all():
             # 检查pct_chg的格式：如果最大值小于1，可能是小数形式，需要转换为百分比
             valid_pct = df[df['pct_chg'].notna()]['pct_chg']
@@ -716,11 +717,9 @@ class DataFetcher:
         # 如果没有提供list_date，尝试从数据库获取，如果数据库没有则尝试从数据源获取
         if not list_date and 'ts_code' in df.columns and not df.empty:
             try:
-                from app.database import Database
-                db = Database()
                 ts_code = df.iloc[0]['ts_code']
                 code = ts_code.replace('.SZ', '').replace('.SH', '')
-                stock = db.get_stock_by_code(code)
+                stock = self.db.get_stock_by_code(code)
                 if stock and stock.get('list_date'):
                     list_date = stock['list_date']
                 else:
@@ -740,14 +739,7 @@ class DataFetcher:
                                         # 更新数据库中的上市日期（如果股票存在）
                                         try:
                                             if stock:
-                                                conn = db.get_connection()
-                                                try:
-                                                    cursor = conn.cursor()
-                                                    cursor.execute("UPDATE stocks SET list_date = ? WHERE symbol = ? OR ts_code = ?", 
-                                                                 (list_date, code, ts_code))
-                                                    conn.commit()
-                                                finally:
-                                                    conn.close()
+                                                self.db.update_stock_list_date(code, list_date, ts_code)
                                         except Exception as e:
                                             print(f"Error updating list_date in DB for {ts_code}: {e}")
                         except Exception as e:
@@ -3,7 +3,8 @@
 """
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import Callable, Optional
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
 import time
 import traceback
 from app.database import Database
@@ -12,12 +13,37 @@ from app.config import Config
 
 
 class DataUpdater:
+    # 累积多少只股票的月K线后合并成一次批量写入（一个事务）
+    KLINE_BATCH_STOCKS = 50
+    
     def __init__(self, db: Database, config: Config):
         self.db = db
         self.config = config
-        self.fetcher = DataFetcher(config)
+        self.fetcher = DataFetcher(config, db)
         self.data_source = config.get('data_source', 'tushare')
         self.progress_callback: Optional[Callable] = None
+        self._kline_buffer: List[pd.DataFrame] = []
+        # 覆盖模式正在重建的数据源（该数据源的月K线先写入影子表，获取完成后整体替换）
+        self._rebuild_source: Optional[str] = None
+        # 配置变化标记（由配置订阅回调设置，在下次更新开始时应用）
+        self._config_changed = threading.Event()
+    
+    def on_config_change(self, old_config: Dict, new_config: Dict):
+        """
+        配置变化回调（在修改配置的线程中调用）：数据源或其参数（如token）变化时只做标记，
+        数据获取器在下次更新开始时由更新线程重新初始化，正在进行的更新继续使用原数据源
+        """
+        data_source = new_config.get('data_source', 'tushare')
+        if old_config.get('data_source') != data_source or old_config.get(data_source) != new_config.get(data_source):
+            self._config_changed.set()
+    
+    def _apply_config_change(self):
+        """更新开始前应用标记的配置变化（在更新线程中调用，两次更新之间没有暂存的月K线）"""
+        if not self._config_changed.is_set():
+            return
+        self._config_changed.clear()
+        self.fetcher = DataFetcher(self.config, self.db)
+        self.data_source = self.config.get('data_source', 'tushare')
     
     def set_progress_callback(self, callback: Callable):
         """设置进度回调函数"""
@@ -28,57 +54,133 @@ class DataUpdater:
         if self.progress_callback:
             self.progress_callback(current, total, message)
     
+    def _buffer_kline(self, kline_df: pd.DataFrame):
+        """暂存一只股票的月K线，累积到一定数量后批量写入"""
+        self._kline_buffer.append(kline_df)
+        if len(self._kline_buffer) >= self.KLINE_BATCH_STOCKS:
+            self._flush_kline()
+    
+    def _flush_kline(self):
+        """把暂存的月K线一次性写入数据库"""
+        if not self._kline_buffer:
+            return
+        frames, self._kline_buffer = self._kline_buffer, []
+        try:
+            kline_df = pd.concat(frames, ignore_index=True)
+            if self._rebuild_source == self.data_source:
+                self.db.save_monthly_kline_rebuild(kline_df)
+            else:
+                self.db.save_monthly_kline(kline_df, data_source=self.data_source)
+        except Exception as e:
+            codes = sorted({code for df in frames for code in df['ts_code'].unique()})
+            print(f"Error saving monthly kline for {len(codes)} stocks ({', '.join(codes[:5])}...): {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+    
+    def _plan_kline_fetch(self, stocks_df: pd.DataFrame, default_start_date: Callable[[pd.Series], str],
+                          use_latest: bool) -> Tuple[List[Tuple[pd.Series, str, str]], List[str]]:
+        """
+        获取月K线前一次性生成全部股票的获取计划
+        
+        use_latest 为 True 时用一次分组查询取出当前数据源每只股票的最新交易日期，从其后一天开始获取；
+        没有数据的股票从 default_start_date(row) 开始。起始日期不早于结束日期（已是最新）的股票跳过。
+        
+        Returns:
+            ([(股票行, 起始日期, 结束日期)], 跳过的股票代码列表)
+        """
+        latest_dates = self.db.get_latest_trade_dates(self.data_source) if use_latest else {}
+        end_date = datetime.now().strftime('%Y%m%d')
+        plan, skipped = [], []
+        for _, row in stocks_df.iterrows():
+            latest_date = latest_dates.get(row['ts_code'])
+            if latest_date:
+                start_date = (datetime.strptime(latest_date, '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
+            else:
+                start_date = default_start_date(row)
+            if start_date >= end_date:
+                skipped.append(row['ts_code'])
+            else:
+                plan.append((row, start_date, end_date))
+        return plan, skipped
+    
+    def _sync_kline_store(self):
+        """把本次更新涉及的年份分区从数据库写入月K线列式存储（未启用列式存储时不做任何事）"""
+        if self.db.kline_store is None:
+            return
+        try:
+            count = self.db.kline_store.sync(self.db)
+            if count:
+                print(f"✓ 月K线列式存储已同步 {count} 个分区")
+        except Exception as e:
+            print(f"月K线列式存储同步失败，相关数据源将继续从数据库读取: {e}")
+    
+    def _finish_rebuild(self):
+        """覆盖模式获取完成：用影子表整体替换当前数据源的月K线（替换失败时由 _abort_rebuild 删除影子表）"""
+        data_source = self._rebuild_source
+        self._update_progress(90, 100, f"正在替换 {data_source} 数据源的月K线...")
+        rows = self.db.finish_kline_rebuild(data_source)
+        self._rebuild_source = None
+        if rows:
+            self._update_progress(90, 100, f"已替换为重新获取的 {rows} 条月K线")
+        else:
+            self._update_progress(90, 100, f"未获取到 {data_source} 数据源的月K线，保留原有数据")
+    
+    def _abort_rebuild(self):
+        """覆盖模式中途出错：丢弃影子表，原有数据保持不变"""
+        if self._rebuild_source is None:
+            return
+        self._rebuild_source = None
+        try:
+            self.db.abort_kline_rebuild()
+        except Exception as e:
+            print(f"Error dropping kline rebuild table: {e}")
+    
     def update_all_data(self, start_year: int = 2000, overwrite_mode: bool = False):
         """首次批量更新所有数据
         
         Args:
             start_year: 起始年份
             overwrite_mode: 是否使用覆盖模式
-                - True: 覆盖模式，先删除当前数据源的所有数据，然后重新获取
+                - True: 覆盖模式，重新获取当前数据源的全部数据，获取完成后整体替换原有数据
+                  （获取过程中原有数据照常提供查询，中途出错则保留原有数据）
                 - False: 补充模式，只添加缺失的数据（默认）
         """
+        self._apply_config_change()
         try:
             # 1. 更新股票列表
             self._update_progress(0, 100, "正在获取股票列表...")
             stocks_df = self.fetcher.get_stock_list()
             if not stocks_df.empty:
-                self.db.save_stocks(stocks_df)
-                self._update_progress(10, 100, f"已获取 {len(stocks_df)} 只股票")
+                diff = self.db.save_stocks(stocks_df)
+                self._update_progress(10, 100, f"已获取 {len(stocks_df)} 只股票（新增 {len(diff['added'])}，"
+                                               f"变化 {len(diff['updated'])}，移除 {len(diff['removed'])}）")
             else:
                 self._update_progress(10, 100, "股票列表获取失败")
                 return False
             
-            # 2. 如果是覆盖模式，先删除当前数据源的所有数据
+            # 2. 如果是覆盖模式，重新获取的数据先写入影子表
             if overwrite_mode:
-                self._update_progress(10, 100, f"正在删除 {self.data_source} 数据源的旧数据...")
-                deleted_count = self.db.delete_monthly_kline_by_source(self.data_source)
-                self._update_progress(10, 100, f"已删除 {deleted_count} 条旧数据，开始重新获取...")
+                self.db.begin_kline_rebuild()
+                self._rebuild_source = self.data_source
+                self._update_progress(10, 100, f"开始重新获取 {self.data_source} 数据源的全部数据（完成前仍使用原有数据）...")
             
             # 3. 更新月K线数据
-            current_year = datetime.now().year
+            def default_start_date(row) -> str:
+                # 起始日期：上市日期或起始年份（取较晚者）
+                list_date = row['list_date']
+                if list_date and len(list_date) == 8:
+                    return max(list_date, f"{start_year}0101")
+                return f"{start_year}0101"
+            
+            # 补充模式从已有数据（按当前数据源）的最新日期之后开始；覆盖模式全部从头获取
+            plan, skipped = self._plan_kline_fetch(stocks_df, default_start_date, use_latest=not overwrite_mode)
             total_stocks = len(stocks_df)
-            processed = 0
+            processed = len(skipped)
+            self._update_progress(10, 100, f"{len(plan)} 只股票需要获取月K线，{len(skipped)} 只已是最新")
             
-            for idx, row in stocks_df.iterrows():
+            for row, start_date, end_date in plan:
                 ts_code = row['ts_code']
-                list_date = row['list_date']
-                
-                # 确定起始日期（上市日期或2000年）
-                if list_date and len(list_date) == 8:
-                    start_date = max(list_date, f"{start_year}0101")
-                else:
-                    start_date = f"{start_year}0101"
-                
-                end_date = datetime.now().strftime('%Y%m%d')
                 
                 try:
-                    # 如果是补充模式，检查是否已有数据（按当前数据源）
-                    if not overwrite_mode:
-                        latest_date = self.db.get_latest_trade_date(ts_code, data_source=self.data_source)
-                        if latest_date:
-                            # 增量更新：从最新日期之后开始
-                            start_date = (pd.to_datetime(latest_date, format='%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
-                    
                     # 获取数据（添加超时保护）
                     try:
                         kline_df = self.fetcher.get_monthly_kline(ts_code, start_date, end_date)
@@ -98,8 +200,8 @@ class DataUpdater:
                     if not kline_df.empty:
                         # 计算涨跌幅（如果需要）
                         kline_df = self.fetcher.calculate_pct_chg(kline_df)
-                        # 保存数据，记录数据源
-                        self.db.save_monthly_kline(kline_df, data_source=self.data_source)
+                        # 暂存数据，累积多只股票后批量保存（记录数据源）
+                        self._buffer_kline(kline_df)
                     
                     processed += 1
                     progress = 10 + int((processed / total_stocks) * 80)
@@ -122,6 +224,11 @@ class DataUpdater:
                     self._update_progress(progress, 100, f"更新 {row['name']} ({ts_code}) 时出错: {error_msg[:50]}... [{processed}/{total_stocks}]")
                     continue
             
+            self._flush_kline()
+            if self._rebuild_source is not None:
+                self._finish_rebuild()
+            self._sync_kline_store()
+            
             # 4. 更新行业分类
             self._update_progress(90, 100, "正在更新行业分类...")
             self._update_industry_classification()
@@ -129,10 +236,13 @@ class DataUpdater:
             mode_text = "覆盖模式" if overwrite_mode else "补充模式"
             self._update_progress(100, 100, f"数据更新完成！[{mode_text}]")
             return True
-            
+        
         except Exception as e:
             error_msg = str(e)
             error_trace = traceback.format_exc()
+            self._flush_kline()
+            self._abort_rebuild()
+            self._sync_kline_store()
             print(f"Error in update_all_data: {error_msg}")
             print(f"Traceback: {error_trace}")
             self._update_progress(100, 100, f"数据更新失败: {error_msg}")
@@ -140,29 +250,24 @@ class DataUpdater:
     
     def update_incremental(self):
         """增量更新（只更新最新数据）"""
+        self._apply_config_change()
         try:
             stocks_df = self.db.get_stocks(exclude_delisted=True)
             total_stocks = len(stocks_df)
-            processed = 0
             
-            for idx, row in stocks_df.iterrows():
+            def default_start_date(row) -> str:
+                # 没有数据的股票从上市日期开始
+                list_date = row['list_date']
+                return list_date if list_date and len(list_date) == 8 else "20000101"
+            
+            # 已是最新的股票直接跳过
+            plan, skipped = self._plan_kline_fetch(stocks_df, default_start_date, use_latest=True)
+            processed = len(skipped)
+            self._update_progress(0, 100, f"{len(plan)} 只股票需要更新，{len(skipped)} 只已是最新")
+            
+            for row, start_date, end_date in plan:
                 ts_code = row['ts_code']
                 
-                # 获取最新交易日期
-                latest_date = self.db.get_latest_trade_date(ts_code, data_source=self.data_source)
-                if latest_date:
-                    start_date = (pd.to_datetime(latest_date, format='%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
-                else:
-                    # 如果没有数据，从上市日期开始
-                    list_date = row['list_date']
-                    start_date = list_date if list_date and len(list_date) == 8 else "20000101"
-                
-                end_date = datetime.now().strftime('%Y%m%d')
-                
-                if start_date >= end_date:
-                    processed += 1
-                    continue
-                
                 try:
                     try:
                         kline_df = self.fetcher.get_monthly_kline(ts_code, start_date, end_date)
@@ -177,7 +282,7 @@ class DataUpdater:
                     
                     if not kline_df.empty:
                         kline_df = self.fetcher.calculate_pct_chg(kline_df)
-                        self.db.save_monthly_kline(kline_df, data_source=self.data_source)
+                        self._buffer_kline(kline_df)
                     
                     processed += 1
                     progress = int((processed / total_stocks) * 100)
@@ -194,12 +299,16 @@ class DataUpdater:
                     self._update_progress(progress, 100, f"更新 {row['name']} ({ts_code}) 时出错: {error_msg[:50]}...")
                     continue
             
+            self._flush_kline()
+            self._sync_kline_store()
             self._update_progress(100, 100, "增量更新完成！")
             return True
-            
+        
         except Exception as e:
             error_msg = str(e)
             error_trace = traceback.format_exc()
+            self._flush_kline()
+            self._sync_kline_store()
             print(f"Error in update_incremental: {error_msg}")
             print(f"Traceback: {error_trace}")
             self._update_progress(100, 100, f"增量更新失败: {error_msg}")
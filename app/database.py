@@ -3,289 +3,631 @@
 """
 import sqlite3
 import os
+import re
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 import pandas as pd
+from app.connection_pool import get_pool, write_method
+from app import kline_layout, migrations
+from app.stock_directory import StockDirectory, get_directory_cache
 
 
 class Database:
+    # 月K线表的数据列（不含 data_source），批量写入时按此顺序组织
+    KLINE_COLUMNS = ['ts_code', 'trade_date', 'year', 'month', 'open', 'close', 'high', 'low',
+                     'vol', 'amount', 'pct_chg']
+    
+    # 股票表的字段（与表定义一致）
+    STOCK_COLUMNS = ['ts_code', 'symbol', 'name', 'area', 'industry', 'list_date', 'delist_date',
+                     'is_hs', 'exchange']
+    
     def __init__(self, db_path: str = None):
         # 支持环境变量指定数据库路径（用于Docker部署）
         if db_path is None:
             import os
             db_path = os.getenv("DB_PATH", "stock_data.db")
         self.db_path = db_path
-        self.init_database()
+        # 月K线列式存储（可选，见 use_kline_store）
+        self.kline_store = None
+        # 同一数据库文件共用连接池，结构初始化每个进程只执行一次，之后创建 Database 对象几乎没有开销
+        self._pool = get_pool(db_path)
+        if not self._pool.schema_ready:
+            with self._pool.schema_lock:
+                if not self._pool.schema_ready:
+                    self.init_database()
+                    self._refresh_kline_attachments()
+                    self._pool.schema_ready = True
     
     def get_connection(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path)
+        """
+        获取数据库连接（连接池中本线程的长期连接，写方法内为共用的写连接）
+        
+        调用方式不变：用完后 close() 只回滚未提交的事务，不会真正关闭连接
+        """
+        return self._pool.connection()
     
     def init_database(self):
-        """初始化数据库表结构"""
+        """初始化数据库表结构（执行尚未执行的迁移；已是最新版本时只做一次版本查询）"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # 股票基本信息表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stocks (
-                ts_code TEXT PRIMARY KEY,
-                symbol TEXT NOT NULL,
-                name TEXT NOT NULL,
-                area TEXT,
-                industry TEXT,
-                list_date TEXT,
-                delist_date TEXT,
-                is_hs TEXT,
-                exchange TEXT
-            )
-        """)
+        version = migrations.current_version(conn)
+        conn.close()
+        if version < migrations.LATEST_VERSION:
+            # 迁移可能需要读取月K线（如初始化汇总表），分数据源存储时先附加各数据源的文件
+            if version >= 1:
+                self._refresh_kline_attachments()
+            self._migrate()
+    
+    @write_method
+    def _migrate(self):
+        """在写事务中执行数据库迁移（其他进程可能已先完成迁移，迁移模块会重新检查版本）"""
+        conn = self.get_connection()
+        migrations.migrate(self, conn.cursor())
+        conn.commit()
+        conn.close()
+    
+    # 各查询路径使用的索引（check_query_plans.py 检查热点查询是否都能命中索引）
+    INDEXES = {
+        # 月K线：最新交易日期（全表）
+        'idx_monthly_kline_date': "monthly_kline(trade_date)",
+        # 月K线：按年份、月份查询
+        'idx_monthly_kline_year_month': "monthly_kline(year, month)",
+        # 月K线：季节性汇总重算、单只股票最新交易日期、数据源统计（覆盖索引，无需回表）
+        'idx_monthly_kline_source_code': "monthly_kline(data_source, ts_code, month, year, trade_date, pct_chg)",
+        # 季节性汇总：单只股票逐年数据（覆盖索引，按年份、月份有序）
+        'idx_monthly_seasonality_stock': "monthly_seasonality(ts_code, data_source, year, month, pct_chg, total_count, "
+                                         "up_count, down_count, up_pct_sum, down_pct_sum)",
+        # 行业成分：按行业名称查询成分股
+        'idx_industry_sw_name': "industry_sw(industry_name, ts_code)",
+        'idx_industry_citics_name': "industry_citics(industry_name, ts_code)",
+        # 股票列表：按股票代码（不带交易所后缀）查询
+        'idx_stocks_symbol': "stocks(symbol)",
+        'idx_stocks_delist': "stocks(delist_date)",
+    }
+    # 已被上面的复合索引取代的旧索引
+    OBSOLETE_INDEXES = ['idx_monthly_kline_code', 'idx_monthly_seasonality_code', 'idx_stocks_code']
+    # 涨跌幅合计保留的小数位数：累计值相减、不同求和顺序带来的浮点误差在此舍去，
+    # 各统计后端得到相同的合计值，平均涨跌幅保留两位小数时不会在 .xx5 附近相差 0.01
+    PCT_SUM_DECIMALS = 6
+    
+    def _create_indexes(self, cursor):
+        """创建缺失的索引并删除已被取代的旧索引（启动时执行，已存在的索引不会重复创建）"""
+        for name in self.OBSOLETE_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        # 紧凑存储时 monthly_kline 是视图，不建索引（紧凑表的主键已按数据源、股票、年月聚簇）；
+        # 分数据源存储时月K线索引建在各数据源的文件中（见 kline_layout.create_kline_source_table）
+        kline_is_table = kline_layout.current_kline_layout(cursor) == 'standard'
+        for name, definition in self.INDEXES.items():
+            if not kline_is_table and definition.startswith('monthly_kline('):
+                continue
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    
+    def _seasonality_insert_sql(self, kline_filter: str, table: str = 'monthly_seasonality',
+                                kline_table: str = 'monthly_kline') -> str:
+        """
+        构造从月K线重新生成季节性汇总行的INSERT语句
+        （kline_filter为月K线的过滤条件，table为写入的表，kline_table为读取的月K线表）
         
-        # 行业分类表（申万）
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS industry_sw (
-                ts_code TEXT,
-                industry_name TEXT,
-                level TEXT,
-                parent_code TEXT,
-                PRIMARY KEY (ts_code, industry_name)
+        同一（股票, 年, 月）有多条月K线时（如未完结月份的多个交易日）只取最新交易日期的一条，
+        每个年月计数为1，与收益面板（ReturnPanel）每个年月一个值的口径一致
+        """
+        return f"""
+            INSERT INTO {table} (
+                data_source, ts_code, month, year, pct_chg,
+                total_count, up_count, down_count, up_pct_sum, down_pct_sum,
+                cum_total_count, cum_up_count, cum_down_count, cum_up_pct_sum, cum_down_pct_sum
             )
-        """)
-        
-        # 行业分类表（中信）
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS industry_citics (
-                ts_code TEXT,
-                industry_name TEXT,
-                level TEXT,
-                parent_code TEXT,
-                PRIMARY KEY (ts_code, industry_name)
+            SELECT data_source, ts_code, month, year, pct_chg,
+                   1, pct_chg > 0, pct_chg < 0,
+                   CASE WHEN pct_chg > 0 THEN pct_chg ELSE 0.0 END,
+                   CASE WHEN pct_chg < 0 THEN pct_chg ELSE 0.0 END,
+                   COUNT(*) OVER w, SUM(pct_chg > 0) OVER w, SUM(pct_chg < 0) OVER w,
+                   TOTAL(CASE WHEN pct_chg > 0 THEN pct_chg END) OVER w,
+                   TOTAL(CASE WHEN pct_chg < 0 THEN pct_chg END) OVER w
+            FROM (
+                SELECT data_source, ts_code, month, year,
+                       pct_chg, MAX(trade_date) AS latest_trade_date
+                FROM {kline_table}
+                WHERE pct_chg IS NOT NULL AND {kline_filter}
+                GROUP BY data_source, ts_code, month, year
             )
-        """)
+            WINDOW w AS (PARTITION BY data_source, ts_code, month ORDER BY year)
+        """
+    
+    def _refresh_seasonality(self, cursor, data_source: str, kline_df: pd.DataFrame):
+        """增量维护季节性汇总表：只重新生成本次写入涉及的（股票, 月份）"""
+        if kline_df.empty or 'ts_code' not in kline_df.columns or 'month' not in kline_df.columns:
+            return
         
-        # 用户表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT NOT NULL DEFAULT 'user',
-                is_active INTEGER NOT NULL DEFAULT 1,
-                valid_until TEXT,
-                created_at TEXT NOT NULL,
-                updated_at TEXT
-            )
-        """)
+        kline_table = self._kline_source_table(data_source)
+        for ts_code, months in kline_df.groupby('ts_code')['month'].unique().items():
+            months = sorted(int(m) for m in months if pd.notna(m))
+            if not months:
+                continue
+            placeholders = ', '.join('?' * len(months))
+            params = [data_source, ts_code] + months
+            cursor.execute(f"""
+                DELETE FROM monthly_seasonality
+                WHERE data_source = ? AND ts_code = ? AND month IN ({placeholders})
+            """, params)
+            cursor.execute(self._seasonality_insert_sql(
+                f"data_source = ? AND ts_code = ? AND month IN ({placeholders})", kline_table=kline_table
+            ), params)
+    
+    def _rebuild_source_summary(self, cursor, data_source: str = None):
+        """从月K线重新统计数据源汇总（不指定数据源时重新统计全部数据源）"""
+        now = datetime.now().strftime('%Y%m%d%H%M%S')
+        if data_source is None:
+            cursor.execute("DELETE FROM source_summary")
+            kline_table, condition, params = 'monthly_kline', "data_source IS NOT NULL", (now,)
+        else:
+            cursor.execute("DELETE FROM source_summary WHERE data_source = ?", (data_source,))
+            kline_table, condition, params = self._kline_source_table(data_source), "data_source = ?", (now, data_source)
+        cursor.execute(f"""
+            INSERT INTO source_summary (data_source, data_count, stock_count, latest_date, updated_at)
+            SELECT data_source, COUNT(*), COUNT(DISTINCT ts_code), MAX(trade_date), ?
+            FROM {kline_table}
+            WHERE {condition}
+            GROUP BY data_source
+        """, params)
+    
+    def _bump_data_generation(self, cursor, key: str = 'data_generation'):
+        """
+        数据版本号加1（行情、股票列表或行业数据变化时调用，用于使统计结果缓存失效）
         
-        # 会话表
+        key 为 'stocks_generation' 时是股票列表版本号（用于重新加载股票目录）
+        """
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                expires_at TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
+            INSERT INTO system_config (key, value, updated_at)
+            VALUES (?, '1', ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = CAST(CAST(value AS INTEGER) + 1 AS TEXT),
+                updated_at = excluded.updated_at
+        """, (key, datetime.now().strftime('%Y%m%d%H%M%S')))
+    
+    def get_data_generation(self) -> int:
+        """获取当前数据版本号"""
+        return int(self.get_system_config('data_generation', '0'))
+    
+    def save_stocks(self, stocks_df: pd.DataFrame) -> Dict[str, List[str]]:
+        """保存股票基本信息（见 _save_stocks），有变化时本进程的股票目录立即重新加载"""
+        diff = self._save_stocks(stocks_df)
+        if any(diff.values()):
+            get_directory_cache(self.db_path).invalidate()
+        return diff
+    
+    @write_method
+    def _save_stocks(self, stocks_df: pd.DataFrame) -> Dict[str, List[str]]:
+        """
+        保存股票基本信息（与现有股票表比对，只写入变化的部分）
         
-        # 系统配置表（用于存储会话时长等系统配置）
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS system_config (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL,
-                updated_at TEXT
-            )
-        """)
+        传入的是完整的股票列表：不在列表中的股票被移除，新股票插入，字段有变化的股票更新。
+        只更新传入数据中包含的字段；上市日期为空时保留已有的上市日期（部分数据源不提供上市日期，
+        由获取K线时补充）。没有任何变化时不写入，也不改变数据版本号。
         
-        # 用户权限表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_permissions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                permission_code TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                UNIQUE(user_id, permission_code)
-            )
-        """)
+        Returns:
+            变化的股票代码：{'added': 新增, 'updated': 字段变化, 'removed': 移除, 'delisted': 新标记退市}
+        """
+        columns = [col for col in self.STOCK_COLUMNS if col in stocks_df.columns]
+        if 'ts_code' not in columns:
+            raise ValueError("stocks_df must contain column 'ts_code'")
         
-        # 初始化默认管理员账号（如果不存在）
-        cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
-        if cursor.fetchone()[0] == 0:
-            import bcrypt
-            password_hash = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            cursor.execute("""
-                INSERT INTO users (username, password_hash, role, is_active, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, ('admin', password_hash, 'admin', 1, datetime.now().strftime('%Y%m%d%H%M%S')))
+        # 统一为字符串（表字段均为TEXT），缺失值为None；同一代码保留最后一行
+        new_df = stocks_df[columns].astype(object)
+        new_df = new_df.where(pd.notna(new_df), None).map(lambda v: v if v is None else str(v))
+        new_df = new_df[new_df['ts_code'].notna()].drop_duplicates('ts_code', keep='last')
         
-        # 初始化系统配置（会话时长，默认24小时）
-        cursor.execute("SELECT COUNT(*) FROM system_config WHERE key = 'session_duration_hours'")
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("""
-                INSERT INTO system_config (key, value, updated_at)
-                VALUES (?, ?, ?)
-            """, ('session_duration_hours', '24', datetime.now().strftime('%Y%m%d%H%M%S')))
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(columns)} FROM stocks")
+        current = {row[0]: row for row in cursor.fetchall()}
         
-        # 公告表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS announcements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                is_pinned INTEGER NOT NULL DEFAULT 0,
-                created_by INTEGER,
-                created_at TEXT NOT NULL,
-                updated_at TEXT,
-                FOREIGN KEY (created_by) REFERENCES users(id)
-            )
-        """)
+        list_date_idx = columns.index('list_date') if 'list_date' in columns else None
+        delist_date_idx = columns.index('delist_date') if 'delist_date' in columns else None
+        diff = {'added': [], 'updated': [], 'removed': [], 'delisted': []}
+        changed_rows = []
+        incoming = set()
+        for row in new_df.itertuples(index=False, name=None):
+            ts_code = row[0]
+            incoming.add(ts_code)
+            old = current.get(ts_code)
+            if old is not None and list_date_idx is not None and not row[list_date_idx] and old[list_date_idx]:
+                row = row[:list_date_idx] + (old[list_date_idx],) + row[list_date_idx + 1:]
+            if old is None:
+                diff['added'].append(ts_code)
+            elif row != old:
+                diff['updated'].append(ts_code)
+            else:
+                continue
+            changed_rows.append(row)
+            if delist_date_idx is not None and row[delist_date_idx] and not (old and old[delist_date_idx]):
+                diff['delisted'].append(ts_code)
+        diff['removed'] = [ts_code for ts_code in current if ts_code not in incoming]
         
-        # 提交所有更改
+        if changed_rows:
+            update_set = ', '.join(f"{col} = excluded.{col}" for col in columns[1:])
+            conflict = f"DO UPDATE SET {update_set}" if update_set else "DO NOTHING"
+            cursor.executemany(f"""
+                INSERT INTO stocks ({', '.join(columns)})
+                VALUES ({', '.join('?' * len(columns))})
+                ON CONFLICT(ts_code) {conflict}
+            """, changed_rows)
+        if diff['removed']:
+            cursor.executemany("DELETE FROM stocks WHERE ts_code = ?", [(ts_code,) for ts_code in diff['removed']])
+        if changed_rows or diff['removed']:
+            self._bump_data_generation(cursor)
+            self._bump_data_generation(cursor, 'stocks_generation')
         conn.commit()
+        conn.close()
+        return diff
+    
+    def save_monthly_kline(self, kline_df: pd.DataFrame, data_source: str = 'akshare') -> int:
+        """
+        保存月K线数据（见 _save_monthly_kline），启用列式存储时把涉及的年份分区记为待同步
         
-        # 月K线数据表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS monthly_kline (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ts_code TEXT NOT NULL,
-                trade_date TEXT NOT NULL,
-                year INTEGER NOT NULL,
-                month INTEGER NOT NULL,
-                open REAL,
-                close REAL,
-                high REAL,
-                low REAL,
-                vol REAL,
-                amount REAL,
-                pct_chg REAL,
-                data_source TEXT DEFAULT 'akshare',
-                UNIQUE(ts_code, trade_date, data_source)
-            )
-        """)
+        写入前先标记，提交前后读取方都不会读到过时的分区；写入后再标记一次，使期间开始的同步保留这些分区
+        """
+        self._ensure_kline_source(data_source)
+        if self.kline_store is not None:
+            self.kline_store.mark_dirty(data_source, kline_df['year'].unique())
+        changed_rows = self._save_monthly_kline(kline_df, data_source)
+        if changed_rows and self.kline_store is not None:
+            self.kline_store.mark_dirty(data_source, kline_df['year'].unique())
+        return changed_rows
+    
+    @write_method
+    def _save_monthly_kline(self, kline_df: pd.DataFrame, data_source: str = 'akshare') -> int:
+        """
+        保存月K线数据（批量upsert，支持多数据源，可一次传入多只股票的数据）
         
-        # 检查表结构和约束
-        cursor.execute("PRAGMA table_info(monthly_kline)")
-        columns = [col[1] for col in cursor.fetchall()]
+        数据先整体写入临时暂存表，再用一条 INSERT ... ON CONFLICT DO UPDATE 合并到月K线表；
+        与已有记录完全相同的行不会被改写，也不会触发季节性汇总表的重算和数据版本号变化。
         
-        # 检查表定义中的UNIQUE约束
-        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='monthly_kline'")
-        table_sql = cursor.fetchone()
-        has_old_constraint = False
-        if table_sql and 'UNIQUE(ts_code, trade_date)' in table_sql[0] and 'UNIQUE(ts_code, trade_date, data_source)' not in table_sql[0]:
-            has_old_constraint = True
+        Returns:
+            新增或内容变化的行数
+        """
+        if kline_df.empty:
+            return 0
         
-        if 'data_source' not in columns or has_old_constraint:
-            # 需要重建表
-            print("检测到旧的表结构，正在重建表以支持多数据源...")
-            
-            # 备份数据
-            cursor.execute("SELECT * FROM monthly_kline")
-            old_data = cursor.fetchall()
-            old_columns = [desc[0] for desc in cursor.description]
-            
-            # 删除旧表
-            cursor.execute("DROP TABLE IF EXISTS monthly_kline")
-            
-            # 创建新表
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        rows = self._kline_rows(kline_df)
+        columns = ', '.join(self.KLINE_COLUMNS)
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS kline_staging ({columns})")
+        cursor.execute("DELETE FROM kline_staging")
+        cursor.executemany(f"INSERT INTO kline_staging ({columns}) VALUES ({', '.join('?' * len(self.KLINE_COLUMNS))})",
+                           rows)
+        
+        # 找出新增或内容有变化的行涉及的（股票, 月份），只对这些重算季节性汇总
+        compact = self.kline_layout(cursor) == 'compact'
+        if compact:
+            # 紧凑存储每个（股票, 年月）只有一行：同月多条时只保留交易日期最晚（相同则最后写入）的一条，
+            # 与标准存储下季节性汇总取每月最新交易日期的口径一致；否则较早的一条每次都会先覆盖再被改回，重复保存不是幂等的
             cursor.execute("""
-                CREATE TABLE monthly_kline (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ts_code TEXT NOT NULL,
-                    trade_date TEXT NOT NULL,
-                    year INTEGER NOT NULL,
-                    month INTEGER NOT NULL,
-                    open REAL,
-                    close REAL,
-                    high REAL,
-                    low REAL,
-                    vol REAL,
-                    amount REAL,
-                    pct_chg REAL,
-                    data_source TEXT DEFAULT 'akshare',
-                    UNIQUE(ts_code, trade_date, data_source)
+                DELETE FROM kline_staging WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY ts_code, substr(trade_date, 1, 6) ORDER BY trade_date DESC, rowid DESC
+                        ) AS rank
+                        FROM kline_staging WHERE trade_date IS NOT NULL
+                    ) WHERE rank > 1
                 )
             """)
-            
-            # 恢复数据（如果有data_source字段则使用，否则默认为akshare）
-            if old_data:
-                data_source_col_idx = old_columns.index('data_source') if 'data_source' in old_columns else None
-                for row in old_data:
-                    data_source = row[data_source_col_idx] if data_source_col_idx is not None and row[data_source_col_idx] else 'akshare'
-                    cursor.execute("""
-                        INSERT INTO monthly_kline 
-                        (ts_code, trade_date, year, month, open, close, high, low, vol, amount, pct_chg, data_source)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        row[old_columns.index('ts_code')],
-                        row[old_columns.index('trade_date')],
-                        row[old_columns.index('year')],
-                        row[old_columns.index('month')],
-                        row[old_columns.index('open')],
-                        row[old_columns.index('close')],
-                        row[old_columns.index('high')],
-                        row[old_columns.index('low')],
-                        row[old_columns.index('vol')],
-                        row[old_columns.index('amount')],
-                        row[old_columns.index('pct_chg')],
-                        data_source
-                    ))
-            
-            print("✓ 表重建完成")
+            changes_sql, upsert_sql = self._compact_kline_upsert_sql()
         else:
-            # 如果字段已存在，确保有唯一索引
-            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_monthly_kline_unique ON monthly_kline(ts_code, trade_date, data_source)")
+            changes_sql, upsert_sql = self._standard_kline_upsert_sql(self._kline_source_table(data_source))
+        cursor.execute(changes_sql, (data_source,))
+        changed = cursor.fetchall()
+        if not changed:
+            cursor.execute("DELETE FROM kline_staging")
+            conn.close()
+            return 0
         
-        # 创建索引
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_monthly_kline_code ON monthly_kline(ts_code)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_monthly_kline_date ON monthly_kline(trade_date)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_monthly_kline_year_month ON monthly_kline(year, month)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stocks_delist ON stocks(delist_date)")
+        if compact:
+            # 紧凑存储：先为新的股票和数据源分配整数编号
+            cursor.execute("INSERT OR IGNORE INTO kline_source (data_source) VALUES (?)", (data_source,))
+            cursor.execute("INSERT OR IGNORE INTO kline_stock (ts_code) SELECT DISTINCT ts_code FROM kline_staging")
+        # 数据源汇总按本次涉及股票写入前后的统计增量维护（只读取这些股票的索引项）
+        stock_stats_sql = f"""
+            SELECT COUNT(*), COUNT(DISTINCT ts_code), MAX(trade_date) FROM {self._kline_source_table(data_source)}
+            WHERE data_source = ? AND ts_code IN (SELECT DISTINCT ts_code FROM kline_staging)
+        """
+        cursor.execute(stock_stats_sql, (data_source,))
+        stats_before = cursor.fetchone()
+        before = conn.total_changes
+        cursor.execute(upsert_sql, (data_source,))
+        changed_rows = conn.total_changes - before
+        cursor.execute(stock_stats_sql, (data_source,))
+        stats_after = cursor.fetchone()
+        cursor.execute("DELETE FROM kline_staging")
+        cursor.execute("""
+            INSERT INTO source_summary (data_source, data_count, stock_count, latest_date, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(data_source) DO UPDATE SET
+                data_count = data_count + excluded.data_count,
+                stock_count = stock_count + excluded.stock_count,
+                latest_date = CASE WHEN latest_date IS NULL OR excluded.latest_date > latest_date
+                                   THEN excluded.latest_date ELSE latest_date END,
+                updated_at = excluded.updated_at
+        """, (data_source, stats_after[0] - stats_before[0], stats_after[1] - stats_before[1], stats_after[2],
+              datetime.now().strftime('%Y%m%d%H%M%S')))
         
+        # 已有记录的月份被修改时，原月份的汇总也需要重算
+        changed_months = pd.DataFrame(
+            [(ts_code, month) for ts_code, new_month, old_month in changed
+             for month in {new_month, old_month} if month is not None],
+            columns=['ts_code', 'month']
+        )
+        self._refresh_seasonality(cursor, data_source, changed_months)
+        self._bump_data_generation(cursor)
         conn.commit()
         conn.close()
+        return changed_rows
     
-    def save_stocks(self, stocks_df: pd.DataFrame):
-        """保存股票基本信息"""
+    def _kline_rows(self, kline_df: pd.DataFrame) -> List[tuple]:
+        """一次性转换为 KLINE_COLUMNS 顺序的元组列表（astype(object) 把 numpy 数值转为 Python 数值，缺失值转为 None）"""
+        rows_df = kline_df.reindex(columns=self.KLINE_COLUMNS).astype(object)
+        return list(rows_df.where(pd.notna(rows_df), None).itertuples(index=False, name=None))
+    
+    def _standard_kline_upsert_sql(self, table: str = 'monthly_kline') -> Tuple[str, str]:
+        """标准存储（或分数据源存储中该数据源的表 table）：(查找变化行的SQL, 合并暂存表的SQL)，参数均为 (data_source,)"""
+        columns = ', '.join(self.KLINE_COLUMNS)
+        value_columns = [c for c in self.KLINE_COLUMNS if c not in ('ts_code', 'trade_date')]
+        changed_condition = ' OR '.join(f"k.{c} IS NOT s.{c}" for c in value_columns)
+        changes_sql = f"""
+            SELECT DISTINCT s.ts_code, s.month, k.month
+            FROM kline_staging s
+            LEFT JOIN {table} k
+                ON k.ts_code = s.ts_code AND k.trade_date = s.trade_date AND k.data_source = ?
+            WHERE k.ts_code IS NULL OR {changed_condition}
+        """
+        update_set = ', '.join(f"{c} = excluded.{c}" for c in value_columns)
+        update_condition = ' OR '.join(f"monthly_kline.{c} IS NOT excluded.{c}" for c in value_columns)
+        # WHERE true 用于消除 INSERT ... SELECT 与 ON CONFLICT 之间的语法歧义；同一键出现多次时以后出现的为准
+        upsert_sql = f"""
+            INSERT INTO {table} ({columns}, data_source)
+            SELECT {columns}, ? FROM kline_staging WHERE true ORDER BY rowid
+            ON CONFLICT(ts_code, trade_date, data_source) DO UPDATE SET {update_set}
+            WHERE {update_condition}
+        """
+        return changes_sql, upsert_sql
+    
+    def _compact_kline_upsert_sql(self) -> Tuple[str, str]:
+        """紧凑存储：(查找变化行的SQL, 合并暂存表的SQL)，按（数据源, 股票, 年月）匹配，同月以后写入的为准"""
+        value_columns = ['day'] + kline_layout.COMPACT_KLINE_VALUE_COLUMNS
+        staging_values = {
+            'period': "CAST(substr(s.trade_date, 1, 6) AS INTEGER)",
+            'day': "CAST(substr(s.trade_date, 7, 2) AS INTEGER)",
+        }
+        staging_values.update({c: f"s.{c}" for c in kline_layout.COMPACT_KLINE_VALUE_COLUMNS})
+        changed_condition = ' OR '.join(f"k.{c} IS NOT {staging_values[c]}" for c in value_columns)
+        changes_sql = f"""
+            SELECT DISTINCT s.ts_code, s.month, k.period % 100
+            FROM kline_staging s
+            LEFT JOIN kline_stock st ON st.ts_code = s.ts_code
+            LEFT JOIN monthly_kline_compact k
+                ON k.source_id = (SELECT source_id FROM kline_source WHERE data_source = ?)
+                AND k.stock_id = st.stock_id AND k.period = {staging_values['period']}
+            WHERE k.stock_id IS NULL OR {changed_condition}
+        """
+        update_set = ', '.join(f"{c} = excluded.{c}" for c in value_columns)
+        update_condition = ' OR '.join(f"monthly_kline_compact.{c} IS NOT excluded.{c}" for c in value_columns)
+        upsert_sql = f"""
+            INSERT INTO monthly_kline_compact (source_id, stock_id, period, {', '.join(value_columns)})
+            SELECT src.source_id, st.stock_id, {', '.join(staging_values[c] for c in ['period'] + value_columns)}
+            FROM kline_staging s
+            JOIN kline_stock st ON st.ts_code = s.ts_code
+            JOIN kline_source src ON src.data_source = ?
+            WHERE s.trade_date IS NOT NULL
+            ORDER BY s.rowid
+            ON CONFLICT(source_id, stock_id, period) DO UPDATE SET {update_set}
+            WHERE {update_condition}
+        """
+        return changes_sql, upsert_sql
+    
+    def kline_layout(self, cursor=None) -> str:
+        """
+        月K线的存储方式：'standard'（标准表）、'compact'（紧凑存储，monthly_kline 为视图）
+        或 'attached'（分数据源存储，monthly_kline 为各数据源文件的临时合并视图）
+        """
+        if cursor is None:
+            return self.get_system_config('kline_layout', 'standard')
+        cursor.execute("SELECT value FROM system_config WHERE key = 'kline_layout'")
+        row = cursor.fetchone()
+        return row[0] if row else 'standard'
+    
+    def convert_kline_layout(self, layout: str) -> Dict:
+        """
+        转换月K线的存储方式（见 _convert_kline_layout），返回转换统计
+        
+        转换为分数据源存储时先创建并附加各数据源的文件（ATTACH 不能在事务中执行），
+        转换完成后再在各连接上创建合并视图。转换期间应停止其他读写（各连接在下次使用时才切换到新的存储方式）。
+        """
+        if layout == 'attached' and self.kline_layout() != 'attached':
+            os.makedirs(self.kline_source_dir(), exist_ok=True)
+            for data_source in self.get_available_data_sources():
+                kline_layout.create_kline_source_file(self, self._kline_source_path(data_source))
+            self._pool.set_attachments(self._kline_source_schemas())
+        result = self._convert_kline_layout(layout)
+        self._refresh_kline_attachments()
+        return result
+    
+    @write_method
+    def _convert_kline_layout(self, layout: str) -> Dict:
+        """一个事务内整表转换月K线的存储方式（见 kline_layout.convert_kline_layout）"""
         conn = self.get_connection()
-        stocks_df.to_sql('stocks', conn, if_exists='replace', index=False)
+        cursor = conn.cursor()
+        result = kline_layout.convert_kline_layout(self, cursor, layout)
         conn.commit()
         conn.close()
+        return result
+    
+    # ---------- 分数据源存储 ----------
+    
+    def kline_source_dir(self) -> str:
+        """分数据源存储时各数据源月K线文件所在的目录（数据库文件同目录下的 <文件名>_kline）"""
+        return os.path.splitext(os.path.abspath(self.db_path))[0] + '_kline'
+    
+    def _kline_source_path(self, data_source: str) -> str:
+        kline_layout.kline_source_schema(data_source)
+        return os.path.join(self.kline_source_dir(), f"{data_source}.db")
+    
+    def _kline_source_schemas(self) -> Dict[str, str]:
+        """目录中已有的数据源文件 {模式名: 路径}"""
+        directory = self.kline_source_dir()
+        if not os.path.isdir(directory):
+            return {}
+        files = {}
+        for name in sorted(os.listdir(directory)):
+            data_source, ext = os.path.splitext(name)
+            if ext == '.db' and re.fullmatch(r'[A-Za-z0-9_]+', data_source):
+                files[kline_layout.kline_source_schema(data_source)] = os.path.join(directory, name)
+        return files
+    
+    def _refresh_kline_attachments(self):
+        """
+        按当前存储方式设置连接池附加的数据源文件：分数据源存储时附加目录中的全部数据源文件并创建合并视图，
+        其他存储方式下解除之前的附加（其他进程新增的数据源文件在本进程重新启动后附加）
+        """
+        if self.kline_layout() == 'attached':
+            schemas = self._kline_source_schemas()
+            self._pool.set_attachments(schemas, kline_layout.attached_kline_view_sql(self, schemas))
+        elif self._pool.attachments:
+            self._pool.set_attachments({}, [kline_layout.DROP_KLINE_VIEW_SQL])
+    
+    def _ensure_kline_source(self, data_source: str):
+        """分数据源存储：数据源第一次写入前创建它的文件并附加到各连接"""
+        schema = kline_layout.KLINE_SOURCE_SCHEMA_PREFIX + str(data_source)
+        if schema in self._pool.attachments or self.kline_layout() != 'attached':
+            return
+        with self._pool.schema_lock:
+            if schema not in self._pool.attachments:
+                os.makedirs(self.kline_source_dir(), exist_ok=True)
+                kline_layout.create_kline_source_file(self, self._kline_source_path(data_source))
+                self._refresh_kline_attachments()
+    
+    def _attached_kline_tables(self) -> List[str]:
+        """分数据源存储时各数据源文件中的月K线表（其他存储方式为空列表）"""
+        return [f"{schema}.monthly_kline" for schema in sorted(self._pool.attachments)]
+    
+    def _kline_source_table(self, data_source: str) -> str:
+        """单个数据源的月K线表：分数据源存储时为该数据源文件中的表（只读取该数据源的页），否则为 monthly_kline"""
+        schema = kline_layout.KLINE_SOURCE_SCHEMA_PREFIX + str(data_source)
+        if schema in self._pool.attachments:
+            return f"{schema}.monthly_kline"
+        return 'monthly_kline'
+    
+    # 覆盖模式重新获取月K线时写入的影子表（同一时间只重建一个数据源）
+    KLINE_REBUILD_TABLE = 'monthly_kline_rebuild'
     
-    def save_monthly_kline(self, kline_df: pd.DataFrame, data_source: str = 'akshare'):
-        """保存月K线数据（使用INSERT OR REPLACE避免重复，支持多数据源）"""
+    @write_method
+    def begin_kline_rebuild(self):
+        """
+        开始重建一个数据源的月K线（覆盖模式）：创建空的影子表，重新获取的数据写入影子表，
+        原有数据在 finish_kline_rebuild 整体替换之前照常提供查询
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        for idx, row in kline_df.iterrows():
-            cursor.execute("""
-                INSERT OR REPLACE INTO monthly_kline 
-                (ts_code, trade_date, year, month, open, close, high, low, vol, amount, pct_chg, data_source)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                row.get('ts_code'),
-                row.get('trade_date'),
-                row.get('year'),
-                row.get('month'),
-                row.get('open'),
-                row.get('close'),
-                row.get('high'),
-                row.get('low'),
-                row.get('vol'),
-                row.get('amount'),
-                row.get('pct_chg'),
-                data_source
-            ))
-        
+        cursor.execute(f"DROP TABLE IF EXISTS {self.KLINE_REBUILD_TABLE}")
+        cursor.execute(f"CREATE TABLE {self.KLINE_REBUILD_TABLE} ({', '.join(self.KLINE_COLUMNS)}, "
+                       f"UNIQUE(ts_code, trade_date))")
+        conn.commit()
+        conn.close()
+    
+    @write_method
+    def save_monthly_kline_rebuild(self, kline_df: pd.DataFrame) -> int:
+        """把重新获取的月K线写入影子表（同一股票同一交易日以后写入的为准），返回写入的行数"""
+        if kline_df.empty:
+            return 0
+        rows = self._kline_rows(kline_df)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(f"INSERT OR REPLACE INTO {self.KLINE_REBUILD_TABLE} ({', '.join(self.KLINE_COLUMNS)}) "
+                           f"VALUES ({', '.join('?' * len(self.KLINE_COLUMNS))})", rows)
+        conn.commit()
+        conn.close()
+        return len(rows)
+    
+    def finish_kline_rebuild(self, data_source: str) -> int:
+        """
+        用影子表替换该数据源的月K线（见 _finish_kline_rebuild），启用列式存储时该数据源的分区全部重新同步
+        （与 save_monthly_kline 相同，替换前后各标记一次）
+        """
+        self._ensure_kline_source(data_source)
+        if self.kline_store is not None:
+            conn = self.get_connection()
+            years = [row[0] for row in conn.execute(f"SELECT DISTINCT year FROM {self.KLINE_REBUILD_TABLE}")]
+            conn.close()
+            self.kline_store.replace_source(data_source, years)
+        rows, years = self._finish_kline_rebuild(data_source)
+        if rows and self.kline_store is not None:
+            self.kline_store.replace_source(data_source, years)
+        return rows
+    
+    @write_method
+    def _finish_kline_rebuild(self, data_source: str) -> Tuple[int, List[int]]:
+        """
+        在一个事务中用影子表整体替换该数据源的月K线和季节性汇总（见 kline_layout.replace_kline_source），
+        返回 (替换后的行数, 涉及的年份)；影子表为空（重新获取全部失败）时不替换，保留原有数据
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {self.KLINE_REBUILD_TABLE}")
+        rows = cursor.fetchone()[0]
+        years = []
+        if rows:
+            cursor.execute(f"SELECT DISTINCT year FROM {self.KLINE_REBUILD_TABLE}")
+            years = [row[0] for row in cursor.fetchall()]
+            kline_layout.replace_kline_source(self, cursor, data_source, self.KLINE_REBUILD_TABLE)
+            self._rebuild_source_summary(cursor, data_source)
+            self._bump_data_generation(cursor)
+        cursor.execute(f"DROP TABLE {self.KLINE_REBUILD_TABLE}")
+        conn.commit()
+        conn.close()
+        return rows, years
+    
+    @write_method
+    def abort_kline_rebuild(self):
+        """放弃重建（删除影子表），原有数据不变"""
+        conn = self.get_connection()
+        conn.cursor().execute(f"DROP TABLE IF EXISTS {self.KLINE_REBUILD_TABLE}")
         conn.commit()
         conn.close()
     
     def delete_monthly_kline_by_source(self, data_source: str):
-        """删除指定数据源的所有月K线数据"""
+        """删除指定数据源的所有月K线数据（启用列式存储时同时删除该数据源的分区，删除前先标记为待同步）"""
+        if self.kline_store is not None:
+            self.kline_store.replace_source(data_source, [])
+        deleted_count = self._delete_monthly_kline_by_source(data_source)
+        if self.kline_store is not None:
+            self.kline_store.drop_source(data_source)
+        return deleted_count
+    
+    @write_method
+    def _delete_monthly_kline_by_source(self, data_source: str):
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM monthly_kline WHERE data_source = ?", (data_source,))
-        deleted_count = cursor.rowcount
+        layout = self.kline_layout(cursor)
+        if layout == 'attached':
+            # 分数据源存储：不逐行删除，直接在该数据源的文件中重新建空表
+            schema = kline_layout.attached_kline_schemas(cursor).get(data_source)
+            deleted_count = 0
+            if schema is not None:
+                cursor.execute(f"SELECT COUNT(*) FROM {schema}.monthly_kline")
+                deleted_count = cursor.fetchone()[0]
+                kline_layout.create_kline_source_table(self, cursor, schema)
+        else:
+            if layout == 'compact':
+                cursor.execute("""
+                    DELETE FROM monthly_kline_compact
+                    WHERE source_id = (SELECT source_id FROM kline_source WHERE data_source = ?)
+                """, (data_source,))
+            else:
+                cursor.execute("DELETE FROM monthly_kline WHERE data_source = ?", (data_source,))
+            deleted_count = cursor.rowcount
+        cursor.execute("DELETE FROM monthly_seasonality WHERE data_source = ?", (data_source,))
+        cursor.execute("DELETE FROM source_summary WHERE data_source = ?", (data_source,))
+        self._bump_data_generation(cursor)
         conn.commit()
         conn.close()
         return deleted_count
@@ -340,6 +682,7 @@ class Database:
             }
         return None
     
+    @write_method
     def create_user(self, username: str, password: str, role: str = 'user', valid_until: str = None) -> int:
         """创建用户"""
         import bcrypt
@@ -359,6 +702,7 @@ class Database:
         finally:
             conn.close()
     
+    @write_method
     def update_user(self, user_id: int, username: str = None, password: str = None, 
                    role: str = None, is_active: bool = None, valid_until: str = None):
         """更新用户信息"""
@@ -400,6 +744,7 @@ class Database:
         
         conn.close()
     
+    @write_method
     def delete_user(self, user_id: int):
         """删除用户"""
         conn = self.get_connection()
@@ -431,6 +776,7 @@ class Database:
         conn.close()
         return users
     
+    @write_method
     def create_session(self, user_id: int, session_id: str, expires_at: str) -> bool:
         """创建会话"""
         conn = self.get_connection()
@@ -484,6 +830,7 @@ class Database:
             }
         return None
     
+    @write_method
     def delete_session(self, session_id: str):
         """删除会话"""
         conn = self.get_connection()
@@ -492,6 +839,7 @@ class Database:
         conn.commit()
         conn.close()
     
+    @write_method
     def cleanup_expired_sessions(self):
         """清理过期会话"""
         conn = self.get_connection()
@@ -510,6 +858,7 @@ class Database:
         conn.close()
         return row[0] if row else default
     
+    @write_method
     def set_system_config(self, key: str, value: str):
         """设置系统配置"""
         conn = self.get_connection()
@@ -536,6 +885,7 @@ class Database:
         conn.close()
         return permissions
     
+    @write_method
     def set_user_permissions(self, user_id: int, permission_codes: List[str]):
         """设置用户权限（覆盖原有权限）"""
         conn = self.get_connection()
@@ -555,6 +905,7 @@ class Database:
         conn.commit()
         conn.close()
     
+    @write_method
     def add_user_permission(self, user_id: int, permission_code: str):
         """添加单个权限"""
         conn = self.get_connection()
@@ -571,6 +922,7 @@ class Database:
         finally:
             conn.close()
     
+    @write_method
     def remove_user_permission(self, user_id: int, permission_code: str):
         """移除单个权限"""
         conn = self.get_connection()
@@ -600,100 +952,94 @@ class Database:
         conn.close()
         return count > 0
     
-    def get_stocks(self, exclude_delisted: bool = True) -> pd.DataFrame:
-        """获取股票列表"""
-        conn = self.get_connection()
-        query = "SELECT * FROM stocks"
-        if exclude_delisted:
-            query += " WHERE delist_date IS NULL OR delist_date = ''"
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
+    def stock_directory(self) -> StockDirectory:
+        """进程内共享的股票目录（股票列表版本号变化后重新加载）"""
+        return get_directory_cache(self.db_path).get(
+            lambda: int(self.get_system_config('stocks_generation', '0')),
+            self._load_stock_directory
+        )
     
-    def get_stock_by_code(self, code: str) -> Optional[Dict]:
-        """根据代码获取股票信息"""
+    def _load_stock_directory(self, generation: int, previous: Optional[StockDirectory]) -> StockDirectory:
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        # 先获取表结构，确定有哪些列
-        cursor.execute("PRAGMA table_info(stocks)")
-        columns_info = cursor.fetchall()
-        column_names = [col[1] for col in columns_info]
-        
-        # 构建查询语句
-        if column_names:
-            select_cols = ', '.join(column_names)
-            cursor.execute(f"""
-                SELECT {select_cols}
-                FROM stocks 
-                WHERE symbol = ? OR ts_code = ?
-            """, (code, code))
-        else:
-            # 如果表不存在或为空，使用默认列
-            cursor.execute("""
-                SELECT ts_code, symbol, name, list_date, delist_date, exchange 
-                FROM stocks 
-                WHERE symbol = ? OR ts_code = ?
-            """, (code, code))
-            column_names = ['ts_code', 'symbol', 'name', 'list_date', 'delist_date', 'exchange']
-        
-        row = cursor.fetchone()
+        cursor.execute("SELECT * FROM stocks")
+        columns = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
         conn.close()
-        
-        if row:
-            result = {}
-            for i, col_name in enumerate(column_names):
-                if i < len(row):
-                    result[col_name] = row[i]
-                else:
-                    result[col_name] = None
-            return result
-        return None
+        return StockDirectory(columns, rows, generation, previous)
+    
+    def get_stocks(self, exclude_delisted: bool = True) -> pd.DataFrame:
+        """获取股票列表（来自内存中的股票目录，返回副本）"""
+        return self.stock_directory().get_stocks(exclude_delisted)
+    
+    def get_stock_by_code(self, code: str) -> Optional[Dict]:
+        """根据代码获取股票信息（股票代码或完整代码）"""
+        return self.stock_directory().get(code)
     
     def search_stocks(self, keyword: str, limit: int = 20) -> List[Dict]:
-        """根据关键词搜索股票（支持代码和名称）"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """根据关键词搜索股票（支持代码、名称和名称拼音首字母，使用股票目录中的搜索索引）"""
+        return self.stock_directory().search(keyword, limit)
+    
+    def use_kline_store(self, store):
+        """启用月K线列式存储（app.kline_store.ParquetKlineStore），之后月K线的批量读取优先从列式存储读取"""
+        self.kline_store = store
+    
+    def _use_kline_store(self, data_source: str = None, ts_code: str = None) -> bool:
+        """
+        是否从列式存储读取：存储已导出且相关数据源没有待同步的分区
         
-        # 模糊搜索：匹配代码或名称
-        keyword_pattern = f"%{keyword}%"
-        cursor.execute("""
-            SELECT ts_code, symbol, name, exchange
-            FROM stocks 
-            WHERE (symbol LIKE ? OR ts_code LIKE ? OR name LIKE ?)
-            AND (delist_date IS NULL OR delist_date = '')
-            ORDER BY 
-                CASE 
-                    WHEN symbol = ? THEN 1
-                    WHEN ts_code = ? THEN 2
-                    WHEN symbol LIKE ? THEN 3
-                    WHEN ts_code LIKE ? THEN 4
-                    WHEN name LIKE ? THEN 5
-                    ELSE 6
-                END,
-                symbol
-            LIMIT ?
-        """, (keyword_pattern, keyword_pattern, keyword_pattern, 
-              keyword, keyword, f"{keyword}%", f"{keyword}%", f"{keyword}%", limit))
+        单只股票的读取（包括数据源对比）需要打开多个分区文件，按索引查询数据库更快，仍走数据库
+        """
+        if self.kline_store is None or ts_code:
+            return False
+        return self.kline_store.usable(data_source)
+    
+    def _store_result(self, df: pd.DataFrame, order_by: List[str]) -> pd.DataFrame:
+        """列式存储的读取结果转换为与数据库查询一致的类型和顺序"""
+        df['ts_code'] = df['ts_code'].astype(object)
+        df[['year', 'month']] = df[['year', 'month']].astype('int64')
+        return df.sort_values(order_by, kind='stable').reset_index(drop=True)
+    
+    def load_kline_history(self, columns: List[str], data_source: str = None, month: int = None,
+                           start_year: int = None, end_year: int = None) -> pd.DataFrame:
+        """
+        批量加载月K线历史用于分析（只读取 columns 中的列，ts_code 为分类类型以节省内存）
         
-        results = []
-        for row in cursor.fetchall():
-            results.append({
-                'ts_code': row[0],
-                'symbol': row[1],
-                'name': row[2],
-                'exchange': row[3]
-            })
+        启用列式存储时按数据源、年份分区裁剪读取，否则查询数据库
+        """
+        if self._use_kline_store(data_source):
+            return self.kline_store.read(columns=columns, data_source=data_source, month=month,
+                                         start_year=start_year, end_year=end_year)
         
+        # 分数据源存储时只读取该数据源的文件（不经过合并视图）
+        kline_table = self._kline_source_table(data_source) if data_source else 'monthly_kline'
+        query = f"SELECT {', '.join(columns)} FROM {kline_table} WHERE 1=1"
+        params = []
+        for condition, value in (("data_source = ?", data_source), ("month = ?", month),
+                                 ("year >= ?", start_year), ("year <= ?", end_year)):
+            if value:
+                query += f" AND {condition}"
+                params.append(value)
+        conn = self.get_connection()
+        df = pd.read_sql_query(query, conn, params=params)
         conn.close()
-        return results
+        if 'ts_code' in df.columns:
+            df['ts_code'] = df['ts_code'].astype('category')
+        return df
     
     def get_monthly_kline(self, ts_code: str = None, year: int = None, 
                           month: int = None, start_year: int = None, 
                           end_year: int = None, data_source: str = None) -> pd.DataFrame:
         """获取月K线数据（支持按数据源过滤）"""
+        if self._use_kline_store(data_source, ts_code):
+            df = self.kline_store.read(data_source=data_source, year=year, month=month,
+                                       start_year=start_year, end_year=end_year)
+            df = self._store_result(df, ['trade_date'])
+            df.insert(0, 'id', None)
+            return df[['id'] + self.KLINE_COLUMNS + ['data_source']]
+        
         conn = self.get_connection()
-        query = "SELECT * FROM monthly_kline WHERE 1=1"
+        query = f"SELECT id, {', '.join(self.KLINE_COLUMNS)}, data_source FROM monthly_kline WHERE 1=1"
         params = []
         
         if ts_code:
@@ -720,13 +1066,129 @@ class Database:
         conn.close()
         return df
     
+    def _code_range_condition(self, column: str, code_range: Tuple[str, Optional[str]]) -> Tuple[str, List]:
+        """股票代码区间条件 [起始代码, 结束代码)，结束代码为None表示不限（用于分块并行统计）"""
+        lo, hi = code_range
+        if hi is None:
+            return f"{column} >= ?", [lo]
+        return f"{column} >= ? AND {column} < ?", [lo, hi]
+    
+    def _seasonality_range_query(self, month: int, start_year: int = None, end_year: int = None,
+                                 data_source: str = None, ts_code: str = None,
+                                 code_range: Tuple[str, Optional[str]] = None) -> Tuple[str, List]:
+        """
+        构造按年份区间汇总季节性统计的子查询
+        
+        每只股票只取两行累计值：区间末年（<= end_year）的最后一行和起始年之前（< start_year）的最后一行，
+        两者相减即为区间内的次数与涨跌幅合计，查询开销与年份跨度无关。
+        涨跌幅合计相减后按 PCT_SUM_DECIMALS 舍入，得到与逐年相加相同的精确合计。
+        返回列：ts_code, total_count, up_count, down_count, up_pct_sum, down_pct_sum
+        """
+        conditions = ["month = ?"]
+        params = [month]
+        if data_source:
+            conditions.append("data_source = ?")
+            params.append(data_source)
+        if ts_code:
+            conditions.append("ts_code = ?")
+            params.append(ts_code)
+        if code_range:
+            condition, condition_params = self._code_range_condition("ts_code", code_range)
+            conditions.append(condition)
+            params += condition_params
+        
+        cum_columns = ['total_count', 'up_count', 'down_count', 'up_pct_sum', 'down_pct_sum']
+        select_cum = ', '.join(f"cum_{col}" for col in cum_columns)
+        
+        def range_sum(expression: str, col: str) -> str:
+            if col.endswith('_pct_sum'):
+                return f"ROUND(SUM({expression}), {self.PCT_SUM_DECIMALS}) AS {col}"
+            return f"SUM({expression}) AS {col}"
+        
+        def last_row_before(year_condition: str) -> str:
+            return f"""
+                SELECT data_source, ts_code, MAX(year) AS last_year, {select_cum}
+                FROM monthly_seasonality
+                WHERE {' AND '.join(conditions + [year_condition])}
+                GROUP BY data_source, ts_code
+            """
+        
+        query_params = list(params)
+        hi_query = last_row_before("year <= ?" if end_year else "1=1")
+        if end_year:
+            query_params.append(end_year)
+        
+        if start_year:
+            lo_join = f"""
+                LEFT JOIN ({last_row_before("year < ?")}) lo
+                ON lo.data_source = hi.data_source AND lo.ts_code = hi.ts_code
+            """
+            query_params += params + [start_year]
+            select_range = ', '.join(range_sum(f"hi.cum_{col} - COALESCE(lo.cum_{col}, 0)", col) for col in cum_columns)
+        else:
+            lo_join = ""
+            select_range = ', '.join(range_sum(f"hi.cum_{col}", col) for col in cum_columns)
+        
+        query = f"""
+            SELECT hi.ts_code, {select_range}
+            FROM ({hi_query}) hi
+            {lo_join}
+            GROUP BY hi.ts_code
+            HAVING total_count > 0
+        """
+        return query, query_params
+    
+    def get_month_statistics(self, month: int, start_year: int = None, end_year: int = None,
+                             data_source: str = None, ts_code: str = None,
+                             code_range: Tuple[str, Optional[str]] = None) -> pd.DataFrame:
+        """获取指定月份按股票汇总的涨跌统计（读取季节性汇总表，可用code_range只统计部分股票）"""
+        query, params = self._seasonality_range_query(month, start_year, end_year, data_source, ts_code,
+                                                      code_range)
+        conn = self.get_connection()
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        return df
+    
+    def get_stock_seasonality(self, ts_code: str, start_year: int = None, end_year: int = None,
+                              data_source: str = None) -> pd.DataFrame:
+        """
+        获取单只股票全部月份的逐年季节性数据（一次查询）
+        
+        返回列：year, month, pct_chg, total_count, up_count, down_count, up_pct_sum, down_pct_sum
+        """
+        query = """
+            SELECT year, month, pct_chg, total_count, up_count, down_count, up_pct_sum, down_pct_sum
+            FROM monthly_seasonality
+            WHERE ts_code = ?
+        """
+        params = [ts_code]
+        if data_source:
+            query += " AND data_source = ?"
+            params.append(data_source)
+        if start_year:
+            query += " AND year >= ?"
+            params.append(start_year)
+        if end_year:
+            query += " AND year <= ?"
+            params.append(end_year)
+        query += " ORDER BY year, month"
+        
+        conn = self.get_connection()
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        return df
+    
     def get_available_data_sources(self, ts_code: str = None) -> List[str]:
         """获取可用的数据源列表"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        tables = self._attached_kline_tables()
         if ts_code:
             cursor.execute("SELECT DISTINCT data_source FROM monthly_kline WHERE ts_code = ?", (ts_code,))
+        elif tables:
+            # 分数据源存储：每个数据源的文件只需读取一行
+            cursor.execute(" UNION ALL ".join(f"SELECT (SELECT data_source FROM {table} LIMIT 1)" for table in tables))
         else:
             cursor.execute("SELECT DISTINCT data_source FROM monthly_kline")
         
@@ -735,19 +1197,17 @@ class Database:
         return sources
     
     def get_data_source_statistics(self) -> List[Dict]:
-        """获取每个数据源的统计信息（数据量和最新日期）"""
+        """
+        获取每个数据源的统计信息（数据量、股票数、最新日期和最后更新时间）
+        
+        读取随月K线写入维护的数据源汇总表，不扫描月K线
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        # 查询每个数据源的统计信息
         cursor.execute("""
-            SELECT 
-                data_source,
-                COUNT(*) as data_count,
-                MAX(trade_date) as latest_date,
-                COUNT(DISTINCT ts_code) as stock_count
-            FROM monthly_kline
-            GROUP BY data_source
+            SELECT data_source, data_count, latest_date, stock_count, updated_at
+            FROM source_summary
+            WHERE data_count > 0
             ORDER BY data_source
         """)
         
@@ -757,7 +1217,8 @@ class Database:
                 'data_source': row[0],
                 'data_count': row[1],
                 'latest_date': row[2],
-                'stock_count': row[3]
+                'stock_count': row[3],
+                'updated_at': row[4]
             })
         
         conn.close()
@@ -790,13 +1251,38 @@ class Database:
         conn.close()
         return df
     
+    def get_latest_trade_dates(self, data_source: str) -> Dict[str, str]:
+        """
+        一次查询取出指定数据源股票表中每只股票的最新交易日期 {ts_code: trade_date}（用于生成增量更新计划）
+        
+        对股票表中的每只股票用 (ts_code, trade_date, data_source) 唯一索引只读取该股票的索引项，
+        比按数据源全量分组（GROUP BY ts_code 需要读取该数据源的全部K线）快一个数量级；
+        分数据源存储时直接查询该数据源的表（合并视图上的相关子查询无法使用索引）
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT s.ts_code,
+                   (SELECT MAX(k.trade_date) FROM {self._kline_source_table(data_source)} k
+                    WHERE k.ts_code = s.ts_code AND k.data_source = ?)
+            FROM stocks s
+        """, (data_source,))
+        latest_dates = {ts_code: trade_date for ts_code, trade_date in cursor.fetchall() if trade_date}
+        conn.close()
+        return latest_dates
+    
     def get_latest_trade_date(self, ts_code: str = None, data_source: str = None) -> Optional[str]:
         """获取最新的交易日期（支持按数据源过滤）"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        query = "SELECT MAX(trade_date) FROM monthly_kline WHERE 1=1"
+        query = f"SELECT MAX(trade_date) FROM {self._kline_source_table(data_source)} WHERE 1=1"
         params = []
+        tables = self._attached_kline_tables()
+        if tables and not ts_code and not data_source:
+            # 分数据源存储：合并视图上的 MAX 无法使用索引，改为各数据源的表分别用交易日期索引取最大值
+            query = "SELECT MAX(trade_date) FROM (" + " UNION ALL ".join(
+                f"SELECT MAX(trade_date) AS trade_date FROM {table}" for table in tables) + ")"
         
         if ts_code:
             query += " AND ts_code = ?"
@@ -811,6 +1297,7 @@ class Database:
         conn.close()
         return result[0] if result and result[0] else None
     
+    @write_method
     def save_industry(self, ts_code: str, industry_name: str, level: str, 
                      parent_code: str, industry_type: str = 'sw'):
         """保存行业分类"""
@@ -826,9 +1313,28 @@ class Database:
             INSERT OR REPLACE INTO {table} (ts_code, industry_name, level, parent_code)
             VALUES (?, ?, ?, ?)
         """, (ts_code, industry_name, level, parent_code))
+        self._bump_data_generation(cursor)
         conn.commit()
         conn.close()
     
+    def update_stock_list_date(self, code: str, list_date: str, ts_code: str = None):
+        """更新股票上市日期（按股票代码或完整代码匹配），本进程的股票目录立即重新加载"""
+        if self._update_stock_list_date(code, list_date, ts_code):
+            get_directory_cache(self.db_path).invalidate()
+    
+    @write_method
+    def _update_stock_list_date(self, code: str, list_date: str, ts_code: str = None) -> int:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE stocks SET list_date = ? WHERE symbol = ? OR ts_code = ?",
+                       (list_date, code, ts_code or code))
+        updated = cursor.rowcount
+        if updated:
+            self._bump_data_generation(cursor, 'stocks_generation')
+        conn.commit()
+        conn.close()
+        return updated
+    
     def get_industry_stocks(self, industry_name: str, industry_type: str = 'sw') -> List[str]:
         """获取行业下的股票代码列表"""
         # 白名单验证，防止SQL注入
@@ -859,8 +1365,127 @@ class Database:
         conn.close()
         return [r[0] for r in results]
     
+    def get_industry_month_statistics(self, month: int, start_year: int = None, end_year: int = None,
+                                      industry_type: str = 'sw', data_source: str = None,
+                                      code_range: Tuple[str, Optional[str]] = None) -> pd.DataFrame:
+        """获取各行业成分股指定月份的涨跌统计（行业成分与季节性汇总单次关联查询）
+        
+        使用LEFT JOIN，没有数据的成分股也会返回一行（统计列为空），用于统计行业股票数量。
+        指定code_range时只返回该代码区间内的成分股。
+        """
+        # 白名单验证，防止SQL注入
+        ALLOWED_INDUSTRY_TYPES = {'sw', 'citics'}
+        if industry_type not in ALLOWED_INDUSTRY_TYPES:
+            raise ValueError(f"Invalid industry_type: {industry_type}. Must be one of {ALLOWED_INDUSTRY_TYPES}")
+        
+        table = 'industry_sw' if industry_type == 'sw' else 'industry_citics'
+        range_query, params = self._seasonality_range_query(month, start_year, end_year, data_source,
+                                                            code_range=code_range)
+        member_condition = "1=1"
+        if code_range:
+            member_condition, condition_params = self._code_range_condition("i.ts_code", code_range)
+            params += condition_params
+        query = f"""
+            SELECT i.industry_name, i.ts_code, a.total_count, a.up_count, a.down_count,
+                   a.up_pct_sum, a.down_pct_sum
+            FROM {table} i
+            LEFT JOIN ({range_query}) a ON a.ts_code = i.ts_code
+            WHERE {member_condition}
+        """
+        conn = self.get_connection()
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        return df
+    
+    def get_industry_stocks_month_statistics(self, industry_name: str, month: int, start_year: int = None,
+                                             end_year: int = None, industry_type: str = 'sw',
+                                             data_source: str = None) -> pd.DataFrame:
+        """获取单个行业内未退市成分股指定月份的涨跌统计（成分、股票信息与季节性汇总单次关联查询）"""
+        # 白名单验证，防止SQL注入
+        ALLOWED_INDUSTRY_TYPES = {'sw', 'citics'}
+        if industry_type not in ALLOWED_INDUSTRY_TYPES:
+            raise ValueError(f"Invalid industry_type: {industry_type}. Must be one of {ALLOWED_INDUSTRY_TYPES}")
+        
+        table = 'industry_sw' if industry_type == 'sw' else 'industry_citics'
+        range_query, params = self._seasonality_range_query(month, start_year, end_year, data_source)
+        query = f"""
+            SELECT i.ts_code, s.symbol, s.name, a.total_count, a.up_count, a.down_count,
+                   a.up_pct_sum, a.down_pct_sum
+            FROM {table} i
+            JOIN stocks s ON s.ts_code = i.ts_code AND (s.delist_date IS NULL OR s.delist_date = '')
+            JOIN ({range_query}) a ON a.ts_code = i.ts_code
+            WHERE i.industry_name = ?
+            ORDER BY i.ts_code
+        """
+        conn = self.get_connection()
+        df = pd.read_sql_query(query, conn, params=params + [industry_name])
+        conn.close()
+        return df
+    
+    # ========== 数据更新状态 ==========
+    
+    # 正在运行的更新超过该时间（秒）没有刷新进度时视为已中断（如进程退出），允许重新开始更新
+    UPDATE_STALE_SECONDS = 600
+    
+    def _update_stale_before(self) -> str:
+        return (datetime.now() - timedelta(seconds=self.UPDATE_STALE_SECONDS)).strftime('%Y%m%d%H%M%S')
+    
+    @write_method
+    def try_begin_update(self, owner: str, message: str = '') -> bool:
+        """
+        获取数据更新锁：没有正在运行的更新（或上次更新已中断）时记为由 owner 运行并重置进度，返回是否获取成功
+        
+        检查和修改是同一条 UPDATE，在写事务中执行，多个 worker 同时请求时只有一个能成功
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = datetime.now().strftime('%Y%m%d%H%M%S')
+        cursor.execute("""
+            UPDATE update_progress
+            SET is_running = 1, owner = ?, current = 0, total = 100, message = ?, heartbeat_at = ?, updated_at = ?
+            WHERE id = 1 AND (is_running = 0 OR heartbeat_at IS NULL OR heartbeat_at < ?)
+        """, (owner, message, now, now, self._update_stale_before()))
+        acquired = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return acquired
+    
+    @write_method
+    def set_update_progress(self, owner: str, current: int, total: int, message: str = '',
+                            finished: bool = False):
+        """记录 owner 的更新进度并刷新心跳；finished 为 True 时释放更新锁（锁已被其他更新接管时不做修改）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = datetime.now().strftime('%Y%m%d%H%M%S')
+        cursor.execute("""
+            UPDATE update_progress
+            SET current = ?, total = ?, message = ?, heartbeat_at = ?, updated_at = ?,
+                is_running = CASE WHEN ? THEN 0 ELSE is_running END
+            WHERE id = 1 AND owner = ?
+        """, (current, total, message, now, now, finished, owner))
+        conn.commit()
+        conn.close()
+    
+    def get_update_progress(self) -> Dict:
+        """当前数据更新进度（已中断的更新显示为未运行）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT current, total, message, is_running, heartbeat_at FROM update_progress WHERE id = 1")
+        row = cursor.fetchone()
+        conn.close()
+        if row is None:
+            return {'current': 0, 'total': 100, 'message': '', 'is_running': False}
+        current, total, message, is_running, heartbeat_at = row
+        return {
+            'current': current,
+            'total': total,
+            'message': message,
+            'is_running': bool(is_running) and heartbeat_at is not None and heartbeat_at >= self._update_stale_before()
+        }
+    
     # ========== 公告管理方法 ==========
     
+    @write_method
     def create_announcement(self, title: str, content: str, created_by: int, is_pinned: int = 0) -> int:
         """创建公告"""
         conn = self.get_connection()
@@ -939,6 +1564,7 @@ class Database:
             })
         return announcements
     
+    @write_method
     def update_announcement(self, announcement_id: int, title: str, content: str, is_pinned: int = 0):
         """更新公告"""
         conn = self.get_connection()
@@ -952,6 +1578,7 @@ class Database:
         conn.commit()
         conn.close()
     
+    @write_method
     def delete_announcement(self, announcement_id: int):
         """删除公告"""
         conn = self.get_connection()
@@ -0,0 +1,293 @@
+"""
+月K线存储方式
+
+标准表、紧凑存储（整数编号 + 按数据源、股票、年月聚簇的 WITHOUT ROWID 表）和分数据源存储（每个数据源一个文件，
+附加到连接上，由临时视图 monthly_kline 合并）的表结构，以及存储方式的识别、转换和按数据源整体替换月K线。
+
+这些是运行时代码，随 Database 的字段、索引列表一起演进；编号迁移（migrations）只使用各自发布时写定的SQL，不引用本模块。
+"""
+import re
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+# 月K线表定义（{name} 为表名，重建表时先创建新表）
+MONTHLY_KLINE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts_code TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        open REAL,
+        close REAL,
+        high REAL,
+        low REAL,
+        vol REAL,
+        amount REAL,
+        pct_chg REAL,
+        data_source TEXT DEFAULT 'akshare',
+        UNIQUE(ts_code, trade_date, data_source)
+    )
+"""
+
+# 紧凑存储的月K线值字段（交易日拆为整数年月 period=yyyymm 和日 day）
+COMPACT_KLINE_VALUE_COLUMNS = ['open', 'close', 'high', 'low', 'vol', 'amount', 'pct_chg']
+
+# 紧凑存储：股票和数据源使用整数编号，K线表按（数据源, 股票, 年月）聚簇，每个（数据源, 股票, 月份）一行
+KLINE_ID_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS kline_stock (
+        stock_id INTEGER PRIMARY KEY,
+        ts_code TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS kline_source (
+        source_id INTEGER PRIMARY KEY,
+        data_source TEXT NOT NULL UNIQUE
+    )
+    """,
+]
+
+# 紧凑存储的K线表定义（{name} 为表名，重建表时先创建新表）
+COMPACT_KLINE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        source_id INTEGER NOT NULL,
+        stock_id INTEGER NOT NULL,
+        period INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        open REAL,
+        close REAL,
+        high REAL,
+        low REAL,
+        vol REAL,
+        amount REAL,
+        pct_chg REAL,
+        PRIMARY KEY (source_id, stock_id, period)
+    ) WITHOUT ROWID
+"""
+
+# 按股票跨数据源查询（数据源对比）
+COMPACT_KLINE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_kline_compact_stock ON monthly_kline_compact(stock_id, period)"
+
+# 紧凑存储时的 monthly_kline 视图：字段与标准表一致（没有自增id），原有查询无需修改
+COMPACT_KLINE_VIEW_SQL = f"""
+    CREATE VIEW IF NOT EXISTS monthly_kline AS
+    SELECT NULL AS id, st.ts_code, CAST(k.period * 100 + k.day AS TEXT) AS trade_date,
+           k.period / 100 AS year, k.period % 100 AS month,
+           {', '.join('k.' + c for c in COMPACT_KLINE_VALUE_COLUMNS)}, src.data_source
+    FROM monthly_kline_compact k
+    JOIN kline_stock st ON st.stock_id = k.stock_id
+    JOIN kline_source src ON src.source_id = k.source_id
+"""
+
+# 分数据源存储：每个数据源的月K线是单独文件中的标准表，附加到每个连接的模式名为 kline_<数据源>，
+# 各连接上的临时视图 monthly_kline 把各数据源的表 UNION ALL 起来，原有查询无需修改
+KLINE_SOURCE_SCHEMA_PREFIX = 'kline_'
+DROP_KLINE_VIEW_SQL = "DROP VIEW IF EXISTS temp.monthly_kline"
+
+KLINE_LAYOUTS = ('standard', 'compact', 'attached')
+
+
+def _insert_compact_rows(cursor, table: str, select_sql: str, params=()):
+    """
+    把标准字段的K线行（select_sql 返回 ts_code、trade_date、各值字段和 data_source）写入紧凑存储的K线表
+    
+    先为新的股票和数据源分配编号；按交易日顺序写入，同一月份较晚的交易日覆盖较早的
+    """
+    cursor.execute(f"INSERT OR IGNORE INTO kline_source (data_source) "
+                   f"SELECT DISTINCT data_source FROM ({select_sql}) ORDER BY data_source", params)
+    cursor.execute(f"INSERT OR IGNORE INTO kline_stock (ts_code) "
+                   f"SELECT DISTINCT ts_code FROM ({select_sql}) ORDER BY ts_code", params)
+    cursor.execute(f"""
+        INSERT OR REPLACE INTO {table}
+            (source_id, stock_id, period, day, {', '.join(COMPACT_KLINE_VALUE_COLUMNS)})
+        SELECT src.source_id, st.stock_id,
+               CAST(substr(k.trade_date, 1, 6) AS INTEGER), CAST(substr(k.trade_date, 7, 2) AS INTEGER),
+               {', '.join('k.' + c for c in COMPACT_KLINE_VALUE_COLUMNS)}
+        FROM ({select_sql}) k
+        JOIN kline_stock st ON st.ts_code = k.ts_code
+        JOIN kline_source src ON src.data_source = k.data_source
+        ORDER BY k.trade_date
+    """, params)
+
+
+def kline_source_schema(data_source: str) -> str:
+    """分数据源存储时数据源文件附加到连接上的模式名（数据源名称同时用作文件名，只允许字母、数字和下划线）"""
+    if not re.fullmatch(r'[A-Za-z0-9_]+', data_source or ''):
+        raise ValueError(f"数据源名称不能用于分数据源存储: {data_source}")
+    return KLINE_SOURCE_SCHEMA_PREFIX + data_source
+
+
+def attached_kline_view_sql(db, schemas: Iterable[str]) -> List[str]:
+    """分数据源存储时在每个连接上执行的语句：重新创建临时视图 monthly_kline（各数据源表的 UNION ALL）"""
+    selects = [f"SELECT * FROM {schema}.monthly_kline" for schema in sorted(schemas)]
+    if not selects:
+        # 还没有任何数据源时使用字段相同的空视图
+        columns = ', '.join(f"NULL AS {c}" for c in ['id'] + db.KLINE_COLUMNS + ['data_source'])
+        selects = [f"SELECT {columns} WHERE 0"]
+    return [DROP_KLINE_VIEW_SQL, f"CREATE TEMP VIEW monthly_kline AS {' UNION ALL '.join(selects)}"]
+
+
+def create_kline_source_table(db, cursor, schema: str = 'main'):
+    """（重新）创建一个数据源文件中的空月K线表及其索引（表已存在时先删除）"""
+    cursor.execute(f"DROP TABLE IF EXISTS {schema}.monthly_kline")
+    cursor.execute(MONTHLY_KLINE_TABLE_SQL.format(name=f"{schema}.monthly_kline"))
+    for name, definition in db.INDEXES.items():
+        if definition.startswith('monthly_kline('):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.{name} ON {definition}")
+
+
+def create_kline_source_file(db, path: str):
+    """创建一个数据源的月K线文件（WAL模式、空的月K线表），文件已存在时不做修改"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'monthly_kline'")
+        if cursor.fetchone() is None:
+            create_kline_source_table(db, cursor)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def attached_kline_schemas(cursor) -> Dict[str, str]:
+    """当前连接上附加的数据源文件 {数据源: 模式名}"""
+    cursor.execute("PRAGMA database_list")
+    return {name[len(KLINE_SOURCE_SCHEMA_PREFIX):]: name for _, name, _ in cursor.fetchall()
+            if name.startswith(KLINE_SOURCE_SCHEMA_PREFIX)}
+
+
+def current_kline_layout(cursor) -> str:
+    """按主库中 monthly_kline 的类型判断存储方式：表为标准存储，视图为紧凑存储，不存在（只有临时视图）为分数据源存储"""
+    cursor.execute("SELECT type FROM main.sqlite_master WHERE name = 'monthly_kline'")
+    row = cursor.fetchone()
+    if row is None:
+        return 'attached'
+    return 'compact' if row[0] == 'view' else 'standard'
+
+
+def convert_kline_layout(db, cursor, layout: str) -> dict:
+    """
+    在标准表、紧凑存储和分数据源存储之间转换月K线（需在写事务中调用），返回 {'layout', 'rows', 'converted'}
+    
+    转换为紧凑存储时同一（数据源, 股票, 月份）有多个交易日的记录只保留交易日最晚的一条。
+    紧凑存储下 monthly_kline 是视图，分数据源存储下主库中没有 monthly_kline，
+    之后新增的迁移如需修改月K线表，应先转换回标准表。
+    
+    转换为分数据源存储前，各数据源的文件须已附加到写连接（见 Database.convert_kline_layout）；
+    转换回其他存储方式后数据源文件保持不变（不再附加），可在服务重启后删除。
+    紧凑存储与分数据源存储之间经由标准表转换。
+    """
+    if layout not in KLINE_LAYOUTS:
+        raise ValueError(f"不支持的存储方式: {layout}")
+    current = current_kline_layout(cursor)
+    if current == layout:
+        cursor.execute("SELECT COUNT(*) FROM monthly_kline")
+        return {'layout': layout, 'rows': cursor.fetchone()[0], 'converted': False}
+    if 'standard' not in (current, layout):
+        convert_kline_layout(db, cursor, 'standard')
+        current = 'standard'
+    
+    kline_columns = ', '.join(db.KLINE_COLUMNS)
+    cursor.execute("SELECT COUNT(*) FROM monthly_kline")
+    rows = cursor.fetchone()[0]
+    if layout == 'attached':
+        schemas = attached_kline_schemas(cursor)
+        cursor.execute("SELECT DISTINCT data_source FROM main.monthly_kline")
+        sources = [row[0] for row in cursor.fetchall()]
+        missing = [source for source in sources if source not in schemas]
+        if missing:
+            raise ValueError(f"数据源文件未附加: {missing}")
+        for source in sources:
+            create_kline_source_table(db, cursor, schemas[source])
+            cursor.execute(f"""
+                INSERT INTO {schemas[source]}.monthly_kline (id, {kline_columns}, data_source)
+                SELECT id, {kline_columns}, data_source FROM main.monthly_kline
+                WHERE data_source = ?
+                ORDER BY ts_code, trade_date
+            """, (source,))
+        cursor.execute("DROP TABLE main.monthly_kline")
+    elif current == 'attached':
+        # 各数据源文件的自增id相互独立，合并时重新编号
+        cursor.execute("DROP TABLE IF EXISTS main.monthly_kline_new")
+        cursor.execute(MONTHLY_KLINE_TABLE_SQL.format(name='main.monthly_kline_new'))
+        cursor.execute(f"""
+            INSERT INTO main.monthly_kline_new ({kline_columns}, data_source)
+            SELECT {kline_columns}, data_source FROM temp.monthly_kline
+            ORDER BY data_source, ts_code, trade_date
+        """)
+        cursor.execute(DROP_KLINE_VIEW_SQL)
+        cursor.execute("ALTER TABLE main.monthly_kline_new RENAME TO monthly_kline")
+        db._create_indexes(cursor)
+    elif layout == 'compact':
+        for sql in KLINE_ID_TABLES_SQL:
+            cursor.execute(sql)
+        cursor.execute(COMPACT_KLINE_TABLE_SQL.format(name='monthly_kline_compact'))
+        cursor.execute(COMPACT_KLINE_INDEX_SQL)
+        _insert_compact_rows(cursor, 'monthly_kline_compact', "SELECT * FROM monthly_kline")
+        cursor.execute("DROP TABLE monthly_kline")
+        cursor.execute(COMPACT_KLINE_VIEW_SQL)
+        # 同一月份重复的记录已合并，季节性汇总全量重新生成
+        cursor.execute("DELETE FROM monthly_seasonality")
+        cursor.execute(db._seasonality_insert_sql("1=1"))
+        db._rebuild_source_summary(cursor)
+        cursor.execute("SELECT COUNT(*) FROM monthly_kline")
+        rows = cursor.fetchone()[0]
+    else:
+        cursor.execute("DROP TABLE IF EXISTS monthly_kline_new")
+        cursor.execute(MONTHLY_KLINE_TABLE_SQL.format(name='monthly_kline_new'))
+        cursor.execute(f"""
+            INSERT INTO monthly_kline_new ({kline_columns}, data_source)
+            SELECT {kline_columns}, data_source FROM monthly_kline
+            ORDER BY data_source, ts_code, trade_date
+        """)
+        cursor.execute("DROP VIEW monthly_kline")
+        for table in ('monthly_kline_compact', 'kline_stock', 'kline_source'):
+            cursor.execute(f"DROP TABLE {table}")
+        cursor.execute("ALTER TABLE monthly_kline_new RENAME TO monthly_kline")
+        db._create_indexes(cursor)
+    
+    cursor.execute("""
+        INSERT OR REPLACE INTO system_config (key, value, updated_at) VALUES ('kline_layout', ?, ?)
+    """, (layout, datetime.now().strftime('%Y%m%d%H%M%S')))
+    # 查询结果缓存随数据版本号失效
+    db._bump_data_generation(cursor)
+    return {'layout': layout, 'rows': rows, 'converted': True}
+
+
+def replace_kline_source(db, cursor, data_source: str, rebuild_table: str):
+    """
+    用 rebuild_table（KLINE_COLUMNS 字段）中的数据整体替换一个数据源的月K线和季节性汇总（需在写事务中调用）
+    
+    只删除并重新写入该数据源的行（其他数据源的数据和索引不动），季节性汇总也只重新生成该数据源的部分；
+    分数据源存储时在该数据源的文件中重新建表写入。其他连接在提交前读到的都是替换前的数据。
+    """
+    kline_columns = ', '.join(db.KLINE_COLUMNS)
+    layout = current_kline_layout(cursor)
+    kline_table = 'monthly_kline'
+    if layout == 'attached':
+        schema = attached_kline_schemas(cursor)[data_source]
+        kline_table = f"{schema}.monthly_kline"
+        create_kline_source_table(db, cursor, schema)
+        cursor.execute(f"""
+            INSERT INTO {schema}.monthly_kline ({kline_columns}, data_source)
+            SELECT {kline_columns}, ? FROM {rebuild_table} ORDER BY rowid
+        """, (data_source,))
+    elif layout == 'compact':
+        cursor.execute("""
+            DELETE FROM monthly_kline_compact
+            WHERE source_id = (SELECT source_id FROM kline_source WHERE data_source = ?)
+        """, (data_source,))
+        _insert_compact_rows(cursor, 'monthly_kline_compact',
+                             f"SELECT {kline_columns}, ? AS data_source FROM {rebuild_table}", (data_source,))
+    else:
+        cursor.execute("DELETE FROM monthly_kline WHERE data_source = ?", (data_source,))
+        cursor.execute(f"""
+            INSERT INTO monthly_kline ({kline_columns}, data_source)
+            SELECT {kline_columns}, ? FROM {rebuild_table} ORDER BY rowid
+        """, (data_source,))
+    
+    cursor.execute("DELETE FROM monthly_seasonality WHERE data_source = ?", (data_source,))
+    cursor.execute(db._seasonality_insert_sql("data_source = ?", kline_table=kline_table), (data_source,))
@@ -0,0 +1,330 @@
+"""
+月K线列式存储（可选的月K线历史读取后端，需要 pyarrow）
+
+月K线历史按 数据源/年份 分区保存为 Parquet 文件（kline_dir/data_source=akshare/year=2024/part.parquet），
+文件内按 (ts_code, trade_date) 排序，ts_code 字典编码。读取时按分区裁剪并只读取需要的列，
+如某个月份的统计只读取所需数据源、年份分区中的 ts_code、year、pct_chg 三列。
+
+单只股票的读取按索引查询数据库更快，不使用列式存储。
+SQLite 仍是月K线的权威来源：保存或删除月K线前后都把涉及的分区记为待同步（记录在 manifest.json 中，
+所有 worker 可见），数据更新结束后再从数据库整体改写这些分区。存在待同步分区的数据源读取时退回数据库。
+每次标记都使该数据源的标记序号加1，同步时只清除开始同步后没有再被标记的数据源，
+同步读取数据库之后才提交的写入不会被误认为已同步。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+class ParquetKlineStore:
+    """按数据源和年份分区的月K线 Parquet 文件"""
+    
+    # 文件中保存的字段（data_source 和 year 由分区目录表示）
+    FILE_COLUMNS = ['ts_code', 'trade_date', 'month', 'open', 'close', 'high', 'low', 'vol', 'amount', 'pct_chg']
+    MANIFEST_FILE = 'manifest.json'
+    PART_FILE = 'part.parquet'
+    # 行组大小：按 ts_code 排序后，单只股票的读取可借助行组统计信息跳过其他行组
+    ROW_GROUP_SIZE = 8192
+    # 检查 manifest 是否更新的最小间隔（秒）
+    RELOAD_CHECK_INTERVAL = 1.0
+    
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        # _lock 保护 manifest 的读-改-写（持有时间很短）；_sync_lock 使同一进程内的分区改写依次进行，
+        # 改写期间不持有 _lock，读取和记录待同步分区不需要等待；_dataset_lock 只保护目录发现结果的替换
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._dataset_lock = threading.Lock()
+        self._manifest: Optional[Dict] = None
+        self._manifest_mtime = None
+        self._last_check = float('-inf')
+        self._cached_dataset = None
+        if PYARROW_AVAILABLE:
+            self._partitioning = ds.partitioning(
+                pa.schema([('data_source', pa.string()), ('year', pa.int32())]), flavor='hive'
+            )
+            self._format = ds.ParquetFileFormat(read_options={'dictionary_columns': ['ts_code']})
+    
+    # ========== manifest ==========
+    
+    def _manifest_path(self) -> str:
+        return os.path.join(self.store_dir, self.MANIFEST_FILE)
+    
+    def manifest(self) -> Optional[Dict]:
+        """当前 manifest（未导出过时为None）；其他进程修改后最多 RELOAD_CHECK_INTERVAL 秒内生效"""
+        now = time.monotonic()
+        if now - self._last_check < self.RELOAD_CHECK_INTERVAL:
+            return self._manifest
+        try:
+            mtime = os.stat(self._manifest_path()).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._manifest_mtime:
+            try:
+                with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+            except (OSError, ValueError):
+                self._manifest = None
+            self._manifest_mtime = mtime
+        self._last_check = now
+        return self._manifest
+    
+    def _write_manifest(self, manifest: Dict):
+        """先写临时文件再替换（调用方持有 self._lock）"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = f"{self._manifest_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self._manifest_path())
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(self._manifest_path()).st_mtime_ns
+        self._last_check = time.monotonic()
+    
+    def _current_manifest(self) -> Optional[Dict]:
+        """立即重新读取 manifest（写入前调用，避免覆盖其他进程的修改）"""
+        self._last_check = float('-inf')
+        manifest = self.manifest()
+        return json.loads(json.dumps(manifest)) if manifest is not None else None
+    
+    @property
+    def is_ready(self) -> bool:
+        """是否已完成首次导出"""
+        return self.manifest() is not None
+    
+    def usable(self, data_source: str = None) -> bool:
+        """是否可以从列式存储读取（指定数据源时只要求该数据源没有待同步的分区）"""
+        manifest = self.manifest()
+        if manifest is None:
+            return False
+        dirty = manifest.get('dirty', {})
+        return not dirty if data_source is None else data_source not in dirty
+    
+    def mark_dirty(self, data_source: str, years: Iterable[int]):
+        """
+        记录数据库中将要修改或已修改、尚未同步的分区（写入前后各调用一次，重复标记没有副作用）
+        
+        分区已在待同步列表中时也使标记序号加1，正在进行的同步据此保留这些分区
+        """
+        years = {int(y) for y in years if pd.notna(y)}
+        with self._lock:
+            manifest = self._current_manifest()
+            if manifest is None or not years:
+                return
+            dirty = manifest.setdefault('dirty', {})
+            dirty[data_source] = sorted(set(dirty.get(data_source, [])) | years)
+            sequence = manifest.setdefault('dirty_seq', {})
+            sequence[data_source] = sequence.get(data_source, 0) + 1
+            self._write_manifest(manifest)
+    
+    @staticmethod
+    def _remaining_dirty(latest: Dict, snapshot: Optional[Dict], synced: Dict[str, Optional[List[int]]]) -> Dict:
+        """
+        同步完成后仍待同步的分区：snapshot 为同步开始时的 manifest，synced 为已改写的 {数据源: 年份}（None 表示全部）；
+        同步期间又被标记过（标记序号变化）的数据源保留全部待同步分区
+        """
+        start_sequence = (snapshot or {}).get('dirty_seq', {})
+        latest_sequence = latest.get('dirty_seq', {})
+        remaining = {}
+        for data_source, years in latest.get('dirty', {}).items():
+            if data_source in synced and latest_sequence.get(data_source) == start_sequence.get(data_source):
+                years = [] if synced[data_source] is None else sorted(set(years) - set(synced[data_source]))
+            if years:
+                remaining[data_source] = years
+        return remaining
+    
+    def replace_source(self, data_source: str, years: Iterable[int]):
+        """数据源被整体替换：新数据涉及的年份和磁盘上该数据源已有的分区全部记为待同步"""
+        source_dir = os.path.join(self.store_dir, f"data_source={data_source}")
+        existing = [int(name[len('year='):]) for name in os.listdir(source_dir)
+                    if name.startswith('year=')] if os.path.isdir(source_dir) else []
+        self.mark_dirty(data_source, list(years) + existing)
+    
+    # ========== 写入 ==========
+    
+    def _partition_dir(self, data_source: str, year: int) -> str:
+        return os.path.join(self.store_dir, f"data_source={data_source}", f"year={int(year)}")
+    
+    def _write_partition(self, data_source: str, year: int, kline_df: pd.DataFrame):
+        """整体改写一个分区（先写临时文件再替换，读取方不会读到写了一半的文件）"""
+        partition_dir = self._partition_dir(data_source, year)
+        path = os.path.join(partition_dir, self.PART_FILE)
+        if kline_df.empty:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(partition_dir, exist_ok=True)
+        kline_df = kline_df.sort_values(['ts_code', 'trade_date'], kind='stable')
+        table = pa.Table.from_pandas(kline_df[self.FILE_COLUMNS], preserve_index=False)
+        # 临时文件以"."开头，读取时的目录发现会忽略它
+        tmp_path = os.path.join(partition_dir, f".{self.PART_FILE}.{os.getpid()}.tmp")
+        pq.write_table(table, tmp_path, row_group_size=self.ROW_GROUP_SIZE, use_dictionary=['ts_code'],
+                       compression='zstd')
+        os.replace(tmp_path, path)
+    
+    def _partition_dirs(self) -> List[str]:
+        """磁盘上现有的全部分区目录"""
+        if not os.path.isdir(self.store_dir):
+            return []
+        return [os.path.join(self.store_dir, source_name, year_name)
+                for source_name in os.listdir(self.store_dir) if source_name.startswith('data_source=')
+                for year_name in os.listdir(os.path.join(self.store_dir, source_name))
+                if year_name.startswith('year=')]
+    
+    def _read_source_from_database(self, db, data_source: str, years: List[int] = None) -> pd.DataFrame:
+        query = (f"SELECT year, {', '.join(self.FILE_COLUMNS)} FROM {db._kline_source_table(data_source)} "
+                 f"WHERE data_source = ?")
+        params = [data_source]
+        if years:
+            query += f" AND year IN ({', '.join('?' * len(years))})"
+            params += years
+        conn = db.get_connection()
+        try:
+            return pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+    
+    def rebuild(self, db) -> int:
+        """从数据库全量导出全部数据源（删除原有分区），返回导出的行数"""
+        with self._sync_lock:
+            with self._lock:
+                snapshot = self._current_manifest()
+            sources = db.get_available_data_sources()
+            rows = 0
+            written = set()
+            for data_source in sources:
+                source_df = self._read_source_from_database(db, data_source)
+                for year, year_df in source_df.groupby('year'):
+                    self._write_partition(data_source, year, year_df)
+                    written.add(self._partition_dir(data_source, year))
+                rows += len(source_df)
+            # 最后删除数据库中已没有数据的分区（不先清空目录，其他进程同时导出时不会删掉对方刚写入的文件）
+            for partition_dir in self._partition_dirs():
+                if partition_dir not in written:
+                    shutil.rmtree(partition_dir, ignore_errors=True)
+            with self._lock:
+                latest = self._current_manifest() or {}
+                self._write_manifest({
+                    'exported_at': time.strftime('%Y%m%d%H%M%S'),
+                    # 全部分区都已按数据库重写或删除，只保留导出期间又被标记的数据源
+                    'dirty': self._remaining_dirty(latest, snapshot, dict.fromkeys(latest.get('dirty', {}))),
+                    'dirty_seq': latest.get('dirty_seq', {}),
+                })
+        print(f"✓ 月K线列式存储导出完成: {len(sources)} 个数据源, {rows} 行")
+        return rows
+    
+    def sync(self, db) -> int:
+        """从数据库改写待同步的分区，返回改写的分区数"""
+        with self._sync_lock:
+            with self._lock:
+                manifest = self._current_manifest()
+            if manifest is None or not manifest.get('dirty'):
+                return 0
+            count = 0
+            for data_source, years in manifest['dirty'].items():
+                source_df = self._read_source_from_database(db, data_source, years)
+                groups = dict(tuple(source_df.groupby('year')))
+                for year in years:
+                    self._write_partition(data_source, year, groups.get(year, source_df.iloc[0:0]))
+                    count += 1
+            # 同步期间又被标记的数据源保留到下次同步
+            with self._lock:
+                latest = self._current_manifest()
+                latest['dirty'] = self._remaining_dirty(latest, manifest, manifest['dirty'])
+                self._write_manifest(latest)
+        return count
+    
+    def drop_source(self, data_source: str):
+        """删除一个数据源的全部分区"""
+        with self._lock:
+            manifest = self._current_manifest()
+            if manifest is None:
+                return
+            source_dir = os.path.join(self.store_dir, f"data_source={data_source}")
+            if os.path.isdir(source_dir):
+                shutil.rmtree(source_dir)
+            manifest.get('dirty', {}).pop(data_source, None)
+            self._write_manifest(manifest)
+    
+    # ========== 读取 ==========
+    
+    def read(self, columns: List[str] = None, data_source: str = None, ts_code: str = None,
+             year: int = None, month: int = None, start_year: int = None, end_year: int = None) -> pd.DataFrame:
+        """
+        按条件读取月K线（数据源和年份条件用于分区裁剪，只读取 columns 中的列）
+        
+        columns 可包含 data_source 和 year；默认返回全部字段。ts_code 列为 pandas 分类类型。
+        """
+        if columns is None:
+            columns = ['ts_code', 'trade_date', 'year', 'month', 'open', 'close', 'high', 'low', 'vol',
+                       'amount', 'pct_chg', 'data_source']
+        conditions = []
+        if data_source:
+            conditions.append(ds.field('data_source') == data_source)
+        if year:
+            conditions.append(ds.field('year') == year)
+        if start_year:
+            conditions.append(ds.field('year') >= start_year)
+        if end_year:
+            conditions.append(ds.field('year') <= end_year)
+        if month:
+            conditions.append(ds.field('month') == month)
+        if ts_code:
+            conditions.append(ds.field('ts_code') == ts_code)
+        condition = None
+        for c in conditions:
+            condition = c if condition is None else condition & c
+        
+        try:
+            table = self._dataset().to_table(columns=columns, filter=condition)
+        except (OSError, pa.ArrowException):
+            # 分区文件在上次目录发现之后被其他进程删除或替换：重新发现后再读一次
+            table = self._dataset(refresh=True).to_table(columns=columns, filter=condition)
+        return table.to_pandas()
+    
+    def _dataset(self, refresh: bool = False):
+        """分区文件列表（目录发现的结果在 manifest 变化前复用）"""
+        manifest = self.manifest()
+        key = self._manifest_mtime
+        with self._dataset_lock:
+            cached = self._cached_dataset
+        if refresh or cached is None or cached[0] != key:
+            # 目录发现不持有锁，完成后只替换缓存的引用
+            dataset = ds.dataset(self.store_dir, format=self._format, partitioning=self._partitioning,
+                                 exclude_invalid_files=False,
+                                 ignore_prefixes=['.', '_', self.MANIFEST_FILE]) if manifest else None
+            cached = (key, dataset)
+            with self._dataset_lock:
+                self._cached_dataset = cached
+        dataset = cached[1]
+        if dataset is None:
+            raise FileNotFoundError(f"月K线列式存储尚未导出: {self.store_dir}")
+        return dataset
+
+
+_stores: Dict[str, ParquetKlineStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_kline_store(db_path: str, store_dir: str = None) -> ParquetKlineStore:
+    """获取数据库对应的列式存储（默认与数据库文件放在同一目录的 kline_parquet/，同一进程内共用）"""
+    if store_dir is None:
+        store_dir = os.getenv("KLINE_STORE_DIR") or os.path.join(
+            os.path.dirname(os.path.abspath(db_path)), 'kline_parquet'
+        )
+    key = os.path.abspath(store_dir)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ParquetKlineStore(store_dir)
+        return _stores[key]
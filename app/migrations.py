@@ -0,0 +1,425 @@
+"""
+数据库结构迁移
+
+schema_version 表记录已执行的迁移版本。每个迁移只执行一次，全部待执行的迁移在同一个事务中完成，
+任一迁移失败则整体回滚；数据库已是最新版本时启动只需一次版本查询。
+
+在引入版本记录之前创建的数据库从版本0开始逐个执行，因此早期迁移都按"检查后再修改"的方式编写，
+对已有的表和数据重复执行不会产生影响。新的结构变更请在 MIGRATIONS 末尾追加新版本，不要修改已发布的迁移。
+
+迁移函数只使用本函数内写定的SQL（发布时的版本），不调用 Database 的方法或引用其字段、索引列表，
+否则这些代码以后修改时，旧数据库升级执行的会是新的SQL，而不是当初发布的迁移。
+月K线存储方式的转换等运行时的表结构操作不属于编号迁移，见 kline_layout 模块。
+"""
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+# 股票基本信息表定义（{name} 为表名）
+STOCKS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        ts_code TEXT PRIMARY KEY,
+        symbol TEXT NOT NULL,
+        name TEXT NOT NULL,
+        area TEXT,
+        industry TEXT,
+        list_date TEXT,
+        delist_date TEXT,
+        is_hs TEXT,
+        exchange TEXT
+    )
+"""
+
+# 月K线表定义（{name} 为表名，重建表时先创建新表；迁移1、2发布时的版本，运行时的定义见 kline_layout）
+MONTHLY_KLINE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts_code TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        open REAL,
+        close REAL,
+        high REAL,
+        low REAL,
+        vol REAL,
+        amount REAL,
+        pct_chg REAL,
+        data_source TEXT DEFAULT 'akshare',
+        UNIQUE(ts_code, trade_date, data_source)
+    )
+"""
+
+
+# 月度季节性汇总表定义（{name} 为表名）：每个（数据源, 股票, 月份, 年份）一行，
+# 同时保存按年份累计的次数和涨跌幅合计，任意年份区间只需两次累计值查找
+SEASONALITY_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        data_source TEXT NOT NULL,
+        ts_code TEXT NOT NULL,
+        month INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        pct_chg REAL,
+        total_count INTEGER NOT NULL,
+        up_count INTEGER NOT NULL,
+        down_count INTEGER NOT NULL,
+        up_pct_sum REAL NOT NULL,
+        down_pct_sum REAL NOT NULL,
+        cum_total_count INTEGER NOT NULL,
+        cum_up_count INTEGER NOT NULL,
+        cum_down_count INTEGER NOT NULL,
+        cum_up_pct_sum REAL NOT NULL,
+        cum_down_pct_sum REAL NOT NULL,
+        PRIMARY KEY (data_source, month, ts_code, year)
+    ) WITHOUT ROWID
+"""
+
+def _create_base_tables(db, cursor):
+    """基础表结构、默认管理员账号和默认系统配置"""
+    # 股票基本信息表
+    cursor.execute(STOCKS_TABLE_SQL.format(name='stocks'))
+    
+    # 行业分类表（申万）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS industry_sw (
+            ts_code TEXT,
+            industry_name TEXT,
+            level TEXT,
+            parent_code TEXT,
+            PRIMARY KEY (ts_code, industry_name)
+        )
+    """)
+    
+    # 行业分类表（中信）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS industry_citics (
+            ts_code TEXT,
+            industry_name TEXT,
+            level TEXT,
+            parent_code TEXT,
+            PRIMARY KEY (ts_code, industry_name)
+        )
+    """)
+    
+    # 用户表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'user',
+            is_active INTEGER NOT NULL DEFAULT 1,
+            valid_until TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT
+        )
+    """)
+    
+    # 会话表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expires_at TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    
+    # 系统配置表（用于存储会话时长等系统配置）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS system_config (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT
+        )
+    """)
+    
+    # 用户权限表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_permissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            permission_code TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            UNIQUE(user_id, permission_code)
+        )
+    """)
+    
+    # 初始化默认管理员账号（如果不存在）
+    cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
+    if cursor.fetchone()[0] == 0:
+        import bcrypt
+        password_hash = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        cursor.execute("""
+            INSERT INTO users (username, password_hash, role, is_active, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, ('admin', password_hash, 'admin', 1, datetime.now().strftime('%Y%m%d%H%M%S')))
+    
+    # 初始化系统配置（会话时长，默认24小时）
+    cursor.execute("SELECT COUNT(*) FROM system_config WHERE key = 'session_duration_hours'")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO system_config (key, value, updated_at)
+            VALUES (?, ?, ?)
+        """, ('session_duration_hours', '24', datetime.now().strftime('%Y%m%d%H%M%S')))
+    
+    # 公告表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS announcements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            is_pinned INTEGER NOT NULL DEFAULT 0,
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    """)
+    
+    # 月K线数据表
+    cursor.execute(MONTHLY_KLINE_TABLE_SQL.format(name='monthly_kline'))
+
+
+def _rebuild_monthly_kline_for_sources(db, cursor):
+    """月K线表支持多数据源：旧表（没有data_source字段或唯一约束不含数据源）整表重建"""
+    cursor.execute("PRAGMA table_info(monthly_kline)")
+    columns = [col[1] for col in cursor.fetchall()]
+    
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='monthly_kline'")
+    table_sql = cursor.fetchone()
+    has_old_constraint = bool(table_sql and 'UNIQUE(ts_code, trade_date)' in table_sql[0]
+                              and 'UNIQUE(ts_code, trade_date, data_source)' not in table_sql[0])
+    
+    if 'data_source' in columns and not has_old_constraint:
+        # 字段已存在，确保有唯一索引
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_monthly_kline_unique "
+                       "ON monthly_kline(ts_code, trade_date, data_source)")
+        return
+    
+    print("检测到旧的表结构，正在重建表以支持多数据源...")
+    # 一条 INSERT ... SELECT 整表复制（没有数据源的记录默认为akshare），再替换旧表
+    data_source = "COALESCE(NULLIF(data_source, ''), 'akshare')" if 'data_source' in columns else "'akshare'"
+    kline_columns = "ts_code, trade_date, year, month, open, close, high, low, vol, amount, pct_chg"
+    cursor.execute("DROP TABLE IF EXISTS monthly_kline_new")
+    cursor.execute(MONTHLY_KLINE_TABLE_SQL.format(name='monthly_kline_new'))
+    cursor.execute(f"""
+        INSERT INTO monthly_kline_new ({kline_columns}, data_source)
+        SELECT {kline_columns}, {data_source} FROM monthly_kline
+    """)
+    cursor.execute("DROP TABLE monthly_kline")
+    cursor.execute("ALTER TABLE monthly_kline_new RENAME TO monthly_kline")
+    print("✓ 表重建完成")
+
+
+def _create_seasonality_table(db, cursor):
+    """月度季节性汇总表，已有月K线数据时全量生成一次"""
+    cursor.execute(SEASONALITY_TABLE_SQL.format(name='monthly_seasonality'))
+    
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM monthly_seasonality)")
+    if not cursor.fetchone()[0]:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM monthly_kline)")
+        if cursor.fetchone()[0]:
+            print("正在生成月度季节性汇总表...")
+            cursor.execute("""
+                INSERT INTO monthly_seasonality (
+                    data_source, ts_code, month, year, pct_chg,
+                    total_count, up_count, down_count, up_pct_sum, down_pct_sum,
+                    cum_total_count, cum_up_count, cum_down_count, cum_up_pct_sum, cum_down_pct_sum
+                )
+                SELECT data_source, ts_code, month, year, pct_chg,
+                       total_count, up_count, down_count, up_pct_sum, down_pct_sum,
+                       SUM(total_count) OVER w, SUM(up_count) OVER w, SUM(down_count) OVER w,
+                       SUM(up_pct_sum) OVER w, SUM(down_pct_sum) OVER w
+                FROM (
+                    SELECT data_source, ts_code, month, year,
+                           pct_chg, MAX(trade_date) AS latest_trade_date,
+                           COUNT(*) AS total_count,
+                           SUM(pct_chg > 0) AS up_count,
+                           SUM(pct_chg < 0) AS down_count,
+                           TOTAL(CASE WHEN pct_chg > 0 THEN pct_chg END) AS up_pct_sum,
+                           TOTAL(CASE WHEN pct_chg < 0 THEN pct_chg END) AS down_pct_sum
+                    FROM monthly_kline
+                    WHERE pct_chg IS NOT NULL
+                    GROUP BY data_source, ts_code, month, year
+                )
+                WINDOW w AS (PARTITION BY data_source, ts_code, month ORDER BY year)
+            """)
+            print("✓ 月度季节性汇总表生成完成")
+
+
+def _create_query_indexes(db, cursor):
+    """热点查询的覆盖索引（取代旧的单列索引）"""
+    for name in ['idx_monthly_kline_code', 'idx_monthly_seasonality_code']:
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    for statement in [
+        "CREATE INDEX IF NOT EXISTS idx_monthly_kline_date ON monthly_kline(trade_date)",
+        "CREATE INDEX IF NOT EXISTS idx_monthly_kline_year_month ON monthly_kline(year, month)",
+        "CREATE INDEX IF NOT EXISTS idx_monthly_kline_source_code "
+        "ON monthly_kline(data_source, ts_code, month, year, trade_date, pct_chg)",
+        "CREATE INDEX IF NOT EXISTS idx_monthly_seasonality_stock ON monthly_seasonality(ts_code, data_source, "
+        "year, month, pct_chg, total_count, up_count, down_count, up_pct_sum, down_pct_sum)",
+        "CREATE INDEX IF NOT EXISTS idx_industry_sw_name ON industry_sw(industry_name, ts_code)",
+        "CREATE INDEX IF NOT EXISTS idx_industry_citics_name ON industry_citics(industry_name, ts_code)",
+        "CREATE INDEX IF NOT EXISTS idx_stocks_code ON stocks(ts_code)",
+        "CREATE INDEX IF NOT EXISTS idx_stocks_symbol ON stocks(symbol)",
+        "CREATE INDEX IF NOT EXISTS idx_stocks_delist ON stocks(delist_date)",
+    ]:
+        cursor.execute(statement)
+
+
+def _restore_stocks_schema(db, cursor):
+    """恢复股票表的声明结构：旧版本用 DataFrame.to_sql 整表替换，表结构由pandas推断，没有主键"""
+    cursor.execute("PRAGMA table_info(stocks)")
+    table_info = cursor.fetchall()
+    columns = [col[1] for col in table_info]
+    primary_key = [col[1] for col in table_info if col[5]]
+    stock_columns = ['ts_code', 'symbol', 'name', 'area', 'industry', 'list_date', 'delist_date', 'is_hs', 'exchange']
+    
+    if primary_key != ['ts_code'] or sorted(columns) != sorted(stock_columns):
+        print("检测到股票表结构与声明不一致，正在重建股票表...")
+        # 只保留声明的字段，同一代码有多行时保留最后写入的一行
+        select_columns = []
+        for column in stock_columns:
+            if column not in columns:
+                select_columns.append("NULL")
+            elif column in ('symbol', 'name'):
+                select_columns.append(f"COALESCE({column}, '')")
+            else:
+                select_columns.append(column)
+        cursor.execute("DROP TABLE IF EXISTS stocks_new")
+        cursor.execute(STOCKS_TABLE_SQL.format(name='stocks_new'))
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO stocks_new ({', '.join(stock_columns)})
+            SELECT {', '.join(select_columns)} FROM stocks
+            WHERE ts_code IS NOT NULL
+            ORDER BY rowid
+        """)
+        cursor.execute("DROP TABLE stocks")
+        cursor.execute("ALTER TABLE stocks_new RENAME TO stocks")
+        print("✓ 股票表重建完成")
+    
+    # 重建后股票表的索引需要重新创建；主键已覆盖按代码查询，删除单独的代码索引
+    cursor.execute("DROP INDEX IF EXISTS idx_stocks_code")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stocks_symbol ON stocks(symbol)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stocks_delist ON stocks(delist_date)")
+
+
+def _create_source_summary(db, cursor):
+    """数据源汇总表：每个数据源的数据量、股票数、最新交易日期和最后更新时间，随月K线写入同一事务维护"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS source_summary (
+            data_source TEXT PRIMARY KEY,
+            data_count INTEGER NOT NULL,
+            stock_count INTEGER NOT NULL,
+            latest_date TEXT,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        INSERT OR REPLACE INTO source_summary (data_source, data_count, stock_count, latest_date, updated_at)
+        SELECT data_source, COUNT(*), COUNT(DISTINCT ts_code), MAX(trade_date), ?
+        FROM monthly_kline
+        WHERE data_source IS NOT NULL
+        GROUP BY data_source
+    """, (datetime.now().strftime('%Y%m%d%H%M%S'),))
+
+
+def _dedupe_seasonality_months(db, cursor):
+    """季节性汇总改为每个（股票, 年, 月）只取最新交易日期的一条月K线，与收益面板口径一致，全量重新生成"""
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM monthly_seasonality)")
+    if not cursor.fetchone()[0]:
+        return
+    print("正在按新的计数口径重新生成月度季节性汇总表...")
+    cursor.execute("DELETE FROM monthly_seasonality")
+    cursor.execute("""
+        INSERT INTO monthly_seasonality (
+            data_source, ts_code, month, year, pct_chg,
+            total_count, up_count, down_count, up_pct_sum, down_pct_sum,
+            cum_total_count, cum_up_count, cum_down_count, cum_up_pct_sum, cum_down_pct_sum
+        )
+        SELECT data_source, ts_code, month, year, pct_chg,
+               1, pct_chg > 0, pct_chg < 0,
+               CASE WHEN pct_chg > 0 THEN pct_chg ELSE 0.0 END,
+               CASE WHEN pct_chg < 0 THEN pct_chg ELSE 0.0 END,
+               COUNT(*) OVER w, SUM(pct_chg > 0) OVER w, SUM(pct_chg < 0) OVER w,
+               TOTAL(CASE WHEN pct_chg > 0 THEN pct_chg END) OVER w,
+               TOTAL(CASE WHEN pct_chg < 0 THEN pct_chg END) OVER w
+        FROM (
+            SELECT data_source, ts_code, month, year,
+                   pct_chg, MAX(trade_date) AS latest_trade_date
+            FROM monthly_kline
+            WHERE pct_chg IS NOT NULL
+            GROUP BY data_source, ts_code, month, year
+        )
+        WINDOW w AS (PARTITION BY data_source, ts_code, month ORDER BY year)
+    """)
+    print("✓ 月度季节性汇总表重新生成完成")
+
+
+def _create_update_progress(db, cursor):
+    """数据更新状态表（只有一行）：更新锁和进度记录在数据库中，多个 worker 看到同一份状态"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS update_progress (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            is_running INTEGER NOT NULL DEFAULT 0,
+            owner TEXT,
+            current INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 100,
+            message TEXT NOT NULL DEFAULT '',
+            heartbeat_at TEXT,
+            updated_at TEXT
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO update_progress (id) VALUES (1)")
+
+
+# (版本号, 说明, 迁移函数)，迁移函数参数为 (Database, cursor)
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "基础表结构", _create_base_tables),
+    (2, "月K线表支持多数据源", _rebuild_monthly_kline_for_sources),
+    (3, "月度季节性汇总表", _create_seasonality_table),
+    (4, "热点查询覆盖索引", _create_query_indexes),
+    (5, "恢复股票表声明结构", _restore_stocks_schema),
+    (6, "数据源汇总表", _create_source_summary),
+    (7, "季节性汇总每月只计最新一条月K线", _dedupe_seasonality_months),
+    (8, "数据更新状态表", _create_update_progress),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    """数据库当前的结构版本（还没有版本表时为0）"""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(db, cursor) -> int:
+    """依次执行尚未执行的迁移（需在写事务中调用），返回执行的迁移数量"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL,
+            duration_ms INTEGER NOT NULL
+        )
+    """)
+    version = current_version(cursor.connection)
+    pending = [m for m in MIGRATIONS if m[0] > version]
+    for number, description, apply in pending:
+        start = time.perf_counter()
+        apply(db, cursor)
+        duration_ms = int((time.perf_counter() - start) * 1000)
+        cursor.execute("""
+            INSERT INTO schema_version (version, description, applied_at, duration_ms)
+            VALUES (?, ?, ?, ?)
+        """, (number, description, datetime.now().strftime('%Y%m%d%H%M%S'), duration_ms))
+        print(f"✓ 数据库迁移 {number}（{description}）完成，耗时 {duration_ms / 1000:.2f} 秒")
+    return len(pending)
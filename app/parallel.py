@@ -0,0 +1,130 @@
+"""
+全市场统计的多进程并行执行
+
+把股票按代码区间分块，每块在进程池中独立查询季节性汇总表得到该块股票的汇总值，
+主进程再把各块结果合并。各块股票互不重叠，合并只需拼接。
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+import pandas as pd
+from app.database import Database
+
+
+# 工作进程内复用的数据库对象（每个进程只初始化一次）
+_worker_db: Optional[Database] = None
+
+
+def _get_worker_db(db_path: str) -> Database:
+    global _worker_db
+    if _worker_db is None or _worker_db.db_path != db_path:
+        _worker_db = Database(db_path)
+    return _worker_db
+
+
+def _month_statistics_chunk(db_path: str, month: int, start_year: int, end_year: int,
+                            data_source: str, code_range: Tuple[str, Optional[str]]) -> pd.DataFrame:
+    return _get_worker_db(db_path).get_month_statistics(month, start_year, end_year, data_source=data_source,
+                                                        code_range=code_range)
+
+
+def _industry_month_statistics_chunk(db_path: str, month: int, start_year: int, end_year: int,
+                                     industry_type: str, data_source: str,
+                                     code_range: Tuple[str, Optional[str]]) -> pd.DataFrame:
+    return _get_worker_db(db_path).get_industry_month_statistics(month, start_year, end_year, industry_type,
+                                                                 data_source=data_source, code_range=code_range)
+
+
+class ParallelAggregator:
+    """
+    并行统计后端
+    
+    与 Database 的汇总查询签名相同：全市场查询（月份筛选、行业统计）分块并行，
+    单只股票、单个行业等小查询直接使用数据库。
+    """
+    
+    def __init__(self, db: Database, workers: int):
+        self.db = db
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # (股票列表版本号, 代码区间)：股票列表不变时各请求沿用同一组区间
+        self._ranges: Optional[Tuple[int, List[Tuple[str, Optional[str]]]]] = None
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """首次使用时创建进程池（使用spawn，避免fork带入父进程的线程和数据库连接）"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+    
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+    
+    def _code_ranges(self) -> List[Tuple[str, Optional[str]]]:
+        """
+        按股票代码把全部股票均分为 workers 个区间 [起始代码, 下一块起始代码)
+        
+        代码取自内存中的股票目录，按股票列表版本号缓存，请求路径上不再查询股票表
+        """
+        directory = self.db.stock_directory()
+        cached = self._ranges
+        if cached is not None and cached[0] == directory.generation:
+            return cached[1]
+        
+        codes = sorted(directory.get_stocks(exclude_delisted=False)['ts_code'])
+        if not codes:
+            ranges = [('', None)]
+        else:
+            chunk_size = -(-len(codes) // self.workers)
+            starts = codes[::chunk_size]
+            # 第一块从空字符串开始、最后一块不设上限，保证不在股票表中的代码也被覆盖
+            starts[0] = ''
+            ranges = list(zip(starts, starts[1:] + [None]))
+        self._ranges = (directory.generation, ranges)
+        return ranges
+    
+    def _run_chunks(self, fn, *args) -> pd.DataFrame:
+        executor = self._get_executor()
+        db_path = self.db.db_path
+        futures = [executor.submit(fn, db_path, *args, code_range) for code_range in self._code_ranges()]
+        parts = [future.result() for future in futures]
+        return pd.concat(parts, ignore_index=True)
+    
+    # ========== 与 Database 汇总查询相同签名的读取方法 ==========
+    
+    def get_stocks(self, exclude_delisted: bool = True) -> pd.DataFrame:
+        return self.db.get_stocks(exclude_delisted=exclude_delisted)
+    
+    def get_month_statistics(self, month: int, start_year: int = None, end_year: int = None,
+                             data_source: str = None, ts_code: str = None) -> pd.DataFrame:
+        """获取指定月份按股票汇总的涨跌统计（全市场查询分块并行）"""
+        if ts_code:
+            return self.db.get_month_statistics(month, start_year, end_year, data_source=data_source,
+                                                ts_code=ts_code)
+        return self._run_chunks(_month_statistics_chunk, month, start_year, end_year, data_source)
+    
+    def get_industry_month_statistics(self, month: int, start_year: int = None, end_year: int = None,
+                                      industry_type: str = 'sw', data_source: str = None) -> pd.DataFrame:
+        """获取各行业成分股指定月份的涨跌统计（按成分股代码分块并行）"""
+        if industry_type not in {'sw', 'citics'}:
+            raise ValueError(f"Invalid industry_type: {industry_type}. Must be one of {{'sw', 'citics'}}")
+        return self._run_chunks(_industry_month_statistics_chunk, month, start_year, end_year,
+                                industry_type, data_source)
+    
+    def get_industry_stocks_month_statistics(self, industry_name: str, month: int, start_year: int = None,
+                                             end_year: int = None, industry_type: str = 'sw',
+                                             data_source: str = None) -> pd.DataFrame:
+        return self.db.get_industry_stocks_month_statistics(industry_name, month, start_year, end_year,
+                                                            industry_type, data_source=data_source)
+    
+    def get_stock_seasonality(self, ts_code: str, start_year: int = None, end_year: int = None,
+                              data_source: str = None) -> pd.DataFrame:
+        return self.db.get_stock_seasonality(ts_code, start_year, end_year, data_source=data_source)
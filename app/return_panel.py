@@ -0,0 +1,385 @@
+"""
+内存收益面板（可选的统计计算后端）
+
+将各数据源的月涨跌幅加载为 [数据源][股票][年份][月份] 的 float64 稠密数组，
+统计请求只做数组切片和归约，不再访问数据库。
+
+面板按版本写入磁盘（panel_<版本>.npy + panel_<版本>.json），由 manifest.json 指向当前版本。
+各 uvicorn worker 通过 np.memmap 只读打开同一文件，共享操作系统页缓存中的一份数据；
+重建时先写新版本文件，再原子替换 manifest，其他 worker 检测到版本变化后切换。
+"""
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from app.database import Database
+
+
+class PanelSnapshot:
+    """面板数据的一次完整快照（构建完成后只读，重建时整体替换）"""
+    
+    def __init__(self, version: str, sources: List[str], ts_codes: np.ndarray, first_year: int,
+                 values: np.ndarray, stocks_df: pd.DataFrame, industries: Dict[str, pd.DataFrame]):
+        self.version = version
+        self.sources = sources
+        self.source_index = {source: i for i, source in enumerate(sources)}
+        self.ts_codes = ts_codes
+        self.code_index = {code: i for i, code in enumerate(ts_codes)}
+        self.first_year = first_year
+        # 只读内存映射（NaN表示该股票该年该月无数据）
+        self.values = values
+        self.stocks_df = stocks_df
+        self.industries = {}
+        # 行业成分预先映射为面板行号（无数据的成分股为-1）
+        for industry_type, members_df in industries.items():
+            members_df = members_df.copy()
+            members_df['row'] = members_df['ts_code'].map(self.code_index).fillna(-1).astype(np.int64)
+            self.industries[industry_type] = members_df
+    
+    @property
+    def n_years(self) -> int:
+        return self.values.shape[2]
+    
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+
+class ReturnPanel:
+    """
+    收益面板统计后端
+    
+    提供与 Database 中汇总查询相同签名的读取方法（get_month_statistics 等），
+    Statistics 可在面板就绪时直接替换数据库使用。
+    面板由季节性汇总表构建，同一股票同一月份有多条记录时只保留最新交易日的涨跌幅。
+    """
+    
+    AGGREGATE_COLUMNS = ['total_count', 'up_count', 'down_count', 'up_pct_sum', 'down_pct_sum']
+    MANIFEST_FILE = 'manifest.json'
+    # 检查 manifest 是否更新的最小间隔（秒）
+    RELOAD_CHECK_INTERVAL = 1.0
+    # 磁盘上保留的版本数（含当前版本，旧版本可能仍被其他 worker 映射）
+    KEEP_VERSIONS = 2
+    
+    def __init__(self, db: Database, panel_dir: str = None):
+        self.db = db
+        if panel_dir is None:
+            # 默认与数据库文件放在同一目录（Docker中为挂载的数据目录）
+            panel_dir = os.getenv("PANEL_DIR") or os.path.join(
+                os.path.dirname(os.path.abspath(db.db_path)), 'return_panel'
+            )
+        self.panel_dir = panel_dir
+        self._snapshot: Optional[PanelSnapshot] = None
+        self._rebuild_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._last_check = 0.0
+    
+    @property
+    def is_ready(self) -> bool:
+        """面板是否已加载（顺便检查其他 worker 是否已发布新版本）"""
+        return self._current_snapshot() is not None
+    
+    @property
+    def version(self) -> Optional[str]:
+        """当前使用的面板版本号（未加载时为None）"""
+        snapshot = self._current_snapshot()
+        return snapshot.version if snapshot is not None else None
+    
+    def load_or_rebuild(self):
+        """启动时调用：已有发布的面板文件则直接映射，否则从数据库构建"""
+        manifest = self._read_manifest()
+        if manifest is not None:
+            try:
+                self._snapshot = self._open_snapshot(manifest)
+                self._print_loaded('已映射', self._snapshot)
+                return
+            except (OSError, ValueError, KeyError) as e:
+                print(f"收益面板文件无法打开，将重新构建: {e}")
+        self.rebuild()
+    
+    def rebuild(self):
+        """从数据库重新构建面板，写入新版本文件并原子替换 manifest（构建期间旧面板继续提供服务）"""
+        with self._rebuild_lock:
+            manifest = self._write_version(*self._load_from_database())
+            self._publish(manifest)
+            self._snapshot = self._open_snapshot(manifest)
+            self._print_loaded('已构建', self._snapshot)
+            self._remove_old_versions(manifest['version'])
+    
+    def _print_loaded(self, action: str, snapshot: PanelSnapshot):
+        print(f"✓ 收益面板{action}: 版本 {snapshot.version}, {len(snapshot.sources)} 个数据源, "
+              f"{len(snapshot.ts_codes)} 只股票, {snapshot.n_years} 年, {snapshot.nbytes / 1024 / 1024:.1f} MB")
+    
+    # ========== 面板文件读写 ==========
+    
+    def _load_from_database(self):
+        """读取季节性汇总表、股票列表和行业成分，构建面板数组和元数据"""
+        conn = self.db.get_connection()
+        try:
+            if self.db.kline_store is not None and self.db.kline_store.usable():
+                returns_df = self._load_returns_from_kline_store()
+            else:
+                returns_df = pd.read_sql_query("""
+                    SELECT data_source, ts_code, year, month, pct_chg
+                    FROM monthly_seasonality
+                """, conn)
+            industries = {}
+            for industry_type, table in (('sw', 'industry_sw'), ('citics', 'industry_citics')):
+                industries[industry_type] = pd.read_sql_query(
+                    f"SELECT industry_name, ts_code FROM {table} ORDER BY ts_code", conn
+                )
+        finally:
+            conn.close()
+        
+        stocks_df = self.db.get_stocks(exclude_delisted=True)[['ts_code', 'symbol', 'name']].reset_index(drop=True)
+        
+        sources = sorted(returns_df['data_source'].unique().tolist())
+        ts_codes = sorted(returns_df['ts_code'].unique().tolist())
+        if returns_df.empty:
+            first_year, n_years = 0, 0
+        else:
+            first_year = int(returns_df['year'].min())
+            n_years = int(returns_df['year'].max()) - first_year + 1
+        
+        values = np.full((len(sources), len(ts_codes), n_years, 12), np.nan, dtype=np.float64)
+        if not returns_df.empty:
+            source_pos = pd.Categorical(returns_df['data_source'], categories=sources).codes
+            code_pos = pd.Categorical(returns_df['ts_code'], categories=ts_codes).codes
+            year_pos = returns_df['year'].to_numpy() - first_year
+            month_pos = returns_df['month'].to_numpy() - 1
+            values[source_pos, code_pos, year_pos, month_pos] = returns_df['pct_chg'].to_numpy(dtype=np.float64)
+        
+        meta = {
+            'sources': sources,
+            'ts_codes': ts_codes,
+            'first_year': first_year,
+            'stocks': stocks_df.to_dict(orient='list'),
+            'industries': {industry_type: members_df.to_dict(orient='list')
+                           for industry_type, members_df in industries.items()},
+        }
+        return values, meta
+    
+    def _load_returns_from_kline_store(self) -> pd.DataFrame:
+        """从月K线列式存储读取涨跌幅（与季节性汇总表一致：同一月份取最新交易日的非空涨跌幅）"""
+        kline_df = self.db.load_kline_history(['data_source', 'ts_code', 'year', 'month', 'trade_date', 'pct_chg'])
+        kline_df = kline_df[kline_df['pct_chg'].notna()].sort_values('trade_date', kind='stable')
+        kline_df = kline_df.drop_duplicates(['data_source', 'ts_code', 'year', 'month'], keep='last')
+        kline_df['ts_code'] = kline_df['ts_code'].astype(object)
+        return kline_df[['data_source', 'ts_code', 'year', 'month', 'pct_chg']]
+    
+    def _write_version(self, values: np.ndarray, meta: Dict) -> Dict:
+        """写入一个新版本的面板文件，返回指向它的 manifest 内容"""
+        os.makedirs(self.panel_dir, exist_ok=True)
+        now = time.time()
+        version = f"{time.strftime('%Y%m%d%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}_{os.getpid()}"
+        values_file = f"panel_{version}.npy"
+        meta_file = f"panel_{version}.json"
+        
+        # 先写临时文件再重命名，保证读取方看到的文件都是完整的
+        values_path = os.path.join(self.panel_dir, values_file)
+        with open(values_path + '.tmp', 'wb') as f:
+            np.save(f, values)
+        os.replace(values_path + '.tmp', values_path)
+        
+        meta_path = os.path.join(self.panel_dir, meta_file)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + '.tmp', meta_path)
+        
+        return {'version': version, 'values': values_file, 'meta': meta_file}
+    
+    def _publish(self, manifest: Dict):
+        """原子替换 manifest，使所有 worker 切换到新版本"""
+        manifest_path = os.path.join(self.panel_dir, self.MANIFEST_FILE)
+        # 临时文件名带进程号，避免多个 worker 同时发布时互相覆盖
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+    
+    def _read_manifest(self) -> Optional[Dict]:
+        manifest_path = os.path.join(self.panel_dir, self.MANIFEST_FILE)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _open_snapshot(self, manifest: Dict) -> PanelSnapshot:
+        """以只读内存映射方式打开 manifest 指向的面板文件"""
+        values = np.load(os.path.join(self.panel_dir, manifest['values']), mmap_mode='r')
+        with open(os.path.join(self.panel_dir, manifest['meta']), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        industries = {industry_type: pd.DataFrame(members, columns=['industry_name', 'ts_code'])
+                      for industry_type, members in meta['industries'].items()}
+        return PanelSnapshot(
+            manifest['version'],
+            meta['sources'],
+            np.array(meta['ts_codes'], dtype=object),
+            meta['first_year'],
+            values,
+            pd.DataFrame(meta['stocks'], columns=['ts_code', 'symbol', 'name']),
+            industries,
+        )
+    
+    def _current_snapshot(self) -> Optional[PanelSnapshot]:
+        """返回当前快照；定期检查 manifest，其他 worker 发布了新版本时切换"""
+        now = time.monotonic()
+        if self._snapshot is None or now - self._last_check < self.RELOAD_CHECK_INTERVAL:
+            return self._snapshot
+        
+        with self._reload_lock:
+            if now - self._last_check < self.RELOAD_CHECK_INTERVAL:
+                return self._snapshot
+            self._last_check = now
+            manifest = self._read_manifest()
+            if manifest is not None and manifest.get('version') != self._snapshot.version:
+                try:
+                    self._snapshot = self._open_snapshot(manifest)
+                    self._print_loaded('已切换', self._snapshot)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"收益面板新版本打开失败，继续使用当前版本: {e}")
+        return self._snapshot
+    
+    def _remove_old_versions(self, current_version: str):
+        """删除较旧的面板文件（POSIX下已被映射的文件删除后映射依然有效）"""
+        versions = set()
+        for filename in os.listdir(self.panel_dir):
+            if filename.startswith('panel_') and filename.endswith(('.npy', '.json')):
+                versions.add(filename[len('panel_'):].rsplit('.', 1)[0])
+        
+        # 版本号以时间戳开头，按字符串排序即按时间排序
+        older = sorted(versions - {current_version})
+        stale = older[:max(len(older) - (self.KEEP_VERSIONS - 1), 0)]
+        for version in stale:
+            for suffix in ('.npy', '.json'):
+                try:
+                    os.remove(os.path.join(self.panel_dir, f"panel_{version}{suffix}"))
+                except OSError:
+                    # Windows下仍被映射的文件无法删除，留到下次重建时再清理
+                    pass
+    
+    def _aggregate(self, snapshot: PanelSnapshot, month: int, start_year: int = None,
+                   end_year: int = None, data_source: str = None,
+                   rows: np.ndarray = None) -> Optional[Dict[str, np.ndarray]]:
+        """对指定月份、年份区间做向量化归约，返回每只股票的次数和涨跌幅合计数组"""
+        if data_source not in snapshot.source_index or snapshot.n_years == 0:
+            return None
+        
+        y0 = max(start_year - snapshot.first_year, 0) if start_year else 0
+        y1 = min(end_year - snapshot.first_year + 1, snapshot.n_years) if end_year else snapshot.n_years
+        if y1 <= y0:
+            return None
+        
+        source = snapshot.source_index[data_source]
+        block = snapshot.values[source, :, y0:y1, month - 1]
+        if rows is not None:
+            block = block[rows]
+        
+        up = block > 0
+        down = block < 0
+        return {
+            'total_count': (~np.isnan(block)).sum(axis=1),
+            'up_count': up.sum(axis=1),
+            'down_count': down.sum(axis=1),
+            'up_pct_sum': np.where(up, block, 0).sum(axis=1, dtype=np.float64),
+            'down_pct_sum': np.where(down, block, 0).sum(axis=1, dtype=np.float64),
+        }
+    
+    def _empty_statistics(self, extra_columns: List[str]) -> pd.DataFrame:
+        return pd.DataFrame(columns=extra_columns + self.AGGREGATE_COLUMNS)
+    
+    # ========== 与 Database 汇总查询相同签名的读取方法 ==========
+    
+    def get_stocks(self, exclude_delisted: bool = True) -> pd.DataFrame:
+        """获取股票列表（仅包含统计所需的代码和名称；面板只保存未退市股票，包含已退市股票时从数据库读取）"""
+        if not exclude_delisted:
+            return self.db.get_stocks(exclude_delisted=False)[['ts_code', 'symbol', 'name']]
+        return self._current_snapshot().stocks_df
+    
+    def get_month_statistics(self, month: int, start_year: int = None, end_year: int = None,
+                             data_source: str = None, ts_code: str = None) -> pd.DataFrame:
+        """获取指定月份按股票汇总的涨跌统计"""
+        snapshot = self._current_snapshot()
+        rows = None
+        if ts_code:
+            if ts_code not in snapshot.code_index:
+                return self._empty_statistics(['ts_code'])
+            rows = np.array([snapshot.code_index[ts_code]])
+        
+        aggregates = self._aggregate(snapshot, month, start_year, end_year, data_source, rows)
+        if aggregates is None:
+            return self._empty_statistics(['ts_code'])
+        
+        codes = snapshot.ts_codes if rows is None else snapshot.ts_codes[rows]
+        stats_df = pd.DataFrame({'ts_code': codes, **aggregates})
+        return stats_df[stats_df['total_count'] > 0]
+    
+    def get_stock_seasonality(self, ts_code: str, start_year: int = None, end_year: int = None,
+                              data_source: str = None) -> pd.DataFrame:
+        """获取单只股票全部月份的逐年季节性数据（面板中每月只有一个值）"""
+        snapshot = self._current_snapshot()
+        columns = ['year', 'month', 'pct_chg'] + self.AGGREGATE_COLUMNS
+        if (data_source not in snapshot.source_index or ts_code not in snapshot.code_index
+                or snapshot.n_years == 0):
+            return pd.DataFrame(columns=columns)
+        
+        y0 = max(start_year - snapshot.first_year, 0) if start_year else 0
+        y1 = min(end_year - snapshot.first_year + 1, snapshot.n_years) if end_year else snapshot.n_years
+        if y1 <= y0:
+            return pd.DataFrame(columns=columns)
+        
+        matrix = snapshot.values[snapshot.source_index[data_source], snapshot.code_index[ts_code], y0:y1]
+        year_pos, month_pos = np.nonzero(~np.isnan(matrix))
+        pct_chg = matrix[year_pos, month_pos].astype(np.float64)
+        return pd.DataFrame({
+            'year': year_pos + y0 + snapshot.first_year,
+            'month': month_pos + 1,
+            'pct_chg': pct_chg,
+            'total_count': 1,
+            'up_count': (pct_chg > 0).astype(np.int64),
+            'down_count': (pct_chg < 0).astype(np.int64),
+            'up_pct_sum': np.where(pct_chg > 0, pct_chg, 0),
+            'down_pct_sum': np.where(pct_chg < 0, pct_chg, 0),
+        }, columns=columns)
+    
+    def get_industry_month_statistics(self, month: int, start_year: int = None, end_year: int = None,
+                                      industry_type: str = 'sw', data_source: str = None) -> pd.DataFrame:
+        """获取各行业成分股指定月份的涨跌统计（无数据的成分股统计列为空）"""
+        snapshot = self._current_snapshot()
+        members_df = snapshot.industries.get(industry_type)
+        if members_df is None:
+            raise ValueError(f"Invalid industry_type: {industry_type}. Must be one of {set(snapshot.industries)}")
+        
+        result = members_df[['industry_name', 'ts_code']].copy()
+        aggregates = self._aggregate(snapshot, month, start_year, end_year, data_source)
+        rows = members_df['row'].to_numpy()
+        has_data = rows >= 0
+        for column in self.AGGREGATE_COLUMNS:
+            values = np.full(len(rows), np.nan)
+            if aggregates is not None:
+                values[has_data] = aggregates[column][rows[has_data]]
+            result[column] = values
+        return result
+    
+    def get_industry_stocks_month_statistics(self, industry_name: str, month: int, start_year: int = None,
+                                             end_year: int = None, industry_type: str = 'sw',
+                                             data_source: str = None) -> pd.DataFrame:
+        """获取单个行业内未退市成分股指定月份的涨跌统计"""
+        snapshot = self._current_snapshot()
+        members_df = snapshot.industries.get(industry_type)
+        if members_df is None:
+            raise ValueError(f"Invalid industry_type: {industry_type}. Must be one of {set(snapshot.industries)}")
+        
+        members_df = members_df[(members_df['industry_name'] == industry_name) & (members_df['row'] >= 0)]
+        members_df = members_df.merge(snapshot.stocks_df, on='ts_code', how='inner')
+        aggregates = self._aggregate(snapshot, month, start_year, end_year, data_source,
+                                     members_df['row'].to_numpy())
+        if aggregates is None:
+            return self._empty_statistics(['ts_code', 'symbol', 'name'])
+        
+        stats_df = members_df[['ts_code', 'symbol', 'name']].assign(**aggregates)
+        return stats_df[stats_df['total_count'] > 0]
@@ -1,14 +1,25 @@
 """
 统计计算模块
 """
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Optional, Tuple
+from app.config import Config
 from app.database import Database
 
 
 class Statistics:
-    def __init__(self, db: Database):
+    # 汇总统计的原始合计列（可直接相加）
+    AGGREGATE_COLUMNS = ['total_count', 'up_count', 'down_count', 'up_pct_sum', 'down_pct_sum']
+    
+    def __init__(self, db: Database, panel=None, parallel=None, config: Config = None):
         self.db = db
+        # 读取默认数据源的配置（未指定时使用默认配置文件，同一文件在进程内共享一份快照）
+        self.config = config if config is not None else Config()
+        # 可选的内存收益面板后端（ReturnPanel），加载完成后统计查询不再访问数据库
+        self.panel = panel
+        # 可选的多进程并行后端（ParallelAggregator），全市场统计分块并行查询数据库
+        self.parallel = parallel
     
     def calculate_stock_month_statistics(self, ts_code: str, month: int, 
                                         start_year: int = None, end_year: int = None,
@@ -26,76 +37,64 @@ class Statistics:
         Returns:
             统计结果字典
         """
+        if not 1 <= month <= 12:
+            raise ValueError(f"月份必须在1-12之间: {month}")
+        profile = self.calculate_stock_profile(ts_code, start_year, end_year, data_source=data_source)
+        return profile['monthly'][month - 1]
+    
+    def calculate_stock_profile(self, ts_code: str, start_year: int = None, end_year: int = None,
+                                data_source: str = None) -> Dict:
+        """
+        计算单只股票全部12个月份的历史统计（一次读取该股票的全部季节性数据）
+        
+        Args:
+            ts_code: 股票代码
+            start_year: 起始年份
+            end_year: 结束年份
+            data_source: 数据源（可选，如果不指定则使用配置的数据源）
+        
+        Returns:
+            {'monthly': 1-12月统计结果列表（无数据的月份各项为0）,
+             'matrix': {'years': 年份列表, 'values': 每年12个月的涨跌幅（无数据为None）}}
+        """
         # 获取数据源（优先使用参数，否则使用配置的数据源）
         if data_source is None:
-            from app.config import Config
-            config = Config()
-            data_source = config.get('data_source', 'akshare')
-        
-        # 使用指定的数据源查询
-        df = self.db.get_monthly_kline(ts_code=ts_code, month=month, 
-                                      start_year=start_year, end_year=end_year,
-                                      data_source=data_source)
-        
-        # 如果指定数据源没有数据，且没有指定数据源，则尝试所有数据源
-        if df.empty and data_source is None:
-            df = self.db.get_monthly_kline(ts_code=ts_code, month=month, 
-                                          start_year=start_year, end_year=end_year)
-        
-        if df.empty:
-            return {
-                'ts_code': ts_code,
-                'month': month,
-                'total_count': 0,
-                'up_count': 0,
-                'down_count': 0,
-                'avg_up_pct': 0,
-                'avg_down_pct': 0,
-                'up_probability': 0,
-                'down_probability': 0
-            }
-        
-        # 过滤有效数据（有涨跌幅的）
-        df = df[df['pct_chg'].notna()]
-        
-        if df.empty:
-            return {
-                'ts_code': ts_code,
-                'month': month,
-                'total_count': 0,
-                'up_count': 0,
-                'down_count': 0,
-                'avg_up_pct': 0,
-                'avg_down_pct': 0,
-                'up_probability': 0,
-                'down_probability': 0
-            }
-        
-        # 计算统计
-        up_df = df[df['pct_chg'] > 0]
-        down_df = df[df['pct_chg'] < 0]
-        
-        total_count = len(df)
-        up_count = len(up_df)
-        down_count = len(down_df)
-        
-        avg_up_pct = up_df['pct_chg'].mean() if up_count > 0 else 0
-        avg_down_pct = down_df['pct_chg'].mean() if down_count > 0 else 0
-        
-        up_probability = (up_count / total_count * 100) if total_count > 0 else 0
-        down_probability = (down_count / total_count * 100) if total_count > 0 else 0
+            data_source = self._get_default_data_source()
         
-        return {
-            'ts_code': ts_code,
-            'month': month,
-            'total_count': total_count,
-            'up_count': up_count,
-            'down_count': down_count,
-            'avg_up_pct': round(avg_up_pct, 2),
-            'avg_down_pct': round(avg_down_pct, 2),
-            'up_probability': round(up_probability, 2),
-            'down_probability': round(down_probability, 2)
+        seasonality_df = self._backend().get_stock_seasonality(ts_code, start_year, end_year,
+                                                               data_source=data_source)
+        
+        # 按月份累加逐年合计值，再计算概率和平均涨跌幅
+        stats_df = seasonality_df.groupby('month')[self.AGGREGATE_COLUMNS].sum()
+        stats_df = self._calculate_probabilities(stats_df)
+        
+        monthly = []
+        for month in range(1, 13):
+            stat = {'ts_code': ts_code, 'month': month}
+            if month in stats_df.index:
+                stat.update(self._build_stat_record(stats_df.loc[month]))
+            else:
+                stat.update({
+                    'total_count': 0,
+                    'up_count': 0,
+                    'down_count': 0,
+                    'avg_up_pct': 0,
+                    'avg_down_pct': 0,
+                    'up_probability': 0,
+                    'down_probability': 0
+                })
+            monthly.append(stat)
+        
+        # 年份×月份涨跌幅矩阵（用于热力图）
+        matrix_df = seasonality_df.pivot(index='year', columns='month', values='pct_chg')
+        matrix_df = matrix_df.reindex(columns=range(1, 13)).sort_index()
+        matrix = {
+            'years': [int(year) for year in matrix_df.index],
+            'values': [[None if pd.isna(value) else round(float(value), 2) for value in row]
+                       for row in matrix_df.itertuples(index=False)]
         }
+        
+        return {'ts_code': ts_code, 'monthly': monthly, 'matrix': matrix}
     
     def calculate_month_filter_statistics(self, month: int, start_year: int, 
                                          end_year: int, top_n: int = 20,
@@ -114,29 +113,33 @@ class Statistics:
         Returns:
             统计结果列表（按上涨概率降序）
         """
-        # 获取所有股票
-        stocks_df = self.db.get_stocks(exclude_delisted=True)
+        if data_source is None:
+            data_source = self._get_default_data_source()
+        
+        # 一次查询取出该月份全部股票的区间统计
+        backend = self._backend()
+        stats_df = backend.get_month_statistics(month, start_year, end_year, data_source=data_source)
+        
+        # 只保留未退市股票（保持股票列表原有顺序，用于同概率时的排序）
+        stocks_df = backend.get_stocks(exclude_delisted=True)[['ts_code', 'symbol', 'name']]
+        stats_df = stocks_df.merge(stats_df, on='ts_code', how='inner')
+        
+        # 检查最小涨跌次数筛选（上涨次数 + 下跌次数 >= min_count）
+        if min_count > 0:
+            stats_df = stats_df[stats_df['up_count'] + stats_df['down_count'] >= min_count]
+        
+        stats_df = self._calculate_probabilities(stats_df)
+        top_df = stats_df.iloc[self._rank_top_n(stats_df['up_probability'].to_numpy(), top_n)]
         
         results = []
-        for idx, row in stocks_df.iterrows():
-            ts_code = row['ts_code']
-            stat = self.calculate_stock_month_statistics(ts_code, month, start_year, end_year, data_source=data_source)
-            
-            # 添加股票信息
-            stat['symbol'] = row['symbol']
-            stat['name'] = row['name']
-            
-            # 只包含有数据的股票
-            if stat['total_count'] > 0:
-                # 检查最小涨跌次数筛选（上涨次数 + 下跌次数 >= min_count）
-                total_count = stat['up_count'] + stat['down_count']
-                if min_count == 0 or total_count >= min_count:
-                    results.append(stat)
-        
-        # 按上涨概率排序
-        results.sort(key=lambda x: x['up_probability'], reverse=True)
-        
-        return results[:top_n]
+        for row in top_df.itertuples(index=False):
+            stat = {'ts_code': row.ts_code, 'month': month}
+            stat.update(self._build_stat_record(row))
+            stat['symbol'] = row.symbol
+            stat['name'] = row.name
+            results.append(stat)
+        
+        return results
     
     def calculate_industry_statistics(self, month: int, start_year: int, end_year: int,
                                      industry_type: str = 'sw', data_source: str = None) -> List[Dict]:
@@ -153,52 +156,26 @@ class Statistics:
         Returns:
             行业统计列表（按上涨概率降序）
         """
-        # 获取所有行业
-        industries = self.db.get_all_industries(industry_type)
+        if data_source is None:
+            data_source = self._get_default_data_source()
         
-        results = []
-        for industry_name in industries:
-            # 获取行业下的股票
-            stock_codes = self.db.get_industry_stocks(industry_name, industry_type)
-            
-            if not stock_codes:
-                continue
-            
-            # 统计行业整体表现
-            total_up_count = 0
-            total_down_count = 0
-            total_count = 0
-            total_up_pct_sum = 0
-            total_down_pct_sum = 0
-            
-            for ts_code in stock_codes:
-                stat = self.calculate_stock_month_statistics(ts_code, month, start_year, end_year, data_source=data_source)
-                if stat['total_count'] > 0:
-                    total_count += stat['total_count']
-                    total_up_count += stat['up_count']
-                    total_down_count += stat['down_count']
-                    total_up_pct_sum += stat['avg_up_pct'] * stat['up_count']
-                    total_down_pct_sum += stat['avg_down_pct'] * stat['down_count']
-            
-            if total_count > 0:
-                avg_up_pct = total_up_pct_sum / total_up_count if total_up_count > 0 else 0
-                avg_down_pct = total_down_pct_sum / total_down_count if total_down_count > 0 else 0
-                up_probability = (total_up_count / total_count * 100)
-                
-                results.append({
-                    'industry_name': industry_name,
-                    'stock_count': len(stock_codes),
-                    'total_count': total_count,
-                    'up_count': total_up_count,
-                    'down_count': total_down_count,
-                    'avg_up_pct': round(avg_up_pct, 2),
-                    'avg_down_pct': round(avg_down_pct, 2),
-                    'up_probability': round(up_probability, 2),
-                    'down_probability': round((total_down_count / total_count * 100), 2)
-                })
+        # 行业成分与季节性汇总一次关联查询，按行业累加原始合计值
+        members_df = self._backend().get_industry_month_statistics(month, start_year, end_year,
+                                                                   industry_type, data_source=data_source)
+        grouped = members_df.groupby('industry_name')
+        stats_df = grouped[self.AGGREGATE_COLUMNS].sum()
+        stats_df['stock_count'] = grouped['ts_code'].nunique()
+        stats_df = stats_df.reset_index()
         
-        # 按上涨概率排序
-        results.sort(key=lambda x: x['up_probability'], reverse=True)
+        # 按行业名称排序后再按上涨概率稳定排序（概率相同的按名称排列）
+        stats_df = self._calculate_probabilities(stats_df).sort_values('industry_name', kind='stable')
+        ranked_df = stats_df.iloc[self._rank_top_n(stats_df['up_probability'].to_numpy(), len(stats_df))]
+        
+        results = []
+        for row in ranked_df.itertuples(index=False):
+            stat = {'industry_name': row.industry_name, 'stock_count': int(row.stock_count)}
+            stat.update(self._build_stat_record(row))
+            results.append(stat)
         
         return results
     
@@ -221,29 +198,94 @@ class Statistics:
         Returns:
             股票统计列表（按上涨概率降序）
         """
-        # 获取行业下的股票
-        stock_codes = self.db.get_industry_stocks(industry_name, industry_type)
-        
-        if not stock_codes:
-            return []
+        if data_source is None:
+            data_source = self._get_default_data_source()
         
-        # 获取股票信息
-        stocks_df = self.db.get_stocks(exclude_delisted=True)
+        # 行业成分、股票名称与季节性汇总一次关联查询
+        stats_df = self._backend().get_industry_stocks_month_statistics(industry_name, month, start_year, end_year,
+                                                                        industry_type, data_source=data_source)
+        stats_df = self._calculate_probabilities(stats_df)
+        top_df = stats_df.iloc[self._rank_top_n(stats_df['up_probability'].to_numpy(), top_n)]
         
         results = []
-        for ts_code in stock_codes:
-            stat = self.calculate_stock_month_statistics(ts_code, month, start_year, end_year, data_source=data_source)
-            
-            if stat['total_count'] > 0:
-                # 添加股票信息
-                stock_info = stocks_df[stocks_df['ts_code'] == ts_code]
-                if not stock_info.empty:
-                    stat['symbol'] = stock_info.iloc[0]['symbol']
-                    stat['name'] = stock_info.iloc[0]['name']
-                    results.append(stat)
-        
-        # 按上涨概率排序
-        results.sort(key=lambda x: x['up_probability'], reverse=True)
-        
-        return results[:top_n]
-
+        for row in top_df.itertuples(index=False):
+            stat = {'ts_code': row.ts_code, 'month': month}
+            stat.update(self._build_stat_record(row))
+            stat['symbol'] = row.symbol
+            stat['name'] = row.name
+            results.append(stat)
+        
+        return results
+    
+    def _backend(self):
+        """选择统计数据来源：内存面板已加载时使用面板，其次是多进程并行查询，否则直接查询数据库汇总表"""
+        if self.panel is not None and self.panel.is_ready:
+            return self.panel
+        if self.parallel is not None:
+            return self.parallel
+        return self.db
+    
+    def data_version(self) -> str:
+        """
+        当前统计所依据的数据版本（用于结果缓存键）
+        
+        由数据库数据版本号和面板版本组成：面板在数据更新结束后才重建，
+        只看数据库版本号会把旧面板算出的结果当作新数据缓存下来。
+        """
+        version = str(self.db.get_data_generation())
+        if self.panel is not None and self.panel.is_ready:
+            version += f":{self.panel.version}"
+        return version
+    
+    def _get_default_data_source(self) -> str:
+        """获取配置的默认数据源"""
+        return self.config.get('data_source', 'akshare')
+    
+    def _calculate_probabilities(self, stats_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        由聚合结果计算平均涨跌幅和涨跌概率（向量化）
+        
+        涨跌幅合计先按 Database.PCT_SUM_DECIMALS 舍入再相除：数据库、收益面板和并行聚合的求和顺序不同，
+        舍去末位浮点误差后各后端的平均值保留两位小数时结果一致。
+        """
+        stats_df = stats_df[stats_df['total_count'] > 0].copy()
+        for column in ['up_pct_sum', 'down_pct_sum']:
+            stats_df[column] = stats_df[column].astype(float).round(Database.PCT_SUM_DECIMALS)
+        total = stats_df['total_count']
+        up_count = stats_df['up_count']
+        down_count = stats_df['down_count']
+        stats_df['avg_up_pct'] = (stats_df['up_pct_sum'] / up_count.where(up_count > 0)).fillna(0)
+        stats_df['avg_down_pct'] = (stats_df['down_pct_sum'] / down_count.where(down_count > 0)).fillna(0)
+        stats_df['up_probability'] = up_count / total * 100
+        stats_df['down_probability'] = down_count / total * 100
+        return stats_df
+    
+    def _rank_top_n(self, probabilities: np.ndarray, top_n: int) -> np.ndarray:
+        """
+        按上涨概率（保留两位小数后）降序选出前N个位置
+        
+        先用argpartition找出第N大的概率作为门槛，只对达到门槛的候选做稳定排序，
+        概率相同的按原有顺序排列，与全量排序的结果一致。
+        """
+        keys = np.round(probabilities, 2)
+        if top_n <= 0 or len(keys) == 0:
+            return np.array([], dtype=np.intp)
+        if top_n < len(keys):
+            kth = np.argpartition(-keys, top_n - 1)[top_n - 1]
+            candidates = np.flatnonzero(keys >= keys[kth])
+        else:
+            candidates = np.arange(len(keys))
+        order = np.argsort(-keys[candidates], kind='stable')
+        return candidates[order][:top_n]
+    
+    def _build_stat_record(self, row) -> Dict:
+        """将一行聚合结果转换为统计结果字典"""
+        return {
+            'total_count': int(row.total_count),
+            'up_count': int(row.up_count),
+            'down_count': int(row.down_count),
+            'avg_up_pct': round(float(row.avg_up_pct), 2) if row.up_count > 0 else 0,
+            'avg_down_pct': round(float(row.avg_down_pct), 2) if row.down_count > 0 else 0,
+            'up_probability': round(float(row.up_probability), 2),
+            'down_probability': round(float(row.down_probability), 2)
+        }
@@ -0,0 +1,111 @@
+"""
+股票目录
+
+进程内共享的只读股票列表快照：按完整代码和股票代码的字典查找、预先拆分的上市/退市列表、
+上市股票的 DataFrame 和序列化好的 /api/stocks 响应。快照带有股票列表版本号（stocks_generation），
+保存股票列表后版本号变化才重新加载，其余时间查找不访问数据库。
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+import pandas as pd
+from app.stock_search import StockSearchIndex
+
+
+class StockDirectory:
+    """一个版本的股票列表（创建后不再修改，对外返回的字典和 DataFrame 都是副本）"""
+    
+    def __init__(self, columns: Sequence[str], rows: Sequence[tuple], generation: int,
+                 previous: Optional["StockDirectory"] = None):
+        self.generation = generation
+        self.columns = list(columns)
+        records = [dict(zip(self.columns, row)) for row in rows]
+        self._by_ts_code: Dict[str, Dict] = {}
+        self._by_symbol: Dict[str, Dict] = {}
+        for record in records:
+            self._by_ts_code.setdefault(record.get('ts_code'), record)
+            self._by_symbol.setdefault(record.get('symbol'), record)
+        
+        listed_mask = [not record.get('delist_date') for record in records]
+        self.listed: List[Dict] = [r for r, listed in zip(records, listed_mask) if listed]
+        self.delisted: List[Dict] = [r for r, listed in zip(records, listed_mask) if not listed]
+        self._all_df = pd.DataFrame.from_records(list(rows), columns=self.columns)
+        # 用 loc 按行筛选：没有股票时 df[[]] 会被当作列选择，得到没有任何列的表
+        self._listed_df = self._all_df.loc[listed_mask].reset_index(drop=True)
+        self.listed_json = json.dumps({"success": True, "data": self.listed}, ensure_ascii=False).encode('utf-8')
+        
+        # 搜索索引：上市股票的代码和名称没有变化时沿用上一版本的索引
+        self._search_rows = [(r.get('ts_code'), r.get('symbol'), r.get('name'), r.get('exchange'))
+                             for r in self.listed]
+        if previous is not None and previous._search_rows == self._search_rows:
+            self._search_index = previous._search_index
+        else:
+            self._search_index = None
+        self._search_lock = threading.Lock()
+    
+    def get(self, code: str) -> Optional[Dict]:
+        """按股票代码或完整代码查找"""
+        record = self._by_symbol.get(code) or self._by_ts_code.get(code)
+        return dict(record) if record is not None else None
+    
+    def get_stocks(self, exclude_delisted: bool = True) -> pd.DataFrame:
+        return (self._listed_df if exclude_delisted else self._all_df).copy()
+    
+    def search(self, keyword: str, limit: int = 20) -> List[Dict]:
+        """在上市股票中搜索（首次搜索时建立索引）"""
+        if self._search_index is None:
+            with self._search_lock:
+                if self._search_index is None:
+                    index = StockSearchIndex()
+                    index.rebuild(self._search_rows, self.generation)
+                    self._search_index = index
+        return self._search_index.search(keyword, limit)
+
+
+class StockDirectoryCache:
+    """
+    每个数据库文件一个：保存当前的股票目录
+    
+    最多每 CHECK_INTERVAL 秒查询一次版本号（其他进程保存的股票列表在这个间隔内生效），
+    本进程保存股票列表后调用 invalidate() 立即生效。
+    """
+    
+    CHECK_INTERVAL = 1.0
+    
+    def __init__(self):
+        self._directory: Optional[StockDirectory] = None
+        self._last_check = float('-inf')
+        self._lock = threading.Lock()
+    
+    def get(self, load_generation: Callable[[], int],
+            load: Callable[[int, Optional[StockDirectory]], StockDirectory]) -> StockDirectory:
+        directory = self._directory
+        now = time.monotonic()
+        if directory is not None and now - self._last_check < self.CHECK_INTERVAL:
+            return directory
+        
+        with self._lock:
+            generation = load_generation()
+            if self._directory is None or self._directory.generation != generation:
+                self._directory = load(generation, self._directory)
+            self._last_check = now
+            return self._directory
+    
+    def invalidate(self):
+        """下次访问时重新检查版本号"""
+        self._last_check = float('-inf')
+
+
+_caches: Dict[str, StockDirectoryCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_directory_cache(db_path: str) -> StockDirectoryCache:
+    """获取数据库文件对应的股票目录缓存（同一进程内共用）"""
+    key = os.path.abspath(db_path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = StockDirectoryCache()
+        return _caches[key]
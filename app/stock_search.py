@@ -0,0 +1,155 @@
+"""
+股票搜索内存索引
+
+对未退市股票的代码、名称和名称拼音首字母建立单字和双字倒排索引，搜索时先用索引求出候选股票，
+再逐个核对并排序，不再对股票表做 LIKE 全表扫描。排序规则与原SQL一致：
+代码完全匹配 > TS代码完全匹配 > 代码前缀 > TS代码前缀 > 名称（或拼音首字母）前缀 > 任意位置包含，同级按代码排序。
+
+拼音首字母由 pypinyin 生成（支持多音字，如"银行"可用 yh 搜索）。
+"""
+import bisect
+import itertools
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+from pypinyin import pinyin, Style
+
+
+# 多音字组合的数量上限（避免名称中多音字过多时组合数爆炸）
+MAX_INITIAL_VARIANTS = 8
+
+
+def _char_initials(ch: str) -> str:
+    """单个字符可能的拼音首字母（字母数字原样返回小写，无法识别的字符返回空串）"""
+    if ch.isascii():
+        return ch.lower() if ch.isalnum() else ''
+    readings = pinyin(ch, style=Style.FIRST_LETTER, heteronym=True)[0]
+    return ''.join(dict.fromkeys(r[:1].lower() for r in readings if r[:1].isascii() and r[:1].isalpha()))
+
+
+def name_initials(name: str) -> List[str]:
+    """名称的拼音首字母（多音字产生多个组合），如 平安银行 -> ['payx', 'payh', 'bayx', 'bayh']"""
+    if not name:
+        return []
+    # 全角字母数字（如"万科Ａ"）先转为半角
+    name = unicodedata.normalize('NFKC', name)
+    choices = [letters for letters in (_char_initials(ch) for ch in name) if letters]
+    variants = itertools.islice(itertools.product(*choices), MAX_INITIAL_VARIANTS)
+    return [''.join(v) for v in variants]
+
+
+class _SearchEntry:
+    __slots__ = ('ts_code', 'symbol', 'name', 'exchange', 'names', 'text')
+    
+    def __init__(self, ts_code: str, symbol: str, name: str, exchange: Optional[str]):
+        self.ts_code = ts_code or ''
+        self.symbol = symbol or ''
+        self.name = name or ''
+        self.exchange = exchange
+        # 名称类匹配文本（小写名称和拼音首字母）；text 为全部匹配文本拼接，用于核对任意位置包含
+        self.names = (self.name.lower(),) + tuple(name_initials(self.name))
+        self.text = '\x00'.join((self.symbol.lower(), self.ts_code.lower()) + self.names)
+    
+    def to_dict(self) -> Dict:
+        return {'ts_code': self.ts_code, 'symbol': self.symbol, 'name': self.name, 'exchange': self.exchange}
+
+
+class _IndexState:
+    """一次建立的全部索引结构（建立后不再修改）"""
+    
+    def __init__(self, entries: List[_SearchEntry]):
+        # 条目按代码排序，条目序号越小代码越靠前，同级结果按序号排序即按代码排序
+        self.entries = entries
+        self.by_symbol: Dict[str, List[int]] = {}
+        self.by_ts_code: Dict[str, List[int]] = {}
+        symbol_keys, ts_code_keys, name_keys = [], [], []
+        postings: Dict[str, set] = {}
+        for i, entry in enumerate(entries):
+            symbol, ts_code = entry.symbol.lower(), entry.ts_code.lower()
+            self.by_symbol.setdefault(symbol, []).append(i)
+            self.by_ts_code.setdefault(ts_code, []).append(i)
+            symbol_keys.append((symbol, i))
+            ts_code_keys.append((ts_code, i))
+            name_keys += [(key, i) for key in entry.names]
+            for key in (symbol, ts_code) + entry.names:
+                for gram in _grams(key):
+                    postings.setdefault(gram, set()).add(i)
+        # 按文本排序的 (文本列表, 序号列表)，二分查找得到前缀匹配的区间
+        self.symbol_keys = self._sorted_keys(symbol_keys)
+        self.ts_code_keys = self._sorted_keys(ts_code_keys)
+        self.name_keys = self._sorted_keys(name_keys)
+        self.postings = {gram: frozenset(ids) for gram, ids in postings.items()}
+    
+    @staticmethod
+    def _sorted_keys(pairs: List[Tuple[str, int]]) -> Tuple[List[str], List[int]]:
+        pairs.sort()
+        return [key for key, _ in pairs], [i for _, i in pairs]
+    
+    @staticmethod
+    def prefix_ids(keys: Tuple[List[str], List[int]], keyword: str) -> List[int]:
+        texts, ids = keys
+        lo = bisect.bisect_left(texts, keyword)
+        hi = bisect.bisect_left(texts, keyword + '\uffff', lo)
+        return ids[lo:hi]
+    
+    def substring_ids(self, keyword: str):
+        """任意位置包含关键词的候选条目（单字/双字倒排表求交集，关键词超过两个字时可能有多余的候选）"""
+        if not keyword:
+            return range(len(self.entries))
+        grams = {keyword} if len(keyword) <= 2 else {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+        lists = sorted((self.postings.get(gram, frozenset()) for gram in grams), key=len)
+        return lists[0].intersection(*lists[1:]) if lists[0] else frozenset()
+
+
+def _grams(text: str):
+    """文本中的全部单字和相邻双字"""
+    for i, ch in enumerate(text):
+        yield ch
+        if i + 1 < len(text):
+            yield text[i:i + 2]
+
+
+class StockSearchIndex:
+    """
+    股票搜索索引
+    
+    generation 为建立索引时股票列表的版本号，版本号变化后由调用方重新建立。
+    重建时先生成新的索引再整体替换，搜索过程中不需要加锁。
+    """
+    
+    def __init__(self):
+        self.generation: Optional[int] = None
+        self._state = _IndexState([])
+    
+    def rebuild(self, rows: Sequence[Tuple[str, str, str, Optional[str]]], generation: int):
+        """由 (ts_code, symbol, name, exchange) 列表重新建立索引"""
+        entries = sorted((_SearchEntry(*row) for row in rows), key=lambda e: e.symbol)
+        self._state = _IndexState(entries)
+        self.generation = generation
+    
+    def search(self, keyword: str, limit: int = 20) -> List[Dict]:
+        """搜索股票，按匹配等级依次取结果，取满 limit 条即停止"""
+        keyword = keyword.lower()
+        state = self._state
+        # 匹配等级从高到低：代码完全匹配、TS代码完全匹配、代码前缀、TS代码前缀、名称/首字母前缀、任意位置包含
+        tiers = (
+            lambda: state.by_symbol.get(keyword, ()),
+            lambda: state.by_ts_code.get(keyword, ()),
+            lambda: state.prefix_ids(state.symbol_keys, keyword),
+            lambda: state.prefix_ids(state.ts_code_keys, keyword),
+            lambda: state.prefix_ids(state.name_keys, keyword),
+            lambda: state.substring_ids(keyword),
+        )
+        selected: List[int] = []
+        seen = set()
+        for level, tier in enumerate(tiers):
+            need = limit - len(selected)
+            if need <= 0:
+                break
+            ids = sorted(set(tier()).difference(seen))
+            if level == len(tiers) - 1 and len(keyword) > 2:
+                # 倒排表候选可能只是包含关键词的各个双字，按代码顺序逐个核对，取满即停
+                ids = (i for i in ids if keyword in state.entries[i].text)
+            ids = list(itertools.islice(ids, need))
+            selected += ids
+            seen.update(ids)
+        return [state.entries[i].to_dict() for i in selected]
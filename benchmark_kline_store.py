@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+月K线列式存储基准测试：全量导出到 Parquet，对比列式存储与数据库的读取耗时和结果
+
+用法：
+    python benchmark_kline_store.py [--db stock_data.db] [--store-dir kline_parquet] [--data-source akshare]
+                                    [--month 3] [--start-year 2005] [--end-year 2020] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+import pandas as pd
+from app.database import Database
+from app.kline_store import PYARROW_AVAILABLE, get_kline_store
+
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+def best_time(call, repeat: int):
+    """返回最快一次的耗时（秒）和该次结果"""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def same_rows(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    """忽略行顺序和类型比较两个结果"""
+    if len(a) != len(b) or list(a.columns) != list(b.columns):
+        return False
+    a = a.astype(str).sort_values(list(a.columns)).reset_index(drop=True)
+    b = b.astype(str).sort_values(list(b.columns)).reset_index(drop=True)
+    return a.equals(b)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="月K线列式存储基准测试")
+    parser.add_argument('--db', default=None, help="数据库路径（默认使用 DB_PATH 或 stock_data.db）")
+    parser.add_argument('--store-dir', default=None, help="列式存储目录（默认使用 KLINE_STORE_DIR 或数据库同目录的 kline_parquet）")
+    parser.add_argument('--data-source', default='akshare', help="数据源")
+    parser.add_argument('--month', type=int, default=3)
+    parser.add_argument('--start-year', type=int, default=2005)
+    parser.add_argument('--end-year', type=int, default=2020)
+    parser.add_argument('--repeat', type=int, default=3, help="每种读取重复次数（取最快一次）")
+    args = parser.parse_args()
+    
+    if not PYARROW_AVAILABLE:
+        print("未安装 pyarrow，无法使用月K线列式存储")
+        sys.exit(1)
+    
+    sqlite_db = Database(args.db)
+    store_db = Database(args.db)
+    store = get_kline_store(store_db.db_path, args.store_dir)
+    store_db.use_kline_store(store)
+    
+    print("=" * 60)
+    print(f"数据库: {sqlite_db.db_path}  列式存储: {store.store_dir}")
+    print("=" * 60)
+    
+    start = time.perf_counter()
+    rows = store.rebuild(sqlite_db)
+    print(f"全量导出:      {time.perf_counter() - start:.2f} 秒（{rows} 行）")
+    
+    history_columns = ['data_source', 'ts_code', 'year', 'month', 'trade_date', 'pct_chg']
+    month_filter = dict(columns=['ts_code', 'year', 'pct_chg'], data_source=args.data_source, month=args.month,
+                        start_year=args.start_year, end_year=args.end_year)
+    cases = [
+        ('全部历史（read_sql_query）', lambda db: db.load_kline_history(history_columns)),
+        (f'{args.month}月 {args.start_year}-{args.end_year}', lambda db: db.load_kline_history(**month_filter)),
+        (f'{args.end_year}年全部股票', lambda db: db.get_monthly_kline(year=args.end_year,
+                                                                     data_source=args.data_source)),
+    ]
+    for name, call in cases:
+        sqlite_time, sqlite_result = best_time(lambda: call(sqlite_db), args.repeat)
+        store_time, store_result = best_time(lambda: call(store_db), args.repeat)
+        consistent = same_rows(sqlite_result.drop(columns=['id'], errors='ignore'),
+                               store_result.drop(columns=['id'], errors='ignore'))
+        print(f"{name}: 数据库 {sqlite_time * 1000:.1f} 毫秒, 列式存储 {store_time * 1000:.1f} 毫秒"
+              f"（{store_time / sqlite_time:.0%}），{len(store_result)} 行，结果一致: {'是' if consistent else '否'}")
+
+
+if __name__ == "__main__":
+    main()
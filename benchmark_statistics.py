@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+统计性能基准测试：对比单进程查询与多进程并行查询的全市场统计耗时
+
+用法：
+    python benchmark_statistics.py [--db stock_data.db] [--workers 8] [--data-source akshare]
+                                   [--start-year 2000] [--end-year 2024] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+from app.database import Database
+from app.statistics import Statistics
+from app.parallel import ParallelAggregator
+
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+def run_all_months(statistics: Statistics, args) -> list:
+    """依次计算12个月的月份筛选和行业统计，返回全部结果（用于核对一致性）"""
+    results = []
+    for month in range(1, 13):
+        results.append(statistics.calculate_month_filter_statistics(
+            month, args.start_year, args.end_year, 20, data_source=args.data_source
+        ))
+        results.append(statistics.calculate_industry_statistics(
+            month, args.start_year, args.end_year, 'sw', data_source=args.data_source
+        ))
+    return results
+
+
+def measure(statistics: Statistics, args):
+    """返回最快一轮的耗时（秒）和该轮结果"""
+    best, results = None, None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        results = run_all_months(statistics, args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计性能基准测试")
+    parser.add_argument('--db', default=None, help="数据库路径（默认使用 DB_PATH 或 stock_data.db）")
+    parser.add_argument('--workers', type=int, default=8, help="并行进程数")
+    parser.add_argument('--data-source', default='akshare', help="数据源")
+    parser.add_argument('--start-year', type=int, default=2000)
+    parser.add_argument('--end-year', type=int, default=2024)
+    parser.add_argument('--repeat', type=int, default=3, help="每种方式重复次数（取最快一次）")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    parallel = ParallelAggregator(db, args.workers)
+
+    print("=" * 60)
+    print(f"数据库: {db.db_path}  数据源: {args.data_source}  年份: {args.start_year}-{args.end_year}")
+    print(f"任务: 12个月 × (月份筛选 + 申万行业统计)，重复 {args.repeat} 次取最快")
+    print("=" * 60)
+
+    serial_time, serial_results = measure(Statistics(db), args)
+    print(f"单进程:        {serial_time:.3f} 秒")
+
+    # 先预热进程池（进程启动开销不计入）
+    parallel.get_month_statistics(1, args.start_year, args.end_year, data_source=args.data_source)
+    parallel_time, parallel_results = measure(Statistics(db, parallel=parallel), args)
+    parallel.shutdown()
+    print(f"{args.workers} 进程并行:    {parallel_time:.3f} 秒")
+
+    print(f"加速比:        {serial_time / parallel_time:.2f}x")
+    print(f"结果一致:      {'是' if serial_results == parallel_results else '否'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+收益面板与数据库汇总表一致性检查：在临时目录生成一个带有同月多条月K线（未完结月份的多个交易日）的测试库，
+分别用数据库季节性汇总表和内存收益面板计算统计，结果不一致时返回非零退出码。
+
+用法：
+    python check_panel_consistency.py [--stocks 50] [--seed 7]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import pandas as pd
+from app.database import Database
+from app.return_panel import ReturnPanel
+from app.statistics import Statistics
+
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+DATA_SOURCES = ['akshare', 'tushare']
+
+
+def build_fixture(db: Database, n_stocks: int, seed: int) -> int:
+    """写入股票列表和月K线：约5%的月份额外有一条较早交易日的记录，返回其中的重复月份数"""
+    rnd = random.Random(seed)
+    stocks = pd.DataFrame([{
+        'ts_code': f"{600000 + i:06d}.SH", 'symbol': f"{600000 + i:06d}", 'name': f"股票{i}",
+        'list_date': '20000101', 'exchange': 'SH',
+    } for i in range(n_stocks)])
+    db.save_stocks(stocks)
+    
+    duplicates = 0
+    for data_source in DATA_SOURCES:
+        rows = []
+        for ts_code in stocks['ts_code']:
+            for year in range(rnd.randint(2005, 2012), 2025):
+                for month in range(1, 13):
+                    if rnd.random() < 0.05:
+                        rows.append(_kline_row(ts_code, year, month, 15, round(rnd.gauss(0, 5), 2)))
+                        duplicates += 1
+                    pct_chg = None if rnd.random() < 0.02 else round(rnd.gauss(0.5, 8), 2)
+                    rows.append(_kline_row(ts_code, year, month, 28, pct_chg))
+        db.save_monthly_kline(pd.DataFrame(rows), data_source=data_source)
+    return duplicates
+
+
+def _kline_row(ts_code: str, year: int, month: int, day: int, pct_chg) -> dict:
+    return {'ts_code': ts_code, 'trade_date': f"{year}{month:02d}{day:02d}", 'year': year, 'month': month,
+            'open': 10.0, 'close': 10.0, 'high': 10.0, 'low': 10.0, 'vol': 100.0, 'amount': 1000.0,
+            'pct_chg': pct_chg}
+
+
+def compare(expected, actual, path: str) -> list:
+    """递归比较两个统计结果，返回不一致之处"""
+    if isinstance(expected, dict):
+        if set(expected) != set(actual):
+            return [f"{path}: 字段不同 {sorted(expected)} != {sorted(actual)}"]
+        problems = []
+        for key in expected:
+            problems += compare(expected[key], actual[key], f"{path}.{key}")
+        return problems
+    if isinstance(expected, list):
+        if len(expected) != len(actual):
+            return [f"{path}: 长度不同 {len(expected)} != {len(actual)}"]
+        problems = []
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            problems += compare(e, a, f"{path}[{i}]")
+        return problems
+    if isinstance(expected, float) or isinstance(actual, float):
+        # 结果已保留两位小数，两个后端的涨跌幅合计相同，不允许末位有差异
+        if expected is None or actual is None or not math.isclose(expected, actual, rel_tol=0, abs_tol=1e-9):
+            return [f"{path}: {expected} != {actual}"]
+        return []
+    if expected != actual:
+        return [f"{path}: {expected} != {actual}"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查收益面板与数据库汇总表的统计结果是否一致')
+    parser.add_argument('--stocks', type=int, default=50, help='测试库的股票数量')
+    parser.add_argument('--seed', type=int, default=7, help='随机数种子')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        db = Database(os.path.join(work_dir, 'stock_data.db'))
+        duplicates = build_fixture(db, args.stocks, args.seed)
+        panel = ReturnPanel(db, os.path.join(work_dir, 'return_panel'))
+        panel.rebuild()
+        print(f"测试库: {args.stocks} 只股票, {len(DATA_SOURCES)} 个数据源, {duplicates} 个月份有多条月K线")
+        
+        db_stats = Statistics(db)
+        panel_stats = Statistics(db, panel=panel)
+        ts_codes = db.get_stocks()['ts_code'].tolist()
+        
+        # (名称, Statistics 方法名, 参数)
+        checks = []
+        for data_source in DATA_SOURCES:
+            for start_year, end_year in [(None, None), (2005, 2020), (2010, 2020)]:
+                for month in (1, 5, 6, 12):
+                    checks.append((f"{data_source} 月份筛选 {month}月 {start_year}-{end_year}",
+                                   'calculate_month_filter_statistics',
+                                   dict(month=month, start_year=start_year, end_year=end_year,
+                                        top_n=len(ts_codes), data_source=data_source)))
+                for ts_code in ts_codes[:10]:
+                    checks.append((f"{data_source} {ts_code} {start_year}-{end_year}", 'calculate_stock_profile',
+                                   dict(ts_code=ts_code, start_year=start_year, end_year=end_year,
+                                        data_source=data_source)))
+        
+        failed = 0
+        for name, method, kwargs in checks:
+            problems = compare(getattr(db_stats, method)(**kwargs), getattr(panel_stats, method)(**kwargs), name)
+            if problems:
+                failed += 1
+                print(f"✗ {name}")
+                for problem in problems[:5]:
+                    print(f"    {problem}")
+        
+        print(f"\n共检查 {len(checks)} 项，{failed} 项不一致")
+        return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
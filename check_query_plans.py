@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+查询计划检查：执行 Database 的热点查询，记录实际执行的SQL，逐条用 EXPLAIN QUERY PLAN 检查，
+出现全表扫描（或每次查询临时建立自动索引）、或热点查询没有执行任何SQL时返回非零退出码，可用于发布前检查索引是否失效。
+
+默认在临时目录生成测试库（可用 --layout 指定月K线存储方式）；检查已有的数据库需显式指定 --db，
+该文件必须已存在（不会创建或迁移新文件）。
+
+用法：
+    python check_query_plans.py [--layout standard|compact|attached] [--db stock_data.db] [--data-source akshare]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import pandas as pd
+from app.database import Database
+from app.kline_layout import KLINE_LAYOUTS
+from app.stock_directory import get_directory_cache
+
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+# 允许全表扫描的表：查询本身就需要读取整张表（如返回全部股票、统计全部行业成分）
+ALLOWED_SCANS = {
+    'load_stock_directory': {'stocks'},
+    'get_industry_month_statistics': {'industry_sw', 'i'},
+    'get_data_source_statistics': {'source_summary'},
+}
+
+# 紧凑存储（monthly_kline 为视图）时另外允许的扫描：按数据源汇总全部K线没有可用的覆盖索引
+COMPACT_ALLOWED_SCANS = {
+    'get_available_data_sources': {'k'},
+}
+
+
+def build_fixture(db: Database, data_source: str, n_stocks: int = 20):
+    """写入测试用的股票列表、月K线和行业分类"""
+    stocks = pd.DataFrame([{
+        'ts_code': f"{600000 + i:06d}.SH", 'symbol': f"{600000 + i:06d}", 'name': f"股票{i}",
+        'list_date': '20000101', 'exchange': 'SH',
+    } for i in range(n_stocks)])
+    db.save_stocks(stocks)
+    rows = [{'ts_code': ts_code, 'trade_date': f"{year}{month:02d}28", 'year': year, 'month': month,
+             'open': 10.0, 'close': 10.0, 'high': 10.0, 'low': 10.0, 'vol': 100.0, 'amount': 1000.0,
+             'pct_chg': (i + year + month) % 7 - 3.0}
+            for i, ts_code in enumerate(stocks['ts_code'])
+            for year in range(2000, 2025) for month in range(1, 13)]
+    db.save_monthly_kline(pd.DataFrame(rows), data_source=data_source)
+    for i, ts_code in enumerate(stocks['ts_code']):
+        db.save_industry(ts_code, '银行' if i % 2 else '钢铁', 'L1', '', 'sw')
+
+
+def hot_queries(db: Database, ts_code: str, data_source: str):
+    """热点查询：(名称, 调用)"""
+    return [
+        # 股票列表和按代码查询都由内存中的股票目录提供，这里检查目录加载时执行的查询
+        ('load_stock_directory', lambda: (get_directory_cache(db.db_path).invalidate(), db.stock_directory())),
+        ('get_month_statistics', lambda: db.get_month_statistics(3, 2005, 2020, data_source=data_source)),
+        ('get_month_statistics(ts_code)', lambda: db.get_month_statistics(3, 2005, 2020, data_source=data_source,
+                                                                         ts_code=ts_code)),
+        ('get_month_statistics(code_range)', lambda: db.get_month_statistics(3, 2005, 2020, data_source=data_source,
+                                                                            code_range=(ts_code, None))),
+        ('get_stock_seasonality', lambda: db.get_stock_seasonality(ts_code, 2005, 2020, data_source=data_source)),
+        ('get_industry_month_statistics', lambda: db.get_industry_month_statistics(3, 2005, 2020, 'sw',
+                                                                                   data_source=data_source)),
+        ('get_industry_stocks_month_statistics', lambda: db.get_industry_stocks_month_statistics(
+            '银行', 3, 2005, 2020, 'sw', data_source=data_source)),
+        ('get_industry_stocks', lambda: db.get_industry_stocks('银行', 'sw')),
+        ('get_all_industries', lambda: db.get_all_industries('sw')),
+        ('get_monthly_kline', lambda: db.get_monthly_kline(ts_code=ts_code, data_source=data_source)),
+        ('get_latest_trade_date', lambda: db.get_latest_trade_date()),
+        ('get_latest_trade_date(ts_code)', lambda: db.get_latest_trade_date(ts_code, data_source=data_source)),
+        ('get_latest_trade_dates', lambda: db.get_latest_trade_dates(data_source)),
+        ('get_available_data_sources', lambda: db.get_available_data_sources()),
+        ('get_data_source_statistics', lambda: db.get_data_source_statistics()),
+        ('compare_data_sources', lambda: db.compare_data_sources(ts_code, month=3)),
+    ]
+
+
+def write_path_queries(db: Database, ts_code: str, data_source: str):
+    """写入路径上的查询（在写线程中执行，这里直接检查SQL）：(名称, SQL, 参数)"""
+    months = [1, 2]
+    condition = "data_source = ? AND ts_code = ? AND month IN (?, ?)"
+    params = [data_source, ts_code] + months
+    return [
+        ('refresh_seasonality(delete)', f"DELETE FROM monthly_seasonality WHERE {condition}", params),
+        ('refresh_seasonality(insert)', db._seasonality_insert_sql(condition), params),
+    ]
+
+
+def find_problems(conn, name: str, sql: str, params, compact: bool = False) -> list:
+    """返回查询计划中的问题行"""
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+    # 子查询（物化或协程）不是真实的表，扫描子查询结果不算全表扫描
+    subqueries = {m.group(1) for line in plan for m in [re.match(r"(?:MATERIALIZE|CO-ROUTINE) (\S+)", line)] if m}
+    allowed = ALLOWED_SCANS.get(name, set())
+    if compact:
+        allowed = allowed | COMPACT_ALLOWED_SCANS.get(name, set())
+    problems = []
+    for line in plan:
+        scan = re.match(r"SCAN (\S+)$", line)
+        if scan and scan.group(1) not in subqueries and scan.group(1) not in allowed:
+            problems.append(line)
+        auto = re.match(r"SEARCH (\S+) USING AUTOMATIC", line)
+        if auto and auto.group(1) not in subqueries:
+            problems.append(line)
+    return plan, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查热点查询的查询计划")
+    parser.add_argument('--db', default=None, help="检查已有的数据库文件（默认在临时目录生成测试库）")
+    parser.add_argument('--layout', choices=KLINE_LAYOUTS, default='standard', help="测试库的月K线存储方式")
+    parser.add_argument('--data-source', default='akshare', help="数据源")
+    parser.add_argument('--verbose', action='store_true', help="打印全部查询计划")
+    args = parser.parse_args()
+    
+    if args.db:
+        if not os.path.exists(args.db):
+            print(f"✗ 数据库文件不存在: {args.db}")
+            return 1
+        return check(Database(args.db), args)
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        db = Database(os.path.join(work_dir, 'stock_data.db'))
+        build_fixture(db, args.data_source)
+        if args.layout != 'standard':
+            db.convert_kline_layout(args.layout)
+        print(f"测试库: 月K线存储方式 {args.layout}")
+        return check(db, args)
+
+
+def check(db: Database, args) -> int:
+    """检查热点查询和写入路径查询的查询计划，返回退出码"""
+    conn = db.get_connection()
+    row = conn.execute("SELECT ts_code FROM stocks LIMIT 1").fetchone()
+    ts_code = row[0] if row else '000001.SZ'
+    
+    # 记录热点查询实际执行的SQL（跟踪回调得到的是已代入参数的SQL）
+    executed = []
+    conn.set_trace_callback(executed.append)
+    statements = []
+    silent = []
+    for name, call in hot_queries(db, ts_code, args.data_source):
+        executed.clear()
+        call()
+        selects = [(name, sql, []) for sql in executed if sql.lstrip().upper().startswith('SELECT')]
+        if not selects:
+            silent.append(name)
+        statements += selects
+    conn.set_trace_callback(None)
+    statements += write_path_queries(db, ts_code, args.data_source)
+    
+    compact = db.kline_layout() == 'compact'
+    failed = 0
+    for name, sql, params in statements:
+        plan, problems = find_problems(conn, name, sql, params, compact)
+        status = "FAIL" if problems else "OK"
+        print(f"[{status}] {name}")
+        if problems or args.verbose:
+            for line in plan:
+                print(f"        {line}")
+        failed += bool(problems)
+    # 没有执行SQL的热点查询无法检查（通常是改为读取内存缓存后检查项已失效），应更新检查列表
+    for name in silent:
+        print(f"[FAIL] {name}: 未执行任何查询")
+    
+    print("=" * 60)
+    print(f"共检查 {len(statements)} 条查询，{failed} 条存在全表扫描，{len(silent)} 个热点查询未执行SQL")
+    return 1 if failed or silent else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
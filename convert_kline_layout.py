@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+月K线存储方式转换：在标准表、紧凑存储（整数编号 + 按数据源、股票、年月聚簇的 WITHOUT ROWID 表）
+和分数据源存储（每个数据源一个文件，按需附加）之间转换，
+并对比转换前后的数据库文件大小（含各数据源文件）和按股票读取月K线的耗时。转换前请先停止服务。
+
+用法：
+    python convert_kline_layout.py [--db stock_data.db] [--layout compact|standard|attached] [--data-source akshare]
+                                   [--sample 200] [--repeat 3]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from app.database import Database
+from app.kline_layout import KLINE_LAYOUTS
+
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+def compact_file(db_path: str) -> int:
+    """检查点并 VACUUM 后返回数据库文件大小（字节）"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return os.path.getsize(db_path)
+
+
+def storage_size(db: Database) -> int:
+    """数据库文件和当前附加的各数据源文件的总大小（字节）"""
+    paths = [db.db_path] + list(db._pool.attachments.values())
+    return sum(compact_file(path) for path in paths)
+
+
+def measure_reads(db: Database, ts_codes: list, data_source: str, repeat: int) -> float:
+    """依次读取样本股票的全部月K线，返回最快一轮每只股票的平均耗时（毫秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for ts_code in ts_codes:
+            db.get_monthly_kline(ts_code=ts_code, data_source=data_source)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000 / max(len(ts_codes), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转换月K线存储方式")
+    parser.add_argument('--db', default=None, help="数据库路径（默认使用 DB_PATH 或 stock_data.db）")
+    parser.add_argument('--layout', choices=KLINE_LAYOUTS, default='compact', help="目标存储方式")
+    parser.add_argument('--data-source', default='akshare', help="用于读取对比的数据源")
+    parser.add_argument('--sample', type=int, default=200, help="读取对比的股票数量")
+    parser.add_argument('--repeat', type=int, default=3, help="读取对比重复次数（取最快一次）")
+    args = parser.parse_args()
+    
+    db = Database(args.db)
+    conn = db.get_connection()
+    ts_codes = [row[0] for row in conn.execute(
+        "SELECT DISTINCT ts_code FROM monthly_kline WHERE data_source = ? ORDER BY ts_code LIMIT ?",
+        (args.data_source, args.sample)
+    ).fetchall()]
+    
+    print("=" * 60)
+    print(f"数据库: {db.db_path}  当前存储方式: {db.kline_layout()}  目标: {args.layout}")
+    print("=" * 60)
+    
+    size_before = storage_size(db)
+    read_before = measure_reads(db, ts_codes, args.data_source, args.repeat)
+    
+    start = time.perf_counter()
+    result = db.convert_kline_layout(args.layout)
+    convert_time = time.perf_counter() - start
+    if not result['converted']:
+        print(f"已是 {args.layout} 存储，无需转换（{result['rows']} 行）")
+        return
+    
+    size_after = storage_size(db)
+    read_after = measure_reads(db, ts_codes, args.data_source, args.repeat)
+    
+    print(f"转换耗时:      {convert_time:.2f} 秒（{result['rows']} 行）")
+    print(f"文件大小:      {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB"
+          f"（{size_after / size_before:.0%}）")
+    print(f"单只股票读取:  {read_before:.3f} 毫秒 -> {read_after:.3f} 毫秒（{len(ts_codes)} 只股票平均）")
+
+
+if __name__ == "__main__":
+    main()
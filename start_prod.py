@@ -1,14 +1,18 @@
 """
 生产环境启动脚本（不使用自动重载）
 """
+import os
 import uvicorn
 
 if __name__ == "__main__":
+    # worker数量可通过环境变量 WORKERS 设置（默认1）
+    # 多worker时建议在 config.json 中设置 "analytics_backend": "panel"，
+    # 收益面板文件通过内存映射在各worker间共享，只占用一份内存；
+    # 数据更新的锁和进度保存在数据库中，各worker共用（见 DEPLOYMENT.md）
     uvicorn.run(
         "app.api:app",
         host="0.0.0.0",
         port=8588,
         reload=False,
-        workers=1
+        workers=int(os.getenv("WORKERS", "1"))
     )
-
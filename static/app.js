@@ -112,7 +112,7 @@ async function loadDataStatus() {
             if (data.data_sources && data.data_sources.length > 0) {
                 html += '<hr class="my-3"><h6 class="mt-3 mb-2">数据源统计</h6>';
                 html += '<div class="table-responsive"><table class="table table-sm table-bordered table-hover">';
-                html += '<thead class="table-light"><tr><th>数据源</th><th>数据量</th><th>股票数</th><th>最新日期</th></tr></thead><tbody>';
+                html += '<thead class="table-light"><tr><th>数据源</th><th>数据量</th><th>股票数</th><th>最新日期</th><th>更新时间</th></tr></thead><tbody>';
                 
                 data.data_sources.forEach(source => {
                     html += `<tr>
@@ -120,6 +120,7 @@ async function loadDataStatus() {
                         <td>${source.data_count.toLocaleString()}</td>
                         <td>${source.stock_count}</td>
                         <td>${source.latest_date || '无'}</td>
+                        <td>${formatDateTime(source.updated_at) || '无'}</td>
                     </tr>`;
                 });
                 
@@ -157,7 +158,7 @@ async function updateData(type) {
             if (modeRadio && modeRadio.value === 'overwrite') {
                 overwrite_mode = true;
                 // 确认覆盖模式
-                if (!confirm('覆盖模式将删除当前数据源的所有数据，然后重新获取。\n\n此操作不可恢复，确定要继续吗？')) {
+                if (!confirm('覆盖模式将重新获取当前数据源的所有数据，获取完成后替换原有数据。\n\n确定要继续吗？')) {
                     return;
                 }
             }